@@ -1,141 +1,77 @@
+import time
+STARTUP_STARTED = time.perf_counter()  # Startup timeline origin, taken before the heavy imports
+import os
 import sys
-import requests
+import random
+import csv
+import json
+import functools
+import itertools
+import threading
+import contextlib
+from collections import OrderedDict, deque
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
-                             QHBoxLayout, QLabel, QPushButton, QTextEdit,
+                             QHBoxLayout, QLabel, QPushButton, QTextEdit, QPlainTextEdit,
                              QComboBox, QMessageBox, QFrame, QSlider, QFileDialog,
                              QStatusBar, QSplitter, QSizePolicy, QSpinBox, 
                              QGroupBox, QProgressBar, QShortcut, QScrollArea,
-                             QCheckBox, QTabWidget)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QSize, QTimer
-from PyQt5.QtGui import QFont, QTextCursor, QKeySequence
+                             QCheckBox, QTabWidget, QListWidget, QPlainTextDocumentLayout)
+from PyQt5.QtCore import QObject, QThread, pyqtSignal, Qt, QSize, QTimer
+from PyQt5.QtGui import QFont, QTextCursor, QKeySequence, QTextDocument
 
-# Try to import docx for .doc support
-try:
-    from docx import Document
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
+from ai_writer_core import (
+    requests,
+    OLLAMA_HOSTS, DEFAULT_TOKEN_LIMIT, DEFAULT_TEMPERATURE, DEFAULT_CONTEXT_CHARS,
+    DEFAULT_NUM_CTX, FALLBACK_MODEL_CONTEXT, PROMPT_SAFETY_TOKENS, SERVER_PARALLEL_SLOTS, CACHE_DIR,
+    DEFAULT_EMBED_MODEL, RETRIEVAL_TOP_K, RETRIEVAL_QUERY_CHARS, NUMPY_AVAILABLE,
+    GENRE_INSTRUCTIONS, SUMMARY_INSTRUCTION, ROLLUP_INSTRUCTION, SUMMARY_FANOUT, SUMMARY_TOKEN_LIMIT,
+    SUMMARY_CHUNK_MIN_CHARS, SUMMARY_CHUNK_MAX_CHARS, MODEL_CONTEXT_LENGTHS, get_ollama_client,
+    may_end_summary_chunk, split_summary_chunks, SummaryCache, CompletionCache,
+    ModelListCache, load_model,
+    HashingEmbeddingBackend, OllamaEmbeddingBackend, EmbeddingIndex, Project, AutosaveJournal, utf16_len,
+    estimate_tokens,
+    EXPORTERS, export_document, ExportCancelled, import_chunks, import_pieces, generation_metrics, stable_context_start,
+    Generation, GenerationCancelled, PRIORITY_BACKGROUND, RequestDropped)
 
 # --- Configuration ---
-OLLAMA_URL = "http://localhost:11434"
-DEFAULT_TOKEN_LIMIT = 40
-DEFAULT_TEMPERATURE = 0.8
-DEFAULT_CONTEXT_CHARS = 2000  # How many previous characters to include in context
-
-# --- Improved Genre Instructions ---
-GENRE_INSTRUCTIONS = {
-    "Neutral": """You are an expert storywriter. Your task is to continue the provided text seamlessly.
-ANALYZE: Study the tone, vocabulary, sentence structure, and pacing of the existing text.
-MATCH: Mimic the writing style exactly. Do not shift to a more formal or casual tone.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. No introductions, no summaries, no moralizing, and no meta-commentary.""",
-    "Erotic": """You are an erotic  writer. Continue the text with sensual themes and intimacy and anything goses.
-FOCUS: Desire, physical connection, lust, and sex.
-STYLE: Sensory-rich language, focusing on deitels, feeling, and atmosphere.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain the heat level of the existing text. No meta-commentary.""",
-    "Dramatic": """You are a dramatic novelist. Continue the text with high emotional intensity.
-FOCUS: Conflict, strong feelings, interpersonal tension, and stakes.
-STYLE: Use evocative language, internal monologue, and charged dialogue.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Do not resolve the conflict immediately; maintain the tension. No meta-commentary.""",
-    "Action": """You are an action thriller writer. Continue the text with fast-paced energy.
-FOCUS: Physical movement, kinetics, adrenaline, and immediate danger.
-STYLE: Use strong verbs, short punchy sentences, and sensory details (sound, impact).
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Keep the pace moving. No long introspections. No meta-commentary.""",
-    "Horror": """You are a horror author. Continue the text building dread and atmosphere.
-FOCUS: Fear, the unknown, psychological tension, and unsettling imagery.
-STYLE: Slow pacing, descriptive shadows, sounds, and feelings of unease.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Do not reveal the monster/threat too quickly. No meta-commentary.""",
-    "Romantic": """You are a romance novelist. Continue the text focusing on relationships and emotion.
-FOCUS: Chemical connection, intimacy, longing, and emotional vulnerability.
-STYLE: Warm, sensory, and character-driven language.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Focus on the dynamic between characters. No meta-commentary.""",
-    "Thriller": """You are a thriller writer. Continue the text with suspense and high stakes.
-FOCUS: Plot twists, urgency, danger, and clever maneuvering.
-STYLE: Tight pacing, cliffhangers, and limited perspective.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Keep the reader guessing. No meta-commentary.""",
-    "Comedy": """You are a comedy writer. Continue the text with humor and wit.
-FOCUS: Timing, irony, absurdity, or character quirks.
-STYLE: Lighthearted, playful, and engaging.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Do not explain the jokes. No meta-commentary.""",
-    "SciFi": """You are a science fiction author. Continue the text with futuristic or technological themes.
-FOCUS: Science, technology, space, or speculative society elements.
-STYLE: Precise terminology, world-building consistency, and logical extrapolation.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain established lore. No meta-commentary.""",
-    "Fantasy": """You are a fantasy author. Continue the text with magical or mythical elements.
-FOCUS: Magic systems, mythical creatures, quests, or supernatural forces.
-STYLE: Epic, descriptive, and immersive language.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain established magic rules. No meta-commentary.""",
-    "Crime": """You are a crime fiction writer. Continue the text focusing on criminal activity or investigation.
-FOCUS: Detectives, criminals, motives, evidence, or underworld dynamics.
-STYLE: Gritty, realistic, or procedural depending on the text's tone.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. No meta-commentary.""",
-    "Mystery": """You are a mystery writer. Continue the text by introducing or developing clues.
-FOCUS: Enigmas, puzzles, hidden information, and deduction.
-STYLE: Careful pacing, red herrings, and observational details.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Do not solve the mystery immediately. No meta-commentary.""",
-    "Suspense": """You are a suspense writer. Continue the text building anxiety and anticipation.
-FOCUS: Ticking clocks, impending doom, and uncertainty.
-STYLE: Withholding information, focusing on character worry, and environmental tension.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. No meta-commentary.""",
-    "Afrofuturism": """You are an Afrofuturism writer. Continue the text blending African diaspora culture with technology and futurism.
-FOCUS: African aesthetics, mythology, technology, liberation, and cultural identity.
-STYLE: Rich cultural references, vibrant imagery, and speculative elements rooted in African traditions.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Honor cultural authenticity. No meta-commentary.""",
-    "Steampunk": """You are a steampunk author. Continue the text with Victorian-era aesthetics and steam-powered technology.
-FOCUS: Gears, brass, steam engines, Victorian fashion, and industrial revolution elements.
-STYLE: Ornate descriptions, period-appropriate language, and imaginative machinery.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain historical-futuristic blend. No meta-commentary.""",
-    "Cyberpunk": """You are a cyberpunk writer. Continue the text with high-tech, low-life themes.
-FOCUS: Corporate dominance, cybernetics, hackers, neon-lit cities, and dystopian society.
-STYLE: Gritty, noir-influenced, tech-heavy vocabulary, and urban atmosphere.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain the dark futuristic tone. No meta-commentary.""",
-    "Futuristic": """You are a futuristic fiction writer. Continue the text with advanced technology and future society elements.
-FOCUS: Space travel, AI, advanced weapons, future politics, and human evolution.
-STYLE: Clean, forward-thinking language with speculative technology descriptions.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain consistency with established future setting. No meta-commentary.""",
-    "Modern": """You are a contemporary fiction writer. Continue the text with realistic, present-day settings and themes.
-FOCUS: Current social issues, everyday life, modern relationships, and realistic scenarios.
-STYLE: Natural dialogue, relatable situations, and current cultural references.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Keep it grounded in reality. No meta-commentary.""",
-    "Historical Fiction": """You are a historical fiction author. Continue the text with accurate period details and settings.
-FOCUS: Historical accuracy, period-appropriate language, customs, and social norms.
-STYLE: Immersive world-building that reflects the chosen time period authentically.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain historical consistency. No anachronisms. No meta-commentary.""",
-    "Philosophy": """You are a philosophical writer. Continue the text exploring deep questions about existence, ethics, and meaning.
-FOCUS: Abstract concepts, moral dilemmas, consciousness, truth, and human nature.
-STYLE: Thoughtful, reflective, and intellectually engaging prose.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Weave philosophy into narrative naturally. No meta-commentary.""",
-    "Dieselpunk": """You are a dieselpunk author. Continue the text with interwar-era aesthetics and diesel-powered technology.
-FOCUS: 1920s-1950s aesthetics, heavy machinery, art deco, war machines, and industrial power.
-STYLE: Gritty, mechanical descriptions, period slang, and noir influences.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain the diesel-age atmosphere. No meta-commentary.""",
-    "Biopunk": """You are a biopunk writer. Continue the text with biotechnology and genetic engineering themes.
-FOCUS: DNA manipulation, bio-engineering, corporate biotech, mutations, and organic technology.
-STYLE: Clinical yet visceral descriptions, scientific terminology, and body horror elements.
-CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
-CONSTRAINTS: Output RAW TEXT ONLY. Maintain the bio-tech dystopian tone. No meta-commentary."""
+DEFAULT_STREAMING = True  # Show the completion in the editor while it is being generated
+STREAM_FLUSH_INTERVAL_MS = 33  # Streamed text is batched into the editor about 30 times per second
+DEFAULT_KV_REUSE = True  # Send Ollama's context tokens back when the document was only appended to
+DEFAULT_CHAT_PROMPT = False  # Use /api/chat with a prompt prefix that stays the same between generations
+DEFAULT_CANDIDATES = 1  # Continuations generated side by side per Ctrl+Enter (1 = insert directly)
+CANDIDATE_TEMPERATURE_SPREAD = 0.2  # Candidates span temperature ± this when spreading is on
+DEFAULT_WARMUP = False  # Pre-evaluate the next prompt while the writer is idle
+DEFAULT_WARMUP_IDLE_SECONDS = 2  # Typing pause before the warm-up request is sent
+DEFAULT_SEED = 0  # Fixed sampling seed for reproducible completions (0 = random)
+DEFAULT_GENERATION_DEADLINE = 0  # Seconds before a generation is stopped (0 = no limit)
+DEFAULT_MIN_TOKENS_PER_SECOND = 0  # Stop generations slower than this once they are running (0 = off)
+DEFAULT_KEEP_PARTIAL = True  # Keep text that was already generated when a generation is stopped
+STATS_REFRESH_DELAY_MS = 150  # Status bar counts refresh once typing pauses for this long
+DEFAULT_ROLLING_SUMMARY = False  # Summarise text older than the context window in the background
+MEMORY_IDLE_MS = 4000  # Typing pause before the summary and retrieval index are brought up to date
+DEFAULT_RETRIEVAL = False  # Add earlier passages similar to the current text to the prompt
+LOCAL_EMBEDDINGS_LABEL = "Built-in (offline)"  # Hashing embeddings that need no model
+DEFAULT_AUTOSAVE = True  # Journal every edit to CACHE_DIR/autosave so a crash loses at most a second of work
+AUTOSAVE_INTERVAL_MS = 1000  # How often queued edits are written
+EXPORT_DIALOGS = {  # Format -> save dialog caption and file filter
+    'txt': ("Save as TXT", "Text Files (*.txt)"),
+    'md': ("Export as Markdown", "Markdown Files (*.md)"),
+    'docx': ("Save as DOCX", "Word Documents (*.docx)"),
+    'epub': ("Export as EPUB", "EPUB Books (*.epub)"),
 }
+IMPORT_SLICE_MS = 8  # UI-thread time per event-loop turn spent inserting an opened document
+IMPORT_READ_AHEAD = 4  # Pieces the reading thread may get ahead of the editor (it waits without the GIL)
+DOCUMENT_READ_SLICE = 262144  # Characters a worker's DocumentReader copies per event-loop turn
+DOCUMENT_READ_RETRIES = 3  # Restarts after edits during a read before the rest is copied in one turn
+PROJECT_OPEN_CHAPTERS = 3  # Unmodified chapter documents kept loaded; the rest are read from disk when needed
+MODEL_PLACEHOLDERS = ("Select model...", "No models found", "Scanning...")  # Combo entries that aren't models
+DEFAULT_KEEP_ALIVE_MINUTES = 30  # How long Ollama keeps the selected model in memory (0 = server default)
+RESIDENT_POLL_MS = 15000  # How often every Ollama host is probed for health and /api/ps
+MODEL_CACHE_KEY = ",".join(OLLAMA_HOSTS)  # The last model list is remembered per set of hosts
+QUEUE_STATUS_MS = 250  # How often the status bar shows the Ollama request queue
+STARTUP_FALLBACK_MS = 1000  # Start the model scan even if no paint event arrives (e.g. started minimized)
+STARTUP_REPORT = "--startup-report" in sys.argv  # Print startup milestones to stderr
 
 # --- Modern Stylesheets ---
 STYLES = {
@@ -182,7 +118,7 @@ STYLES = {
     }
     QPushButton#memory-btn:hover { background-color: #e68600; }
 
-    QTextEdit#editor { 
+    QPlainTextEdit#editor { 
         background-color: #ffffff; 
         border: none; 
         padding: 30px 40px; 
@@ -192,8 +128,8 @@ STYLES = {
         color: #1a1a1a;
         selection-background-color: #b3d7ff;
     }
-    QTextEdit#editor:focus { outline: none; }
-    QTextEdit#editor:disabled { background-color: #fafafa; color: #999; }
+    QPlainTextEdit#editor:focus { outline: none; }
+    QPlainTextEdit#editor:disabled { background-color: #fafafa; color: #999; }
     
     QTextEdit#memory-view { 
         background-color: #f5f5f7; 
@@ -317,7 +253,7 @@ STYLES = {
     }
     QPushButton#memory-btn:hover { background-color: #b45309; }
 
-    QTextEdit#editor { 
+    QPlainTextEdit#editor { 
         background-color: #1e1e1e; 
         border: none; 
         padding: 30px 40px; 
@@ -327,8 +263,8 @@ STYLES = {
         color: #d4d4d4;
         selection-background-color: #264f78;
     }
-    QTextEdit#editor:focus { outline: none; }
-    QTextEdit#editor:disabled { background-color: #1a1a1a; color: #666; }
+    QPlainTextEdit#editor:focus { outline: none; }
+    QPlainTextEdit#editor:disabled { background-color: #1a1a1a; color: #666; }
     
     QTextEdit#memory-view { 
         background-color: #2d2d30; 
@@ -412,94 +348,745 @@ STYLES = {
 }
 
 class OllamaWorker(QThread):
+    """Runs a model scan, a Generation or a warm-up off the UI thread and reports through signals"""
     finished = pyqtSignal(str)
+    partial = pyqtSignal(str)
     error = pyqtSignal(str)
     models_loaded = pyqtSignal(list)
     progress = pyqtSignal(int)
+    stats = pyqtSignal(dict)
+    kv_context = pyqtSignal(list)
+    cancelled = pyqtSignal(str, str)
+    warmed = pyqtSignal(str)
+    model_ready = pyqtSignal(str, float)
+    resident_models = pyqtSignal(list)
 
     def __init__(self, endpoint, model=None, prompt=None, context=None, temperature=0.7, 
-                 token_limit=140, genre="Neutral", memory_summary=None):
+                 token_limit=140, genre="Neutral", memory_summary=None, stream=False, client=None,
+                 kv_tokens=None, deadline=0, min_tokens_per_second=0, retriever=None,
+                 num_ctx_limit=None, seed=None, warmup=False, cache=None, keep_alive=None, chat=False):
         super().__init__()
+        self.client = client or get_ollama_client()
         self.endpoint = endpoint
         self.model = model
-        self.prompt = prompt
-        self.context = context
-        self.temperature = temperature
-        self.token_limit = token_limit
-        self.genre = genre
-        self.memory_summary = memory_summary
+        self.keep_alive = keep_alive
+        self.warmup = warmup
+        self.generation = None
+        if endpoint == "generate":
+            # `stream` only decides whether partial text is emitted
+            self.generation = Generation(
+                model, prompt=prompt, context=context, temperature=temperature, token_limit=token_limit,
+                genre=genre, memory_summary=memory_summary, client=self.client, kv_tokens=kv_tokens,
+                deadline=deadline, min_tokens_per_second=min_tokens_per_second, retriever=retriever,
+                num_ctx_limit=num_ctx_limit, seed=seed, cache=cache, keep_alive=keep_alive, chat=chat,
+                on_partial=self.partial.emit if stream else None,
+                on_stats=self.stats.emit, on_kv_context=self.kv_context.emit)
 
     def run(self):
         try:
             if self.endpoint == "scan":
-                response = requests.get(f"{OLLAMA_URL}/api/tags", timeout=5)
-                if response.status_code == 200:
-                    data = response.json()
-                    models = [m['name'] for m in data.get('models', [])]
-                    self.models_loaded.emit(models)
-                else:
-                    self.error.emit(f"API Error: {response.status_code}")
+                # Every host is asked; the list holds each model once
+                self.models_loaded.emit(self.client.list_models())
             
-            elif self.endpoint == "generate":
-                system_instruction = GENRE_INSTRUCTIONS.get(self.genre, GENRE_INSTRUCTIONS["Neutral"])
-                
-                # Build prompt with memory context
-                prompt_parts = [system_instruction]
-                
-                if self.memory_summary:
-                    prompt_parts.append(f"\n\n### STORY SUMMARY (Memory) ###\n{self.memory_summary}\n")
-                
-                if self.context:
-                    prompt_parts.append(f"\n\n### PREVIOUS CONTEXT ###\n{self.context}\n")
-                
-                prompt_parts.append(f"\n\n### CURRENT TEXT ###\n{self.prompt}\n")
-                prompt_parts.append(f"\n### CONTINUATION ###\n")
-                
-                full_prompt = "".join(prompt_parts)
+            elif self.endpoint == "load":
+                started = time.perf_counter()
+                load_model(self.client, self.model, self.keep_alive)
+                self.model_ready.emit(self.model, time.perf_counter() - started)
             
-                payload = {
-                    "model": self.model,
-                    "prompt": full_prompt,
-                    "stream": False,
-                    "options": {
-                        "num_predict": self.token_limit,
-                        "temperature": self.temperature
-                    }
-                }
-                response = requests.post(f"{OLLAMA_URL}/api/generate", json=payload, timeout=120)
-                if response.status_code == 200:
-                    data = response.json()
-                    completion = data.get('response', '')
-                    cleaned = self.clean_completion(self.prompt, completion)
-                    self.finished.emit(cleaned)
-                else:
-                    self.error.emit(f"Generation Error: {response.status_code}")
+            elif self.endpoint == "ps":
+                self.resident_models.emit(self.client.resident_models())
+            
+            elif self.warmup:
+                self.warmed.emit(self.generation.warm_up())
+            
+            elif self.endpoint == "generate":
+                self.finished.emit(self.generation.run())
+        except GenerationCancelled as e:
+            self.cancelled.emit(e.partial_text, e.reason)
+        except requests.exceptions.ConnectionError:
+            self.fail("Cannot connect to Ollama. Is it running?")
+        except requests.exceptions.Timeout:
+            self.fail("Ollama did not respond in time.")
+        except Exception as e:
+            self.fail(str(e))
+
+    def fail(self, message):
+        # Aborting the connection surfaces as an exception; that is a cancel, not an error
+        if self.cancel_reason:
+            self.cancelled.emit(self.partial_text(), self.cancel_reason)
+        else:
+            self.error.emit(message)
+
+    @property
+    def cancel_reason(self):
+        return self.generation.cancel_reason if self.generation else None
+
+    @property
+    def passages(self):
+        return self.generation.passages if self.generation else []
+
+    def cancel(self, reason="Stopped"):
+        if self.generation:
+            self.generation.cancel(reason)
+
+    def partial_text(self):
+        return self.generation.partial_text() if self.generation else ""
+
+
+def common_affix_lengths(old, new):
+    """Return (prefix, suffix) lengths shared by two strings without overlapping"""
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, lo
+
+
+def document_end(document):
+    """Position after the last character (characterCount() includes the final paragraph separator)"""
+    return document.characterCount() - 1
+
+
+def document_text(document, start, end=None):
+    """Plain text between two document positions, copying only that range"""
+    cursor = QTextCursor(document)
+    cursor.setPosition(max(0, start))
+    cursor.setPosition(document_end(document) if end is None else end, QTextCursor.KeepAnchor)
+    # selectedText() marks block ends with U+2029 and keeps non-breaking spaces; toPlainText() does neither
+    return cursor.selectedText().replace("\u2029", "\n").replace("\u00a0", " ")
+
+
+def document_tail(document, max_chars):
+    """Return the last `max_chars` characters of a QTextDocument's plain text.
+
+    Walks blocks backwards from the end, so only the tail is copied.
+    """
+    parts = []
+    size = -1  # No newline before the first block collected
+    block = document.lastBlock()
+    while block.isValid() and size < max_chars:
+        text = block.text()
+        parts.append(text)
+        size += len(text) + 1
+        block = block.previous()
+    tail = "\n".join(reversed(parts))
+    return tail[-max_chars:] if max_chars > 0 else ""
+
+
+class DocumentReader(QObject):
+    """Reads a QTextDocument for a worker thread, to pass as a source text callable.
+
+    QTextDocument may only be touched on the UI thread, so calling the reader
+    from a worker asks the UI thread for the text a slice of whole blocks at a
+    time (DOCUMENT_READ_SLICE characters per event-loop turn) instead of
+    copying the whole document in one go. A read that sees the document change
+    starts over. `revision` is the document revision the text was read at,
+    and with `keep` the text stays in `text` afterwards. cancel() makes a
+    waiting read raise ExportCancelled.
+    """
+    requested = pyqtSignal(int, int)
+
+    def __init__(self, document, keep=False):
+        super().__init__()
+        self.document = document
+        self.keep = keep
+        self.text = None
+        self.revision = None
+        self.answer = None
+        self.answered = threading.Event()
+        self.cancel_requested = False
+        self.requested.connect(self.copy_slice)  # Emitted from the worker, so queued to the UI thread
+
+    def cancel(self):
+        self.cancel_requested = True
+        self.answered.set()
+
+    def copy_slice(self, start, size):
+        try:
+            block = self.document.findBlock(start)
+            parts = []
+            count = 0
+            while block.isValid() and (size <= 0 or count < size):
+                text = block.text()
+                parts.append(text)
+                count += len(text) + 1
+                block = block.next()
+            end = block.position() if block.isValid() else None
+            # toPlainText() turns non-breaking spaces into plain ones; block.text() keeps them
+            self.answer = ("\n".join(parts).replace("\u00a0", " "), end, self.document.revision())
+        except RuntimeError as e:  # The document was deleted
+            self.answer = e
+        self.answered.set()
+
+    def __call__(self):
+        parts = []
+        start = retries = 0
+        revision = None
+        while True:
+            self.answered.clear()
+            if self.cancel_requested:
+                raise ExportCancelled()
+            self.requested.emit(start, DOCUMENT_READ_SLICE if retries < DOCUMENT_READ_RETRIES else 0)
+            self.answered.wait()
+            if self.cancel_requested:
+                raise ExportCancelled()
+            if isinstance(self.answer, Exception):
+                raise self.answer
+            text, end, slice_revision = self.answer
+            self.answer = None
+            if revision is not None and slice_revision != revision:
+                # Edited between two slices: positions have moved, so start over
+                parts = []
+                retries += 1
+                revision = None
+                start = 0
+                continue
+            revision = slice_revision
+            parts.append(text)
+            if end is None:
+                break
+            start = end
+        self.revision = revision
+        text = "\n".join(parts)
+        if self.keep:
+            self.text = text
+        return text
+
+
+class SummaryWorker(QThread):
+    """Builds a hierarchical summary of the text that lies before the context window.
+
+    `chunks` are the (key, text, summary) of SummaryChunks.chunks(): each chunk
+    of the text is summarised once and cached by content hash, so the UI thread
+    only passes the text of chunks without a cached summary. The summaries are
+    then combined SUMMARY_FANOUT at a time until a single rollup remains. Only
+    new or edited chunks, and the branches above them, cost an Ollama call.
+    """
+    summary_ready = pyqtSignal(str, dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, model, chunks, cache, client=None):
+        super().__init__()
+        self.client = client or get_ollama_client()
+        self.model = model
+        self.chunks = chunks
+        self.cache = cache
+        self.cancelled = False
+        self.calls = 0
+        self.cache_hits = 0
+
+    def cancel(self):
+        self.cancelled = True
+        self.client.drop(self)
+
+    def run(self):
+        try:
+            level = 0
+            summaries = [summary if summary is not None else self.summarize(SUMMARY_INSTRUCTION, text, level, key)
+                         for key, text, summary in self.chunks if not self.cancelled]
+            self.cache_hits += sum(summary is not None for _, _, summary in self.chunks)
+            while len(summaries) > 1 and not self.cancelled:
+                level += 1
+                groups = [summaries[i:i + SUMMARY_FANOUT] for i in range(0, len(summaries), SUMMARY_FANOUT)]
+                summaries = [self.summarize(ROLLUP_INSTRUCTION, "\n\n".join(group), level)
+                             if len(group) > 1 else group[0]
+                             for group in groups if not self.cancelled]
+            self.cache.save()
+            if self.cancelled:
+                return
+            self.summary_ready.emit(summaries[0] if summaries else "", {
+                'chunks': len(self.chunks),
+                'levels': level + 1,
+                'calls': self.calls,
+                'cached': self.cache_hits,
+            })
+        except RequestDropped:
+            pass  # Cancelled while it waited for a free slot
         except requests.exceptions.ConnectionError:
             self.error.emit("Cannot connect to Ollama. Is it running?")
         except Exception as e:
             self.error.emit(str(e))
 
-    def clean_completion(self, original, completion):
-        original_stripped = original.strip()
-        completion_stripped = completion.strip()
+    def summarize(self, instruction, text, level, key=None):
+        key = key or self.cache.key(self.model, level, text)
+        summary = self.cache.get(key)
+        if summary is not None:
+            self.cache_hits += 1
+            return summary
+        
+        payload = {
+            "model": self.model,
+            "prompt": f"{instruction}\n\n### TEXT ###\n{text}\n\n### SUMMARY ###\n",
+            "stream": False,
+            "options": {"num_predict": SUMMARY_TOKEN_LIMIT, "temperature": 0.2}
+        }
+        response = self.client.post("/api/generate", json=payload, priority=PRIORITY_BACKGROUND, owner=self)
+        if response.status_code != 200:
+            raise RuntimeError(f"Summary Error: {response.status_code}")
+        self.calls += 1
+        summary = response.json().get('response', '').strip()
+        self.cache.put(key, summary)
+        return summary
 
-        if completion_stripped.startswith(original_stripped):
-            completion_stripped = completion_stripped[len(original_stripped):].strip()
 
-        prefixes = [
-            "here's the continuation: ", "continuation: ", "continued: ", 
-            "here is the completion: ", "here's the completion: ",
-            "the continuation is: ", "completion: ", "### Continuation ###",
-            "### CONTINUATION ###"
-        ]
-        for prefix in prefixes:
-            if completion_stripped.lower().startswith(prefix):
-                completion_stripped = completion_stripped[len(prefix):].strip()
+class RetrievalWorker(QThread):
+    """Brings an EmbeddingIndex up to date with the document, or every chapter of a project, in the background.
+
+    `sources` holds (source, text, signature) tuples. Text and signature may be
+    callables, so chapters are only read here, and only if their signature changed.
+    """
+    index_ready = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, index, backend, sources):
+        super().__init__()
+        self.index = index
+        self.backend = backend
+        self.sources = sources
+
+    def run(self):
+        try:
+            started = time.perf_counter()
+            embedded = updated = 0
+            new_signatures = False
+            for source, text, signature in self.sources:
+                if callable(signature):
+                    signature = signature()
+                if self.index.is_current(source, signature, self.backend):
+                    continue
+                embedded += self.index.update(text() if callable(text) else text, self.backend, source, signature)
+                updated += 1
+                new_signatures = new_signatures or signature is not None
+            removed = self.index.retain_sources({source for source, _, _ in self.sources})
+            if embedded or removed or new_signatures:
+                self.index.save()
+            self.index_ready.emit({
+                'paragraphs': len(self.index),
+                'embedded': embedded,
+                'sources': updated,
+                'seconds': time.perf_counter() - started,
+            })
+        except requests.exceptions.ConnectionError:
+            self.error.emit("Cannot connect to Ollama. Is it running?")
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class ExportWorker(QThread):
+    """Streams a document to a file with export_document, reporting progress in percent"""
+    progress = pyqtSignal(int)
+    exported = pyqtSignal(dict)
+    cancelled = pyqtSignal()
+    error = pyqtSignal(str)
+
+    def __init__(self, path, format, sources, title):
+        super().__init__()
+        self.path = path
+        self.format = format
+        self.sources = sources
+        self.title = title
+        self.cancel_requested = False
+
+    def cancel(self):
+        self.cancel_requested = True
+        for _, text in self.sources:
+            if isinstance(text, DocumentReader):
+                text.cancel()  # It may be waiting for the UI thread, which may be waiting for this thread
+
+    def run(self):
+        try:
+            started = time.perf_counter()
+            stats = export_document(self.path, self.format, self.sources, self.title,
+                                    progress=lambda fraction: self.progress.emit(int(fraction * 100)),
+                                    cancelled=lambda: self.cancel_requested)
+            stats['seconds'] = time.perf_counter() - started
+            self.exported.emit(stats)
+        except ExportCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.error.emit(str(e))
+
+
+class ImportWorker(QThread):
+    """Reads a .txt, .md or .docx file in the background and hands it over in pieces of whole lines.
+
+    Each piece comes with the (characters, words) of its lines for
+    DocumentStats. The window calls piece_inserted() for every piece it has
+    put in the editor; reading stays IMPORT_READ_AHEAD pieces ahead, so the
+    parser doesn't hold the GIL while the UI thread inserts. With
+    `index_path`, each piece also goes to the retrieval index as it is read;
+    the text is never held here as a whole.
+    """
+    chunk = pyqtSignal(str, object)
+    progress = pyqtSignal(int)
+    imported = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, path, index_path=None, backend=None):
+        super().__init__()
+        self.path = path
+        self.index_path = index_path
+        self.backend = backend
+        self.room = threading.Semaphore(IMPORT_READ_AHEAD)
+        self.cancel_requested = False
+        self.read_error = None
+
+    def piece_inserted(self):
+        self.room.release()
+
+    def cancel(self):
+        self.cancel_requested = True
+        self.room.release()
+
+    def read(self, result):
+        """Hand each piece to the window and yield it; counts lines and characters into `result`"""
+        started = time.perf_counter()
+        try:
+            for text, counts, fraction in import_chunks(self.path):
+                self.room.acquire()
+                if self.cancel_requested:
+                    return
+                result['lines'] += len(counts)
+                result['chars'] += sum(chars for chars, _ in counts) + len(counts)
+                self.chunk.emit(text, counts)
+                self.progress.emit(int(fraction * 100))
+                yield text
+        except Exception as e:
+            self.read_error = e
+        result['seconds'] = time.perf_counter() - started
+
+    def run(self):
+        started = time.perf_counter()
+        result = {'lines': 0, 'chars': -1}  # Lines are joined by one newline each
+        pieces = self.read(result)
+        if self.index_path is not None:
+            try:
+                index = EmbeddingIndex(self.index_path)
+                result['embedded'] = index.update(pieces, self.backend)
+                result['index'] = index
+            except requests.exceptions.ConnectionError:
+                result['index_error'] = "Cannot connect to Ollama. Is it running?"
+            except Exception as e:
+                result['index_error'] = str(e)
+        for _ in pieces:
+            pass  # Without an index, or once indexing failed, the rest is only read
+        if self.read_error is not None:
+            self.error.emit(str(self.read_error))
+            return
+        if self.cancel_requested:
+            return
+        if 'index' in result:
+            try:
+                result['index'].save()
+            except OSError as e:
+                result['index_error'] = str(e)
+        result['total_seconds'] = time.perf_counter() - started
+        self.imported.emit(result)
+
+
+class AutosaveWorker(QThread):
+    """Writes edits to the autosave journals, away from the UI thread.
+
+    The UI thread only queues (operation, key, payload) tuples. Every
+    AUTOSAVE_INTERVAL_MS, or right away after flush(), the queue is drained and
+    each document's edits are appended to its AutosaveJournal with one write;
+    journals that have grown are compacted into a new snapshot.
+    """
+    saved = pyqtSignal(dict)
+    error = pyqtSignal(str)
+
+    def __init__(self, directory):
+        super().__init__()
+        self.directory = directory
+        self.queue = deque()  # Appends and pops are atomic, so no lock is needed
+        self.wake = threading.Event()
+        self.stopping = False
+        self.discard_on_stop = False
+        self.journals = {}
+
+    def track(self, key, text, meta):
+        """Start (or restart, after a save) the journal of a document from its current text"""
+        self.queue.append(('start', key, (text, meta)))
+
+    def edit(self, key, position, removed, added):
+        self.queue.append(('edit', key, (position, removed, added)))
+
+    def forget(self, key):
+        self.queue.append(('discard', key, None))
+
+    def flush(self):
+        self.wake.set()
+
+    def stop(self, discard=False):
+        """Write what is queued and end the thread; `discard` deletes the journals (a clean exit)"""
+        self.discard_on_stop = discard
+        self.stopping = True
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(AUTOSAVE_INTERVAL_MS / 1000)
+            self.wake.clear()
+            stopping = self.stopping
+            try:
+                self.write_queued()
+            except OSError as e:
+                self.error.emit(str(e))
+            if stopping:
+                break
+        for journal in self.journals.values():
+            if self.discard_on_stop:
+                journal.discard()
+            else:
+                journal.close()
+
+    def write_queued(self):
+        started = time.perf_counter()
+        pending = {}  # key -> edits not yet written
+        edits = written = compacted = 0
+        while self.queue:
+            operation, key, payload = self.queue.popleft()
+            if operation == 'edit':
+                pending.setdefault(key, []).append(payload)
+                edits += 1
+                continue
+            # Edits queued before a restart or discard belong to the old journal
+            if key in pending and key in self.journals:
+                written += self.journals[key].append(pending.pop(key))
+            if operation == 'start':
+                journal = self.journals.setdefault(key, AutosaveJournal(self.directory, key))
+                journal.start(*payload)
+            else:
+                journal = self.journals.pop(key, None)
+                if journal is not None:
+                    journal.discard()
+        for key, key_edits in pending.items():
+            if key in self.journals:
+                written += self.journals[key].append(key_edits)
+        for journal in self.journals.values():
+            if journal.generation >= 0 and journal.needs_compaction():
+                journal.compact()
+                compacted += 1
+        if edits:
+            self.saved.emit({'edits': edits, 'bytes': written, 'compacted': compacted,
+                             'seconds': time.perf_counter() - started})
+
+
+def edited_blocks(document, position, added, known_blocks):
+    """Blocks a contentsChange touched, as (first, last, old_last).
 
-        if completion_stripped.startswith('"') and not original_stripped.endswith('"'):
-            completion_stripped = completion_stripped[1:].strip()
+    Blocks first..last now hold the edit; they replace blocks first..old_last
+    of the `known_blocks` there were before it. None if the edit doesn't fit
+    that count, and the whole document has to be read again.
+    """
+    last_position = max(0, document.characterCount() - 1)
+    first = document.findBlock(min(position, last_position)).blockNumber()
+    last = document.findBlock(min(position + added, last_position)).blockNumber()
+    old_last = last - (document.blockCount() - known_blocks)
+    if first < 0 or old_last < first - 1 or old_last >= known_blocks:
+        return None
+    return first, last, old_last
+
+
+class DocumentStats:
+    """Character and word counts of a QTextDocument, updated from contentsChange deltas.
+
+    Counts are cached per block, so an edit only recounts the blocks it touched
+    instead of copying and splitting the whole document on every keystroke.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.block_counts = []  # (chars, words) for every block, in document order
+        self.chars = 0
+        self.words = 0
+        self.supplied = None
+        self.rebuild()
+        document.contentsChange.connect(self.on_contents_change)
+
+    @staticmethod
+    def count_block(block):
+        text = block.text()
+        return len(text), len(text.split())
+
+    def rebuild(self):
+        self.block_counts = []
+        block = self.document.begin()
+        while block.isValid():
+            self.block_counts.append(self.count_block(block))
+            block = block.next()
+        self.chars = sum(c for c, _ in self.block_counts)
+        self.words = sum(w for _, w in self.block_counts)
+
+    def supply(self, counts):
+        """Counts of the blocks the next edit adds after the block it starts in, so they aren't read back.
+
+        Opening a file counts its lines while parsing them in the background;
+        appending them then only recounts the block the text is appended to.
+        """
+        self.supplied = counts
+
+    def on_contents_change(self, position, removed, added):
+        supplied, self.supplied = self.supplied, None
+        edit = edited_blocks(self.document, position, added, len(self.block_counts))
+        if edit is None:
+            self.rebuild()
+            return
+        
+        first, last, old_last = edit
+        block = self.document.findBlockByNumber(first)
+        if supplied is not None and len(supplied) == last - first:
+            new_counts = [self.count_block(block)] + supplied
+        else:
+            new_counts = []
+            for _ in range(first, last + 1):
+                new_counts.append(self.count_block(block))
+                block = block.next()
+        
+        old_counts = self.block_counts[first:old_last + 1]
+        self.chars += sum(c for c, _ in new_counts) - sum(c for c, _ in old_counts)
+        self.words += sum(w for _, w in new_counts) - sum(w for _, w in old_counts)
+        self.block_counts[first:old_last + 1] = new_counts
+
+    @property
+    def char_count(self):
+        # Blocks are joined by one newline each, as in toPlainText()
+        return self.chars + max(0, len(self.block_counts) - 1)
+
+    @property
+    def word_count(self):
+        return self.words
+
+
+class SummaryChunks:
+    """The split_summary_chunks chunks of a QTextDocument, tracked from contentsChange deltas.
+
+    Every block keeps its length, whether a chunk may end after it and a hash
+    of its text, so finding the chunks before the context window copies no
+    text, and a chunk is only read when its summary isn't cached yet.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.blocks = []  # (chars, may end a chunk, blank, hash) for every block, in document order
+        self.digests = {}  # Hash of a chunk's block hashes -> SummaryCache.digest() of its text
+        self.summarized = None  # Keys of the complete chunks the last summary was started from
+        self.rebuild()
+        document.contentsChange.connect(self.on_contents_change)
+
+    @staticmethod
+    def scan_block(block):
+        text = block.text().replace("\u00a0", " ")  # As document_text() reads it
+        return len(text), may_end_summary_chunk(text), not text.strip(), hash(text)
+
+    def rebuild(self):
+        self.blocks = []
+        block = self.document.begin()
+        while block.isValid():
+            self.blocks.append(self.scan_block(block))
+            block = block.next()
+
+    def detach(self):
+        with contextlib.suppress(TypeError, RuntimeError):  # Not connected, or the document is gone
+            self.document.contentsChange.disconnect(self.on_contents_change)
+
+    def on_contents_change(self, position, removed, added):
+        edit = edited_blocks(self.document, position, added, len(self.blocks))
+        if edit is None:
+            self.rebuild()
+            return
+        first, last, old_last = edit
+        block = self.document.findBlockByNumber(first)
+        scanned = []
+        for _ in range(first, last + 1):
+            scanned.append(self.scan_block(block))
+            block = block.next()
+        self.blocks[first:old_last + 1] = scanned
+
+    def read(self, first, last):
+        parts = []
+        block = self.document.findBlockByNumber(first)
+        for _ in range(first, last + 1):
+            parts.append(block.text())
+            block = block.next()
+        return "\n".join(parts).replace("\u00a0", " ")
+
+    def chunks(self, model, end, cache):
+        """The chunks of the text before position `end`, as split_summary_chunks() would split it.
+
+        Returns (key, text, summary) for each, with the summary from `cache`
+        or else the text to summarise, and how many of them are complete: the
+        rest covers the text after the last chunk boundary, which is read and
+        split every time.
+        """
+        cut = self.document.findBlock(end).blockNumber()
+        complete = []
+        first = size = 0
+        for number in range(cut):
+            chars, may_end, _, _ = self.blocks[number]
+            size += chars + 1
+            if size >= SUMMARY_CHUNK_MAX_CHARS or (size >= SUMMARY_CHUNK_MIN_CHARS and may_end):
+                complete.append((first, number))
+                first = number + 1
+                size = 0
+        
+        chunks = []
+        digests = {}
+        for start, stop in complete:
+            blocks = self.blocks[start:stop + 1]
+            if all(blank for _, _, blank, _ in blocks):
+                continue
+            identity = hash(tuple(text_hash for _, _, _, text_hash in blocks))
+            digest = self.digests.get(identity)
+            summary = None if digest is None else cache.get(cache.key(model, 0, digest=digest))
+            text = None
+            if summary is None:
+                text = self.read(start, stop)
+                digest = cache.digest(text)
+            digests[identity] = digest
+            chunks.append((cache.key(model, 0, digest=digest), text, summary))
+        self.digests = digests
+        
+        complete_count = len(chunks)
+        rest = document_text(self.document, self.document.findBlockByNumber(first).position(), end)
+        for text in split_summary_chunks(rest):
+            key = cache.key(model, 0, text)
+            chunks.append((key, text, cache.get(key)))
+        return chunks, complete_count
+
+
+class StartupTimeline:
+    """Milestones of application startup in milliseconds since STARTUP_STARTED.
+
+    Run with --startup-report to print them once the model list has arrived;
+    benchmarks/bench_startup.py collects them over several launches.
+    """
+
+    def __init__(self):
+        self.marks = {}
+
+    def mark(self, name):
+        self.marks.setdefault(name, (time.perf_counter() - STARTUP_STARTED) * 1000)
+
+    def report(self):
+        return "\n".join(f"[startup] {ms:9.1f} ms  {name}" for name, ms in self.marks.items())
+
+
+STARTUP = StartupTimeline()
+AUTOSAVE_KEYS = itertools.count(1)  # Journal names are "<pid>-<n>", unique across the process's windows
 
-        return completion_stripped
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -513,11 +1100,99 @@ class MainWindow(QMainWindow):
         self.current_file = None
         self.selected_genre = "Neutral"
         self.memory_enabled = True
+        self.streaming_enabled = DEFAULT_STREAMING
         self.generation_history = []  # Track all generations in session
+        self.last_generation_stats = {}
+        self.kv_reuse_enabled = DEFAULT_KV_REUSE
+        self.chat_prompt_enabled = DEFAULT_CHAT_PROMPT
+        self.kv_session = None  # Context tokens from the last generation and the document length they cover
+        self.generation_deadline = DEFAULT_GENERATION_DEADLINE
+        self.min_tokens_per_second = DEFAULT_MIN_TOKENS_PER_SECOND
+        self.keep_partial = DEFAULT_KEEP_PARTIAL
+        self.generation_worker = None
+        self.scan_worker = None
+        self.num_ctx_limit = DEFAULT_NUM_CTX
+        self.last_budget = {}
+        self.candidate_count = DEFAULT_CANDIDATES
+        self.spread_temperatures = True
+        self.candidates = []  # One dict per candidate of the current multi-candidate generation
+        self.seed = DEFAULT_SEED or None
+        self.completion_cache = CompletionCache(os.path.join(CACHE_DIR, "completions"))
+        self.model_cache = ModelListCache(os.path.join(CACHE_DIR, "models.json"))
+        self.keep_alive_minutes = DEFAULT_KEEP_ALIVE_MINUTES
+        self.model_load_worker = None
+        self.resident_worker = None
+        self.resident = {}  # Model name -> /api/ps entry for models Ollama holds in memory
+        self.warmup_enabled = DEFAULT_WARMUP
+        self.warmup_worker = None
+        self.retired_workers = []  # Cancelled threads kept alive until they have wound down
+        self.warmed_fingerprint = None  # Prompt the server has most recently evaluated for us
+        self.warmup_hits = 0
+        self.warmup_misses = 0
+        self.rolling_summary_enabled = DEFAULT_ROLLING_SUMMARY
+        self.summary_cache = SummaryCache(os.path.join(CACHE_DIR, "summaries.json"))
+        self.summary_worker = None
+        self.summary_chunks = None  # SummaryChunks of the editor's document, while the rolling summary is on
+        self.memory_summary = ""  # Rollup of the text before the context window
+        self.memory_summary_stats = {}
+        self.retrieval_enabled = DEFAULT_RETRIEVAL and NUMPY_AVAILABLE
+        self.retrieval_index = None  # Created on first use, which is when numpy gets imported
+        self.retrieval_worker = None
+        self.retrieval_stats = {}
+        self.last_retrieved = []
+        self.project = None
+        self.chapter = None  # The chapter in the editor
+        self.open_chapters = OrderedDict()  # Chapter id -> loaded document and its stats, least recently shown first
+        self.chapter_memory = {}  # Chapter id -> that chapter's summary, retrieved passages and token budget
+        self.autosave_dir = os.path.join(CACHE_DIR, "autosave")
+        self.autosave_worker = AutosaveWorker(self.autosave_dir) if DEFAULT_AUTOSAVE else None
+        self.export_worker = None
+        self.import_worker = None
+        self.import_queue = deque()  # (text, line counts) pieces read but not yet in the editor
+        self.import_result = None
+        self.import_pieces = 0  # Pieces of the opening document already in the editor
+        self.stream_buffer = []  # Streamed chunks waiting for the next editor flush
+        self.stream_insert_pos = 0
         self.setStyleSheet(STYLES[self.current_theme])
         
         self.init_ui()
+        if self.autosave_worker is not None:
+            self.autosave_worker.saved.connect(self.on_autosaved)
+            self.autosave_worker.error.connect(self.on_autosave_error)
+            self.autosave_worker.start()
+        self.scratch_autosave_key = self.track_autosave(self.editor.document(), "", {'title': "Untitled"})
+        self.show_cached_models()
+        self.model_combo.currentTextChanged.connect(self.on_model_selected)
+        # Network work waits until the window has painted (see paintEvent)
+        self.startup_done = False
+        self.background_started = False
+        QTimer.singleShot(STARTUP_FALLBACK_MS, self.start_background_work)
+        STARTUP.mark("window built")
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.background_started:
+            STARTUP.mark("first paint")
+            QTimer.singleShot(0, self.start_background_work)
+
+    def start_background_work(self):
+        if self.background_started:
+            return
+        self.background_started = True
         self.scan_models()
+        self.warm_model(self.model_combo.currentText())
+        self.resident_timer.start()
+        self.queue_timer.start()
+        QTimer.singleShot(0, self.offer_recovery)
+
+    def finish_startup(self):
+        """Record that the model list (or the error instead of it) has arrived"""
+        if self.startup_done:
+            return
+        self.startup_done = True
+        STARTUP.mark("models listed")
+        if STARTUP_REPORT:
+            print(STARTUP.report(), file=sys.stderr, flush=True)
 
     def init_ui(self):
         central_widget = QWidget()
@@ -555,6 +1230,10 @@ class MainWindow(QMainWindow):
         self.scan_btn.clicked.connect(self.scan_models)
         header_layout.addWidget(self.scan_btn)
         
+        self.resident_label = QLabel("")
+        self.resident_label.setObjectName("status-label")
+        header_layout.addWidget(self.resident_label)
+        
         header_layout.addSpacing(20)
         
         # Genre Dropdown
@@ -586,17 +1265,38 @@ class MainWindow(QMainWindow):
         self.generate_btn.setEnabled(False)
         header_layout.addWidget(self.generate_btn)
         
+        # Stop Button (visible while generating)
+        self.stop_btn = QPushButton("⏹ Stop")
+        self.stop_btn.setFixedHeight(35)
+        self.stop_btn.setToolTip("Stop generating (Esc)")
+        self.stop_btn.clicked.connect(self.stop_generation)
+        self.stop_btn.hide()
+        header_layout.addWidget(self.stop_btn)
+        
         header_layout.addSpacing(10)
         
+        self.open_btn = QPushButton("📂 Open")
+        self.open_btn.setToolTip("Open a .txt, .md or .docx manuscript")
+        self.open_btn.clicked.connect(self.open_file)
+        header_layout.addWidget(self.open_btn)
+        
         # Save Buttons
         self.save_txt_btn = QPushButton("📄 .txt")
         self.save_txt_btn.clicked.connect(self.save_txt)
         header_layout.addWidget(self.save_txt_btn)
         
-        if DOCX_AVAILABLE:
-            self.save_doc_btn = QPushButton("📕 .docx")
-            self.save_doc_btn.clicked.connect(self.save_docx)
-            header_layout.addWidget(self.save_doc_btn)
+        self.save_doc_btn = QPushButton("📕 .docx")
+        self.save_doc_btn.clicked.connect(self.save_docx)
+        header_layout.addWidget(self.save_doc_btn)
+        
+        self.save_md_btn = QPushButton("📝 .md")
+        self.save_md_btn.clicked.connect(lambda: self.export_as('md'))
+        header_layout.addWidget(self.save_md_btn)
+        
+        self.save_epub_btn = QPushButton("📚 .epub")
+        self.save_epub_btn.setToolTip("E-book with a chapter for every \"# \" heading (or every project chapter)")
+        self.save_epub_btn.clicked.connect(lambda: self.export_as('epub'))
+        header_layout.addWidget(self.save_epub_btn)
         
         main_layout.addWidget(self.header)
 
@@ -614,37 +1314,103 @@ class MainWindow(QMainWindow):
         self.editor_tabs = QTabWidget()
         
         # Main Editor Tab
-        self.editor = QTextEdit()
+        # Plain-text editor: its document lays out lazily, block by block, so novel-length drafts stay fast
+        self.editor = QPlainTextEdit()
         self.editor.setObjectName("editor")
         self.editor.setPlaceholderText("Start writing your story here...\n\nPress Ctrl+Enter to let AI continue from your cursor position.\n\n🧠 Memory is ENABLED - AI will remember previous content!")
         self.editor.textChanged.connect(self.on_text_changed)
+        self.editor.document().contentsChange.connect(self.on_contents_change)
+        self.doc_stats = DocumentStats(self.editor.document())
         self.editor_tabs.addTab(self.editor, "📝 Editor")
         
-        # Memory Context Tab
-        self.memory_view = QTextEdit()
-        self.memory_view.setObjectName("memory-view")
-        self.memory_view.setReadOnly(True)
-        self.memory_view.setPlaceholderText("Memory context will appear here when you generate...\n\nThis shows what the AI can see from your previous writing.")
-        self.editor_tabs.addTab(self.memory_view, "🧠 Memory Context")
+        # Memory Context and History tabs get their views the first time they are shown
+        self.memory_tab = QWidget()
+        self.memory_view = None
+        self.memory_view_text = ""
+        self.memory_view_dirty = True
+        self.editor_tabs.addTab(self.memory_tab, "🧠 Memory Context")
         
-        # Generation History Tab
-        self.history_view = QTextEdit()
-        self.history_view.setObjectName("memory-view")
-        self.history_view.setReadOnly(True)
-        self.history_view.setPlaceholderText("Generation history will appear here...")
-        self.editor_tabs.addTab(self.history_view, "📜 History")
+        self.history_tab = QWidget()
+        self.history_view = None
+        self.editor_tabs.addTab(self.history_tab, "📜 History")
         
+        self.editor_tabs.currentChanged.connect(self.on_editor_tab_changed)
         editor_layout.addWidget(self.editor_tabs)
         splitter.addWidget(editor_container)
         
+        # Candidates Panel (shown while picking between parallel continuations)
+        self.candidates_panel = QFrame()
+        self.candidates_panel.setObjectName("sidebar")
+        self.candidates_panel.setMinimumWidth(320)
+        candidates_layout = QVBoxLayout(self.candidates_panel)
+        candidates_layout.setContentsMargins(15, 15, 15, 15)
+        candidates_header = QHBoxLayout()
+        candidates_title = QLabel("🎲 Candidates")
+        candidates_title.setObjectName("sidebar-title")
+        candidates_header.addWidget(candidates_title)
+        candidates_header.addStretch()
+        discard_btn = QPushButton("✖ Discard")
+        discard_btn.clicked.connect(self.discard_candidates)
+        candidates_header.addWidget(discard_btn)
+        candidates_layout.addLayout(candidates_header)
+        candidates_scroll = QScrollArea()
+        candidates_scroll.setWidgetResizable(True)
+        candidates_scroll.setFrameShape(QFrame.NoFrame)
+        candidates_list = QWidget()
+        self.candidates_list_layout = QVBoxLayout(candidates_list)
+        self.candidates_list_layout.setContentsMargins(0, 0, 0, 0)
+        self.candidates_list_layout.addStretch()
+        candidates_scroll.setWidget(candidates_list)
+        candidates_layout.addWidget(candidates_scroll)
+        self.candidates_panel.hide()
+        splitter.addWidget(self.candidates_panel)
+        
         # Sidebar
+        sidebar_scroll = QScrollArea()
+        sidebar_scroll.setFixedWidth(320)
+        sidebar_scroll.setWidgetResizable(True)
+        sidebar_scroll.setFrameShape(QFrame.NoFrame)
+        sidebar_scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         sidebar = QFrame()
         sidebar.setObjectName("sidebar")
-        sidebar.setFixedWidth(320)
+        sidebar_scroll.setWidget(sidebar)
         sidebar_layout = QVBoxLayout(sidebar)
         sidebar_layout.setContentsMargins(15, 15, 15, 15)
         sidebar_layout.setSpacing(15)
         
+        # Project Group
+        project_group = QGroupBox("📚 Project")
+        project_layout = QVBoxLayout(project_group)
+        
+        project_buttons = QHBoxLayout()
+        open_folder_btn = QPushButton("📁 Folder")
+        open_folder_btn.setToolTip("Open a folder with one .txt or .md file per chapter")
+        open_folder_btn.clicked.connect(self.open_project_folder)
+        project_buttons.addWidget(open_folder_btn)
+        open_book_btn = QPushButton("📖 Book")
+        open_book_btn.setToolTip("Open a single file whose chapters start with \"# \" headings")
+        open_book_btn.clicked.connect(self.open_project_file)
+        project_buttons.addWidget(open_book_btn)
+        self.save_chapters_btn = QPushButton("💾 Save")
+        self.save_chapters_btn.setToolTip("Write every changed chapter back to the project")
+        self.save_chapters_btn.setEnabled(False)
+        self.save_chapters_btn.clicked.connect(self.save_chapters)
+        project_buttons.addWidget(self.save_chapters_btn)
+        project_layout.addLayout(project_buttons)
+        
+        self.chapter_list = QListWidget()
+        self.chapter_list.setMaximumHeight(180)
+        self.chapter_list.currentRowChanged.connect(self.on_chapter_selected)
+        self.chapter_list.hide()
+        project_layout.addWidget(self.chapter_list)
+        
+        self.project_label = QLabel("No project open")
+        self.project_label.setObjectName("status-label")
+        self.project_label.setWordWrap(True)
+        project_layout.addWidget(self.project_label)
+        
+        sidebar_layout.addWidget(project_group)
+        
         # Memory Settings Group
         memory_group = QGroupBox("🧠 Memory Settings")
         memory_layout = QVBoxLayout(memory_group)
@@ -672,6 +1438,56 @@ class MainWindow(QMainWindow):
         context_hint.setObjectName("status-label")
         memory_layout.addWidget(context_hint)
         
+        num_ctx_label = QLabel("🧮 Context Window (Tokens)")
+        num_ctx_label.setObjectName("sidebar-title")
+        memory_layout.addWidget(num_ctx_label)
+        
+        self.num_ctx_spinbox = QSpinBox()
+        self.num_ctx_spinbox.setRange(512, 131072)
+        self.num_ctx_spinbox.setSingleStep(512)
+        self.num_ctx_spinbox.setValue(self.num_ctx_limit)
+        self.num_ctx_spinbox.setSuffix(" tokens")
+        self.num_ctx_spinbox.setToolTip("Upper limit for num_ctx; the model's own maximum is used if smaller")
+        self.num_ctx_spinbox.valueChanged.connect(self.on_num_ctx_changed)
+        memory_layout.addWidget(self.num_ctx_spinbox)
+        
+        self.kv_reuse_checkbox = QCheckBox("Reuse model cache between generations")
+        self.kv_reuse_checkbox.setChecked(self.kv_reuse_enabled)
+        self.kv_reuse_checkbox.setToolTip("Skip re-reading unchanged text when you only added to the end")
+        self.kv_reuse_checkbox.toggled.connect(self.on_kv_reuse_toggled)
+        memory_layout.addWidget(self.kv_reuse_checkbox)
+        
+        self.chat_prompt_checkbox = QCheckBox("Stable prompt prefix (chat API)")
+        self.chat_prompt_checkbox.setChecked(self.chat_prompt_enabled)
+        self.chat_prompt_checkbox.setToolTip("Send instructions and older text first, in a form that changes rarely, "
+                                             "so Ollama only re-reads what changed since the last prompt")
+        self.chat_prompt_checkbox.toggled.connect(self.on_chat_prompt_toggled)
+        memory_layout.addWidget(self.chat_prompt_checkbox)
+        self.kv_reuse_checkbox.setEnabled(not self.chat_prompt_enabled)
+        
+        self.summary_checkbox = QCheckBox("Rolling summary of older text")
+        self.summary_checkbox.setChecked(self.rolling_summary_enabled)
+        self.summary_checkbox.setToolTip("Summarise everything before the context window in the background")
+        self.summary_checkbox.toggled.connect(self.on_rolling_summary_toggled)
+        memory_layout.addWidget(self.summary_checkbox)
+        
+        self.retrieval_checkbox = QCheckBox("Retrieve related earlier passages")
+        self.retrieval_checkbox.setChecked(self.retrieval_enabled)
+        self.retrieval_checkbox.setEnabled(NUMPY_AVAILABLE)
+        self.retrieval_checkbox.setToolTip("Find paragraphs similar to the current text and add them to the prompt"
+                                           if NUMPY_AVAILABLE else "Install numpy to enable retrieval memory")
+        self.retrieval_checkbox.toggled.connect(self.on_retrieval_toggled)
+        memory_layout.addWidget(self.retrieval_checkbox)
+        
+        self.embed_model_combo = QComboBox()
+        self.embed_model_combo.setEditable(True)
+        self.embed_model_combo.addItems([LOCAL_EMBEDDINGS_LABEL, DEFAULT_EMBED_MODEL])
+        self.embed_model_combo.setCurrentText(DEFAULT_EMBED_MODEL)
+        self.embed_model_combo.setToolTip("Embedding model used for retrieval")
+        self.embed_model_combo.setEnabled(self.retrieval_enabled)
+        self.embed_model_combo.currentTextChanged.connect(self.on_embed_model_changed)
+        memory_layout.addWidget(self.embed_model_combo)
+        
         # Clear Memory Button
         self.clear_memory_btn = QPushButton("🗑️ Clear Memory")
         self.clear_memory_btn.clicked.connect(self.clear_memory)
@@ -723,13 +1539,124 @@ class MainWindow(QMainWindow):
         
         sidebar_layout.addWidget(token_group)
         
+        # Output Group
+        output_group = QGroupBox("⚡ Output")
+        output_layout = QVBoxLayout(output_group)
+        
+        self.stream_checkbox = QCheckBox("Stream text while generating")
+        self.stream_checkbox.setChecked(self.streaming_enabled)
+        self.stream_checkbox.toggled.connect(self.on_streaming_toggled)
+        output_layout.addWidget(self.stream_checkbox)
+        
+        stream_hint = QLabel("Words appear as the model writes them")
+        stream_hint.setObjectName("status-label")
+        output_layout.addWidget(stream_hint)
+        
+        candidates_label = QLabel("🎲 Candidates per generation")
+        candidates_label.setObjectName("sidebar-title")
+        output_layout.addWidget(candidates_label)
+        
+        self.candidates_spinbox = QSpinBox()
+        self.candidates_spinbox.setRange(1, max(1, SERVER_PARALLEL_SLOTS))
+        self.candidates_spinbox.setValue(self.candidate_count)
+        self.candidates_spinbox.setToolTip("Generated in parallel; the maximum follows OLLAMA_NUM_PARALLEL")
+        self.candidates_spinbox.valueChanged.connect(self.on_candidate_count_changed)
+        output_layout.addWidget(self.candidates_spinbox)
+        
+        self.spread_checkbox = QCheckBox("Spread temperatures across candidates")
+        self.spread_checkbox.setChecked(self.spread_temperatures)
+        self.spread_checkbox.toggled.connect(self.on_spread_toggled)
+        output_layout.addWidget(self.spread_checkbox)
+        
+        seed_label = QLabel("🔁 Seed")
+        seed_label.setObjectName("sidebar-title")
+        output_layout.addWidget(seed_label)
+        
+        self.seed_spinbox = QSpinBox()
+        self.seed_spinbox.setRange(0, 2**31 - 1)
+        self.seed_spinbox.setSpecialValueText("Random")
+        self.seed_spinbox.setValue(self.seed or 0)
+        self.seed_spinbox.setToolTip("A fixed seed (or temperature 0) makes completions repeatable and lets them be cached")
+        self.seed_spinbox.valueChanged.connect(self.on_seed_changed)
+        output_layout.addWidget(self.seed_spinbox)
+        
+        sidebar_layout.addWidget(output_group)
+        
+        # Limits Group
+        limits_group = QGroupBox("⏱️ Limits")
+        limits_layout = QVBoxLayout(limits_group)
+        
+        deadline_label = QLabel("Stop after")
+        deadline_label.setObjectName("sidebar-title")
+        limits_layout.addWidget(deadline_label)
+        
+        self.deadline_spinbox = QSpinBox()
+        self.deadline_spinbox.setRange(0, 3600)
+        self.deadline_spinbox.setValue(self.generation_deadline)
+        self.deadline_spinbox.setSuffix(" s")
+        self.deadline_spinbox.setSpecialValueText("No limit")
+        self.deadline_spinbox.valueChanged.connect(self.on_deadline_changed)
+        limits_layout.addWidget(self.deadline_spinbox)
+        
+        min_rate_label = QLabel("Stop if slower than")
+        min_rate_label.setObjectName("sidebar-title")
+        limits_layout.addWidget(min_rate_label)
+        
+        self.min_rate_spinbox = QSpinBox()
+        self.min_rate_spinbox.setRange(0, 500)
+        self.min_rate_spinbox.setValue(self.min_tokens_per_second)
+        self.min_rate_spinbox.setSuffix(" tokens/s")
+        self.min_rate_spinbox.setSpecialValueText("Off")
+        self.min_rate_spinbox.valueChanged.connect(self.on_min_rate_changed)
+        limits_layout.addWidget(self.min_rate_spinbox)
+        
+        self.keep_partial_checkbox = QCheckBox("Keep text written before stopping")
+        self.keep_partial_checkbox.setChecked(self.keep_partial)
+        self.keep_partial_checkbox.toggled.connect(self.on_keep_partial_toggled)
+        limits_layout.addWidget(self.keep_partial_checkbox)
+        
+        sidebar_layout.addWidget(limits_group)
+        
+        # Warm-up Group
+        warmup_group = QGroupBox("🔥 Warm-up")
+        warmup_layout = QVBoxLayout(warmup_group)
+        
+        self.warmup_checkbox = QCheckBox("Prepare the next prompt while idle")
+        self.warmup_checkbox.setChecked(self.warmup_enabled)
+        self.warmup_checkbox.setToolTip("Ollama reads the prompt in advance, so Ctrl+Enter starts writing immediately")
+        self.warmup_checkbox.toggled.connect(self.on_warmup_toggled)
+        warmup_layout.addWidget(self.warmup_checkbox)
+        
+        self.warmup_idle_spinbox = QSpinBox()
+        self.warmup_idle_spinbox.setRange(1, 60)
+        self.warmup_idle_spinbox.setValue(DEFAULT_WARMUP_IDLE_SECONDS)
+        self.warmup_idle_spinbox.setPrefix("after ")
+        self.warmup_idle_spinbox.setSuffix(" s idle")
+        self.warmup_idle_spinbox.valueChanged.connect(self.on_warmup_idle_changed)
+        warmup_layout.addWidget(self.warmup_idle_spinbox)
+        
+        keep_alive_label = QLabel("Keep model in memory")
+        keep_alive_label.setObjectName("sidebar-title")
+        warmup_layout.addWidget(keep_alive_label)
+        
+        self.keep_alive_spinbox = QSpinBox()
+        self.keep_alive_spinbox.setRange(0, 24 * 60)
+        self.keep_alive_spinbox.setValue(self.keep_alive_minutes)
+        self.keep_alive_spinbox.setSpecialValueText("Server default")
+        self.keep_alive_spinbox.setSuffix(" min")
+        self.keep_alive_spinbox.setToolTip("The selected model is loaded as soon as it is picked and kept this long after use")
+        self.keep_alive_spinbox.valueChanged.connect(self.on_keep_alive_changed)
+        warmup_layout.addWidget(self.keep_alive_spinbox)
+        
+        sidebar_layout.addWidget(warmup_group)
+        
         # Tips Group
         tips_group = QGroupBox("ℹ️ Tips")
         tips_layout = QVBoxLayout(tips_group)
         tips = [
             "• Memory helps AI maintain continuity",
             "• Place cursor where AI should continue",
-            "• Ctrl+Enter to generate",
+            "• Ctrl+Enter to generate, Esc to stop",
             "• Lower temp = consistent style",
             "• Higher temp = surprising ideas",
             "• Check Memory tab to see context",
@@ -744,7 +1671,7 @@ class MainWindow(QMainWindow):
         sidebar_layout.addWidget(tips_group)
         sidebar_layout.addStretch()
         
-        splitter.addWidget(sidebar)
+        splitter.addWidget(sidebar_scroll)
         main_layout.addWidget(splitter)
         
         # Set initial splitter sizes (70% editor, 30% sidebar)
@@ -757,11 +1684,32 @@ class MainWindow(QMainWindow):
         self.char_label = QLabel("0 chars | 0 words")
         self.char_label.setObjectName("status-label")
         self.statusBar.addPermanentWidget(self.char_label)
+        self.warmup_label = QLabel("")
+        self.warmup_label.setObjectName("status-label")
+        self.warmup_label.setToolTip("Generations that started from a warmed-up prompt")
+        self.warmup_label.setVisible(self.warmup_enabled)
+        self.statusBar.addPermanentWidget(self.warmup_label)
+        self.cache_label = QLabel("")
+        self.cache_label.setObjectName("status-label")
+        self.cache_label.setToolTip("Completion cache hits / lookups (used with a fixed seed or temperature 0)")
+        self.statusBar.addPermanentWidget(self.cache_label)
+        self.speed_label = QLabel("")
+        self.speed_label.setObjectName("status-label")
+        self.speed_label.setToolTip("Decoding speed: live while text streams in, then as reported by Ollama")
+        self.statusBar.addPermanentWidget(self.speed_label)
+        self.queue_label = QLabel("")
+        self.queue_label.setObjectName("status-label")
+        self.statusBar.addPermanentWidget(self.queue_label)
+        self.autosave_label = QLabel("")
+        self.autosave_label.setObjectName("status-label")
+        self.statusBar.addPermanentWidget(self.autosave_label)
         self.statusBar.showMessage("🧠 Memory System Ready")
         
         # Keyboard Shortcuts
         shortcut = QShortcut(QKeySequence("Ctrl+Return"), self)
         shortcut.activated.connect(self.start_generation)
+        stop_shortcut = QShortcut(QKeySequence(Qt.Key_Escape), self)
+        stop_shortcut.activated.connect(self.stop_generation)
         
         # Progress Indicator (Hidden by default)
         self.progress_bar = QProgressBar()
@@ -770,6 +1718,65 @@ class MainWindow(QMainWindow):
         self.progress_bar.hide()
         self.statusBar.addPermanentWidget(self.progress_bar)
         
+        self.import_progress = QProgressBar()
+        self.import_progress.setFixedWidth(150)
+        self.import_progress.setRange(0, 100)
+        self.import_progress.setFormat("Opening %p%")
+        self.import_progress.hide()
+        self.statusBar.addPermanentWidget(self.import_progress)
+        
+        self.export_progress = QProgressBar()
+        self.export_progress.setFixedWidth(150)
+        self.export_progress.setRange(0, 100)
+        self.export_progress.setFormat("Export %p%")
+        self.export_progress.hide()
+        self.statusBar.addPermanentWidget(self.export_progress)
+        self.export_cancel_btn = QPushButton("✖")
+        self.export_cancel_btn.setToolTip("Cancel the export")
+        self.export_cancel_btn.clicked.connect(self.cancel_export)
+        self.export_cancel_btn.hide()
+        self.statusBar.addPermanentWidget(self.export_cancel_btn)
+        
+        # Counts are kept current on every edit; the label and button refresh waits for a pause
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setSingleShot(True)
+        self.stats_timer.setInterval(STATS_REFRESH_DELAY_MS)
+        self.stats_timer.timeout.connect(self.refresh_text_stats)
+        
+        # Opened documents are inserted a slice at a time, whenever the event loop is otherwise idle
+        self.import_timer = QTimer(self)
+        self.import_timer.setInterval(0)
+        self.import_timer.timeout.connect(self.insert_imported_text)
+        
+        # Background memory (summary, retrieval index) is brought up to date once typing pauses
+        self.memory_timer = QTimer(self)
+        self.memory_timer.setSingleShot(True)
+        self.memory_timer.setInterval(MEMORY_IDLE_MS)
+        self.memory_timer.timeout.connect(self.update_rolling_summary)
+        self.memory_timer.timeout.connect(self.update_retrieval_index)
+        
+        # Streamed text is collected and inserted once per frame, not once per token
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(STREAM_FLUSH_INTERVAL_MS)
+        self.stream_timer.timeout.connect(self.flush_stream_buffer)
+        self.candidate_timer = QTimer(self)
+        self.candidate_timer.setInterval(STREAM_FLUSH_INTERVAL_MS)
+        self.candidate_timer.timeout.connect(self.flush_candidate_buffers)
+        
+        # Which models Ollama holds in memory
+        self.resident_timer = QTimer(self)
+        self.resident_timer.setInterval(RESIDENT_POLL_MS)
+        self.resident_timer.timeout.connect(self.poll_resident_models)
+        self.queue_timer = QTimer(self)
+        self.queue_timer.setInterval(QUEUE_STATUS_MS)
+        self.queue_timer.timeout.connect(self.update_queue_label)
+        
+        # Idle warm-up of the next prompt
+        self.warmup_timer = QTimer(self)
+        self.warmup_timer.setSingleShot(True)
+        self.warmup_timer.setInterval(DEFAULT_WARMUP_IDLE_SECONDS * 1000)
+        self.warmup_timer.timeout.connect(self.start_warmup)
+        
         # Update memory view initially
         self.update_memory_view()
 
@@ -811,50 +1818,487 @@ class MainWindow(QMainWindow):
         self.token_limit = value
         self.statusBar.showMessage(f"Token limit set to {self.token_limit} tokens")
 
-    def on_text_changed(self):
-        text = self.editor.toPlainText()
-        char_count = len(text)
-        word_count = len(text.split())
-        self.char_label.setText(f"{char_count} chars | {word_count} words")
-        
+    def on_streaming_toggled(self, checked):
+        self.streaming_enabled = checked
+        mode = "streaming" if checked else "all at once"
+        self.statusBar.showMessage(f"⚡ Completions will be shown {mode}")
+
+    def on_candidate_count_changed(self, value):
+        self.candidate_count = value
+        mode = f"{value} candidates to choose from" if value > 1 else "direct insertion"
+        self.statusBar.showMessage(f"🎲 Generation mode: {mode}")
+
+    def on_spread_toggled(self, checked):
+        self.spread_temperatures = checked
+
+    def on_seed_changed(self, value):
+        self.seed = value or None
+
+    def on_warmup_toggled(self, checked):
+        self.warmup_enabled = checked
+        self.warmup_label.setVisible(checked)
+        if checked:
+            self.warmup_timer.start()
+        else:
+            self.warmup_timer.stop()
+            self.cancel_warmup()
+
+    def on_warmup_idle_changed(self, value):
+        self.warmup_timer.setInterval(value * 1000)
+
+    def start_warmup(self):
+        """Send the prompt the next generation would send, so its prefix is cached"""
+        if not self.warmup_enabled or self.generation_worker is not None or self.candidates:
+            return
         model = self.model_combo.currentText()
-        has_text = len(text.strip()) > 0
-        has_model = model not in ["Select model...", "No models found"]
-        self.generate_btn.setEnabled(has_text and has_model and not self.progress_bar.isVisible())
+        if model in MODEL_PLACEHOLDERS or self.doc_stats.word_count == 0:
+            return
+        self.cancel_warmup()
+        worker_args = self.generation_args(model)
+        worker_args['warmup'] = True
+        self.warmup_worker = OllamaWorker(**worker_args)
+        self.warmup_worker.warmed.connect(self.on_warmed)
+        self.warmup_worker.error.connect(self.on_warmup_error)
+        self.warmup_worker.start()
+
+    def cancel_warmup(self):
+        worker = self.warmup_worker
+        if worker is None:
+            return
+        self.warmup_worker = None
+        worker.warmed.disconnect()
+        worker.error.disconnect()
+        worker.cancel("Superseded")
+        self.retire_worker(worker)
+
+    def cancel_summary(self):
+        worker = self.summary_worker
+        if worker is None:
+            return
+        self.summary_worker = None
+        worker.summary_ready.disconnect()
+        worker.error.disconnect()
+        worker.cancel()
+        self.retire_worker(worker)
+
+    def retire_worker(self, worker):
+        """Hold a reference to a cancelled thread so Qt doesn't destroy it while it is running"""
+        self.retired_workers = [w for w in self.retired_workers if w.isRunning()]
+        if worker.isRunning():
+            self.retired_workers.append(worker)
+
+    def on_warmed(self, fingerprint):
+        self.warmup_worker = None
+        self.warmed_fingerprint = fingerprint
+        self.statusBar.showMessage("🔥 Next prompt is warmed up")
+
+    def on_warmup_error(self, error_msg):
+        self.warmup_worker = None
+        self.statusBar.showMessage(f"⚠️ Warm-up failed: {error_msg}")
+
+    def record_warmup_result(self, fingerprint):
+        """Count whether a real generation started from the prompt a warm-up prepared"""
+        if not self.warmup_enabled or not fingerprint:
+            return None
+        hit = fingerprint == self.warmed_fingerprint
+        if hit:
+            self.warmup_hits += 1
+        else:
+            self.warmup_misses += 1
+        self.warmed_fingerprint = None
+        total = self.warmup_hits + self.warmup_misses
+        self.warmup_label.setText(f"🔥 {self.warmup_hits}/{total} warm")
+        return hit
+
+    def on_num_ctx_changed(self, value):
+        self.num_ctx_limit = value
+        # Reused tokens were evaluated with the previous window size
+        self.kv_session = None
+        self.statusBar.showMessage(f"🧮 Context window limited to {value} tokens")
+
+    def on_deadline_changed(self, value):
+        self.generation_deadline = value
+
+    def on_min_rate_changed(self, value):
+        self.min_tokens_per_second = value
+
+    def on_keep_partial_toggled(self, checked):
+        self.keep_partial = checked
+
+    def on_rolling_summary_toggled(self, checked):
+        self.rolling_summary_enabled = checked
+        if checked:
+            self.memory_timer.start()
+        else:
+            if self.summary_worker:
+                self.summary_worker.cancel()
+            if self.summary_chunks is not None:
+                self.summary_chunks.detach()
+                self.summary_chunks = None
+        self.update_memory_view()
+
+    def update_rolling_summary(self):
+        """Summarise the text before the context window, reusing cached chunk summaries"""
+        model = self.model_combo.currentText()
+        if not (self.rolling_summary_enabled and self.memory_enabled):
+            return
+        if model in MODEL_PLACEHOLDERS:
+            return
+        if self.doc_stats.char_count <= self.context_chars:
+            self.memory_summary = ""
+            return
+        # Don't compete with a running generation or summary; try again after the next pause
+        if self.generation_worker is not None or (self.summary_worker and self.summary_worker.isRunning()):
+            self.memory_timer.start()
+            return
+        
+        document = self.editor.document()
+        tracked = self.tracked_summary_chunks()
+        chunks, complete = tracked.chunks(model, max(0, document_end(document) - self.context_chars),
+                                          self.summary_cache)
+        # Only the text after the last chunk boundary moved: wait until a chunk is complete or edited
+        keys = [key for key, _, _ in chunks[:complete]]
+        if keys == tracked.summarized and self.memory_summary:
+            return
+        tracked.summarized = keys
+        self.summary_worker = SummaryWorker(model, chunks, self.summary_cache)
+        self.summary_worker.summary_ready.connect(self.on_summary_ready)
+        self.summary_worker.error.connect(self.on_summary_error)
+        self.summary_worker.start()
+
+    def tracked_summary_chunks(self):
+        """The SummaryChunks of the editor's document, started when it is first summarised"""
+        document = self.editor.document()
+        if self.summary_chunks is None or self.summary_chunks.document is not document:
+            if self.summary_chunks is not None:
+                self.summary_chunks.detach()
+            self.summary_chunks = SummaryChunks(document)
+        return self.summary_chunks
+
+    def on_summary_ready(self, summary, stats):
+        self.memory_summary = summary
+        self.memory_summary_stats = stats
+        self.update_memory_view()
+        if stats.get('calls'):
+            self.statusBar.showMessage(f"🧠 Summary updated ({stats['calls']} new, {stats['cached']} cached sections)")
+
+    def on_summary_error(self, error_msg):
+        # Background work should not interrupt writing with a dialog
+        self.statusBar.showMessage(f"⚠️ Summary not updated: {error_msg}")
+        if self.summary_chunks is not None:
+            self.summary_chunks.summarized = None  # Try again after the next pause
+
+    def on_retrieval_toggled(self, checked):
+        self.retrieval_enabled = checked
+        self.embed_model_combo.setEnabled(checked)
+        if checked:
+            self.memory_timer.start()
+        self.update_memory_view()
+
+    def on_embed_model_changed(self, name):
+        if self.retrieval_enabled:
+            self.memory_timer.start()
+
+    def embedding_backend(self):
+        name = self.embed_model_combo.currentText().strip()
+        if name == LOCAL_EMBEDDINGS_LABEL or not name:
+            return HashingEmbeddingBackend()
+        return OllamaEmbeddingBackend(name)
+
+    def retrieval_index_path(self):
+        if self.project is not None:
+            return self.project.index_path
+        if not self.current_file:
+            return None
+        return f"{self.current_file}.embeddings.npz"
+
+    def retrieval_sources(self):
+        """(source, text, signature) for RetrievalWorker: the document, or every chapter of the project"""
+        if self.project is None:
+            return [("", DocumentReader(self.editor.document()), None)]
+        sources = []
+        for chapter in self.project.chapters:
+            entry = self.open_chapters.get(chapter.id)
+            if entry is not None and entry['document'].isModified():
+                # Unsaved edits: index the editor's text; no signature, so it is checked again next time
+                sources.append((chapter.id, DocumentReader(entry['document']), None))
+            else:
+                sources.append((chapter.id, functools.partial(self.project.read, chapter),
+                                functools.partial(self.project.signature, chapter)))
+        return sources
+
+    def update_retrieval_index(self):
+        """Embed new or changed paragraphs so retrieval covers the whole document (or every chapter)"""
+        if not (self.retrieval_enabled and self.memory_enabled):
+            return
+        if self.retrieval_worker and self.retrieval_worker.isRunning():
+            self.memory_timer.start()
+            return
+        
+        if self.retrieval_index is None:
+            self.retrieval_index = EmbeddingIndex()
+        
+        # Keep the index next to the document once it has been saved
+        path = self.retrieval_index_path()
+        if path != self.retrieval_index.path:
+            self.retrieval_index.path = path
+            if path and os.path.exists(path) and not len(self.retrieval_index):
+                self.retrieval_index.load()
+        
+        self.retrieval_worker = RetrievalWorker(self.retrieval_index, self.embedding_backend(),
+                                                self.retrieval_sources())
+        self.retrieval_worker.index_ready.connect(self.on_retrieval_index_ready)
+        self.retrieval_worker.error.connect(self.on_retrieval_error)
+        self.retrieval_worker.start()
+
+    def on_retrieval_index_ready(self, stats):
+        self.retrieval_stats = stats
+        self.update_memory_view()
+        if stats.get('embedded'):
+            self.statusBar.showMessage(f"🔎 Indexed {stats['embedded']} paragraphs "
+                                       f"({stats['paragraphs']} total, {stats['seconds']:.1f} s)")
+
+    def on_retrieval_error(self, error_msg):
+        self.statusBar.showMessage(f"⚠️ Retrieval index not updated: {error_msg}")
+
+    def make_retriever(self, document):
+        """Return a callable the worker uses to look up passages similar to the end of the document"""
+        if not (self.retrieval_enabled and self.memory_enabled and self.retrieval_index
+                and len(self.retrieval_index)):
+            return None
+        index = self.retrieval_index
+        backend = self.embedding_backend()
+        query = document_tail(document, RETRIEVAL_QUERY_CHARS)
+        # Passages inside the context window are already in the prompt; other chapters are searched whole
+        before_offset = self.doc_stats.char_count - self.context_chars
+        if self.chat_prompt_enabled:
+            before_offset = stable_context_start(self.doc_stats.char_count, self.context_chars)
+        source = self.chapter.id if self.chapter else ""
+        return lambda: index.search_text(backend, query, RETRIEVAL_TOP_K, before_offset, source)
+
+    def on_kv_reuse_toggled(self, checked):
+        self.kv_reuse_enabled = checked
+        self.kv_session = None
+        state = "enabled" if checked else "disabled"
+        self.statusBar.showMessage(f"♻️ Model cache reuse {state}")
+
+    def on_chat_prompt_toggled(self, checked):
+        # Context tokens only exist for /api/generate, so the two don't mix
+        self.chat_prompt_enabled = checked
+        self.kv_session = None
+        self.kv_reuse_checkbox.setEnabled(not checked)
+        state = "enabled" if checked else "disabled"
+        self.statusBar.showMessage(f"💬 Stable prompt prefix {state}")
+
+    def on_contents_change(self, position, removed, added):
+        # Any edit inside the text the reused context covers makes those tokens stale
+        if self.kv_session and position < self.kv_session['length']:
+            self.kv_session = None
+
+    def on_text_changed(self):
+        self.stats_timer.start()
+        if self.import_worker is not None:
+            return  # Memory follows once the whole file is in
+        if self.warmup_enabled:
+            # Typing makes any in-flight warm-up stale; a new one follows the next pause
+            self.cancel_warmup()
+            if self.generation_worker is None and not self.candidates:
+                self.warmup_timer.start()
+        if self.rolling_summary_enabled or self.retrieval_enabled:
+            self.memory_timer.start()
         
         # Update memory view when text changes
         if self.memory_enabled:
             self.update_memory_view()
 
-    def update_memory_view(self):
-        """Update the memory context view to show what AI will see"""
-        text = self.editor.toPlainText()
+    def refresh_text_stats(self):
+        self.stats_timer.stop()
+        char_count = self.doc_stats.char_count
+        word_count = self.doc_stats.word_count
+        self.char_label.setText(f"{char_count} chars | {word_count} words")
+        
+        model = self.model_combo.currentText()
+        has_text = word_count > 0
+        has_model = model not in MODEL_PLACEHOLDERS
+        self.generate_btn.setEnabled(has_text and has_model and not self.progress_bar.isVisible())
+
+    def on_editor_tab_changed(self, index):
+        tab = self.editor_tabs.widget(index)
+        if tab is self.memory_tab:
+            if self.memory_view is None:
+                self.build_memory_view()
+            if self.memory_view_dirty:
+                self.update_memory_view()
+        elif tab is self.history_tab and self.history_view is None:
+            self.build_history_view()
+
+    def build_memory_view(self):
+        layout = QVBoxLayout(self.memory_tab)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.memory_view = QTextEdit()
+        self.memory_view.setObjectName("memory-view")
+        self.memory_view.setReadOnly(True)
+        self.memory_view.setUndoRedoEnabled(False)
+        self.memory_view.setPlaceholderText("Memory context will appear here when you generate...\n\nThis shows what the AI can see from your previous writing.")
+        layout.addWidget(self.memory_view)
+
+    def build_history_view(self):
+        layout = QVBoxLayout(self.history_tab)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.history_view = QTextEdit()
+        self.history_view.setObjectName("memory-view")
+        self.history_view.setReadOnly(True)
+        self.history_view.setPlaceholderText("Generation history will appear here...")
+        layout.addWidget(self.history_view)
+        export_row = QHBoxLayout()
+        export_row.addStretch()
+        self.export_history_btn = QPushButton("📤 Export metrics")
+        self.export_history_btn.setToolTip("Save every generation of this session with Ollama's timings as CSV or JSONL")
+        self.export_history_btn.clicked.connect(self.export_history)
+        export_row.addWidget(self.export_history_btn)
+        layout.addLayout(export_row)
+        self.update_history_view()
+
+    def update_history_view(self):
+        if self.history_view is None:
+            return
+        self.export_history_btn.setEnabled(bool(self.generation_history))
+        if not self.generation_history:
+            self.history_view.clear()
+            return
+        history_text = "📜 GENERATION HISTORY\n" + "="*50 + "\n\n"
+        for i, gen in enumerate(self.generation_history[-10:], 1):  # Show last 10
+            history_text += f"{i}. [{gen['timestamp'][11:]}] {gen['length']} chars - {gen['genre']} - {gen['model']}"
+            history_text += " [chat]" if gen.get('prompt_mode') == "chat" else ""
+            history_text += " (cached)\n" if gen['cached'] else "\n"
+            history_text += f"   {self.format_metrics(gen)}\n\n"
+        self.history_view.setText(history_text)
+
+    @staticmethod
+    def format_metrics(gen):
+        """One line splitting a generation's time into model load, prompt evaluation and decoding"""
+        def ms(ns):
+            return f"{ns / 1e6:.0f} ms" if ns is not None else "?"
+
+        def rate(value):
+            return f"{value:.1f} tok/s" if value else "? tok/s"
+
+        if gen['total_duration'] is None:
+            return "no timings reported"
+        return (f"load {ms(gen['load_duration'])} | "
+                f"prompt {gen['prompt_eval_count'] or 0} tok in {ms(gen['prompt_eval_duration'])} "
+                f"({rate(gen['prompt_tokens_per_s'])}) | "
+                f"output {gen['eval_count'] or 0} tok in {ms(gen['eval_duration'])} ({rate(gen['tokens_per_s'])}) | "
+                f"total {ms(gen['total_duration'])}")
+
+    def export_history(self):
+        if not self.generation_history:
+            return
+        default_name = f"generations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        file_path, selected = QFileDialog.getSaveFileName(self, "Export generation metrics", default_name,
+                                                          "CSV (*.csv);;JSON Lines (*.jsonl)")
+        if not file_path:
+            return
+        try:
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                if file_path.lower().endswith(".jsonl") or selected.startswith("JSON"):
+                    for gen in self.generation_history:
+                        f.write(json.dumps(gen, ensure_ascii=False) + "\n")
+                else:
+                    # Entries differ in their keys (e.g. stopped or cached generations), so every column is kept
+                    fieldnames = list(dict.fromkeys(key for gen in self.generation_history for key in gen))
+                    writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+                    writer.writeheader()
+                    writer.writerows(self.generation_history)
+            self.statusBar.showMessage(f"✓ Exported {len(self.generation_history)} generations to {file_path}")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to export: {str(e)}")
+
+    def update_memory_view(self, force=False):
+        """Update the memory context view to show what AI will see.
+
+        The preview is only rebuilt while the Memory tab is visible (or when
+        `force` is set); otherwise it is marked stale and rebuilt on first show.
+        """
+        self.memory_view_dirty = True
+        if not force and self.editor_tabs.currentWidget() is not self.memory_tab:
+            return
+        self.memory_view_dirty = False
         
         if not self.memory_enabled:
-            self.memory_view.setText("⏸️ Memory is currently disabled.\n\nEnable it to let AI remember your previous writing.")
+            self.set_memory_view_text("⏸️ Memory is currently disabled.\n\nEnable it to let AI remember your previous writing.")
             return
         
-        if not text.strip():
-            self.memory_view.setText("📝 Start writing to build memory context...\n\nThe AI will use recent text to maintain continuity.")
+        if self.doc_stats.word_count == 0:
+            self.set_memory_view_text("📝 Start writing to build memory context...\n\nThe AI will use recent text to maintain continuity.")
             return
         
         # Show the context that will be sent to AI
-        context_start = max(0, len(text) - self.context_chars)
-        context_text = text[context_start:]
+        context_text = document_tail(self.editor.document(), self.context_chars)
+        
+        summary_section = ""
+        if self.rolling_summary_enabled and self.memory_summary:
+            stats = self.memory_summary_stats
+            summary_section = f"""📚 STORY SUMMARY ({stats.get('chunks', 0)} sections, {stats.get('levels', 0)} levels)
+{self.memory_summary}
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+"""
+        
+        budget = self.last_budget
+        if budget.get('instruction') is not None:
+            free = budget['num_ctx'] - budget['total'] - budget['output']
+            summary_section += f"""🧮 TOKEN BUDGET (last generation, num_ctx {budget['num_ctx']} of {budget['model_ctx']})
+Instruction {budget['instruction']} | Summary {budget['summary']} | Passages {budget['passages']}
+Context {budget['context']} | Current {budget['current']} | Output {budget['output']} | Free {free}
+"""
+            if budget['trimmed_context_chars'] or budget['trimmed_summary_chars']:
+                summary_section += (f"Trimmed to fit: {budget['trimmed_context_chars']} context chars, "
+                                    f"{budget['trimmed_summary_chars']} summary chars\n")
+            summary_section += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+        
+        if self.retrieval_enabled and self.retrieval_stats:
+            scope = f" across {len(self.project.chapters)} chapters" if self.project else ""
+            summary_section += f"🔎 RETRIEVAL INDEX: {self.retrieval_stats.get('paragraphs', 0)} paragraphs{scope}\n"
+            for score, passage in self.last_retrieved:
+                summary_section += f"  • ({score:.2f}) {passage[:120]}\n"
+            summary_section += "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+        
+        chapter_line = ""
+        if self.project is not None:
+            chapter_line = (f"Chapter: {self.chapter.title} ({self.project.chapters.index(self.chapter) + 1} of "
+                            f"{len(self.project.chapters)}, {len(self.open_chapters)} loaded)\n")
         
         memory_info = f"""🧠 MEMORY CONTEXT PREVIEW
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-Context Length: {len(context_text)} / {self.context_chars} characters
-Total Document: {len(text)} characters
+{chapter_line}Context Length: {len(context_text)} / {self.context_chars} characters (~{estimate_tokens(context_text)} tokens)
+Total Document: {self.doc_stats.char_count} characters
 Generations in Session: {len(self.generation_history)}
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
+{summary_section}
 {context_text if context_text else "(No context yet)"}
 
 ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 💡 The AI will see this context + your current cursor position to continue writing seamlessly.
 """
-        self.memory_view.setText(memory_info)
+        self.set_memory_view_text(memory_info)
+
+    def set_memory_view_text(self, text):
+        """Patch the memory view in place, replacing only the span that changed"""
+        if self.memory_view is None:
+            self.memory_view_dirty = True
+            return
+        old = self.memory_view_text
+        if text == old:
+            return
+        prefix, suffix = common_affix_lengths(old, text)
+        start = utf16_len(old[:prefix])
+        end = start + utf16_len(old[prefix:len(old) - suffix])
+        
+        cursor = QTextCursor(self.memory_view.document())
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        cursor.insertText(text[prefix:len(text) - suffix])
+        self.memory_view_text = text
 
     def clear_memory(self):
         """Clear the generation history (not the document)"""
@@ -863,73 +2307,513 @@ Generations in Session: {len(self.generation_history)}
                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
             self.generation_history = []
-            self.history_view.clear()
+            self.kv_session = None
+            self.memory_summary = ""
+            self.update_history_view()
             self.update_memory_view()
             self.statusBar.showMessage("🗑️ Memory cleared - Starting fresh context")
             QMessageBox.information(self, "Memory Cleared", "Generation history has been cleared.\n\nYour document is safe - only the AI's session memory was reset.")
 
-    def scan_models(self):
-        self.statusBar.showMessage("🔍 Scanning for models...")
+    def has_models(self):
+        return self.model_combo.count() > 0 and self.model_combo.itemText(0) not in MODEL_PLACEHOLDERS
+
+    def show_cached_models(self):
+        """Fill the model picker from the last scan so it is usable before Ollama answers"""
+        cached = self.model_cache.get(MODEL_CACHE_KEY)
+        if not cached.get('models'):
+            return
         self.model_combo.clear()
-        self.model_combo.addItem("Scanning...")
-        self.generate_btn.setEnabled(False)
+        self.model_combo.addItems(cached['models'])
+        if cached.get('selected') in cached['models']:
+            self.model_combo.setCurrentText(cached['selected'])
+        STARTUP.mark("cached models shown")
+
+    def scan_models(self):
+        if self.has_models():
+            # Keep the known models usable while the list is refreshed
+            self.statusBar.showMessage("🔍 Refreshing models...")
+        else:
+            self.statusBar.showMessage("🔍 Scanning for models...")
+            self.model_combo.clear()
+            self.model_combo.addItem("Scanning...")
+            self.generate_btn.setEnabled(False)
         
-        self.worker = OllamaWorker(endpoint="scan")
-        self.worker.models_loaded.connect(self.on_models_loaded)
-        self.worker.error.connect(self.on_error)
-        self.worker.start()
+        if self.scan_worker is not None and self.scan_worker.isRunning():
+            return  # The running scan answers this request too
+        self.scan_worker = OllamaWorker(endpoint="scan")
+        self.scan_worker.models_loaded.connect(self.on_models_loaded)
+        self.scan_worker.error.connect(self.on_scan_error)
+        self.scan_worker.start()
 
     def on_models_loaded(self, models):
+        self.finish_startup()
+        selected = self.model_combo.currentText()
+        self.model_combo.blockSignals(True)
         self.model_combo.clear()
         if not models:
             self.model_combo.addItem("No models found")
+        else:
+            self.model_combo.addItems(models)
+            if selected in models:
+                self.model_combo.setCurrentText(selected)
+        self.model_combo.blockSignals(False)
+        self.model_cache.put(MODEL_CACHE_KEY, models=models)
+        if not models:
             self.statusBar.showMessage("❌ No models available")
             self.generate_btn.setEnabled(False)
+            return
+        self.statusBar.showMessage(f"✓ {len(models)} models available | 🧠 Memory Ready")
+        self.refresh_text_stats()
+        if self.model_combo.currentText() != selected:
+            self.on_model_selected(self.model_combo.currentText())
+        self.update_resident_label()
+
+    def on_scan_error(self, error_msg):
+        if self.has_models():
+            self.finish_startup()
+            self.statusBar.showMessage(f"⚠️ Showing the last known models - {error_msg}")
+            return
+        self.on_error(error_msg)
+
+    def keep_alive(self):
+        """keep_alive value sent to Ollama, or None to leave the server default"""
+        return f"{self.keep_alive_minutes}m" if self.keep_alive_minutes else None
+
+    def on_keep_alive_changed(self, value):
+        self.keep_alive_minutes = value
+
+    def on_model_selected(self, model):
+        if model in MODEL_PLACEHOLDERS or not model:
+            return
+        self.model_cache.put(MODEL_CACHE_KEY, selected=model)
+        self.update_resident_label()
+        if self.background_started:
+            self.warm_model(model)
+
+    def warm_model(self, model):
+        """Load the model in the background so the first generation doesn't wait for it"""
+        if model in MODEL_PLACEHOLDERS or not model or model in self.resident:
+            return
+        if self.model_load_worker is not None and self.model_load_worker.model == model:
+            return
+        worker = self.model_load_worker = OllamaWorker(endpoint="load", model=model,
+                                                       keep_alive=self.keep_alive())
+        worker.model_ready.connect(self.on_model_ready)
+        worker.error.connect(functools.partial(self.on_model_load_error, worker))
+        self.resident_label.setText("⏳ Loading")
+        self.resident_label.setToolTip(f"Loading {model} into memory...")
+        worker.start()
+
+    def on_model_ready(self, model, seconds):
+        if self.model_load_worker is not None and self.model_load_worker.model == model:
+            self.retire_worker(self.model_load_worker)
+            self.model_load_worker = None
+        self.statusBar.showMessage(f"🟢 {model} loaded in {seconds:.1f} s")
+        self.poll_resident_models()
+
+    def on_model_load_error(self, worker, error_msg):
+        if worker is self.model_load_worker:
+            self.retire_worker(worker)
+            self.model_load_worker = None
+        self.statusBar.showMessage(f"⚠️ Could not load {worker.model}: {error_msg}")
+        self.update_resident_label()
+
+    def poll_resident_models(self):
+        if self.resident_worker is not None and self.resident_worker.isRunning():
+            return
+        self.resident_worker = OllamaWorker(endpoint="ps")
+        self.resident_worker.resident_models.connect(self.on_resident_models)
+        self.resident_worker.start()
+
+    def on_resident_models(self, models):
+        self.resident = {entry.get('name'): entry for entry in models}
+        self.update_resident_label()
+
+    def update_queue_label(self):
+        """Show how many Ollama requests wait for a free slot and how long the oldest has waited"""
+        status = get_ollama_client().queue_status()
+        if status['waiting']:
+            self.queue_label.setText(f"⏳ {status['waiting']} queued, {status['longest_wait_s']:.1f} s")
         else:
-            self.model_combo.addItems(models)
-            self.statusBar.showMessage(f"✓ {len(models)} models available | 🧠 Memory Ready")
-            self.on_text_changed()
+            self.queue_label.setText("")
+        tooltip = f"{status['running']} of {status['slots']} Ollama slots busy"
+        if status['last_wait_s'] is not None:
+            tooltip += f"\nLast request waited {status['last_wait_s']:.1f} s"
+        self.queue_label.setToolTip(tooltip)
+
+    def update_resident_label(self):
+        """Show whether the selected model is in memory; the tooltip lists every loaded model"""
+        model = self.model_combo.currentText()
+        if self.model_load_worker is not None and self.model_load_worker.model == model:
+            return
+        if model in MODEL_PLACEHOLDERS:
+            self.resident_label.setText("")
+        elif model in self.resident:
+            self.resident_label.setText("🟢 In memory")
+        else:
+            self.resident_label.setText("⚪ Not loaded")
+        lines = []
+        for name, entry in self.resident.items():
+            vram = entry.get('size_vram') or 0
+            expires = (entry.get('expires_at') or "")[:19].replace("T", " ")
+            where = f" on {entry['host']}" if len(OLLAMA_HOSTS) > 1 and entry.get('host') else ""
+            lines.append(f"{name}{where}  {vram / 1024**3:.1f} GB VRAM  until {expires}".rstrip())
+        tooltip = "\n".join(lines) or "No models loaded"
+        if len(OLLAMA_HOSTS) > 1:
+            hosts = [f"{'✓' if healthy else '✗ unreachable'} {url}  {active} running"
+                     for url, healthy, active, _ in get_ollama_client().status()]
+            tooltip += "\n\n" + "\n".join(hosts)
+        self.resident_label.setToolTip(tooltip)
 
     def start_generation(self):
-        text = self.editor.toPlainText()
         model = self.model_combo.currentText()
+        if self.import_worker is not None:
+            self.statusBar.showMessage("⏳ Wait for the document to finish opening")
+            return
+        if self.generation_worker is not None or any(not c['done'] for c in self.candidates):
+            return  # Ctrl+Enter while the AI is writing; the running generation is the same request
         
-        if not text.strip() or model in ["Select model...", "No models found"]:
+        if self.doc_stats.word_count == 0 or model in MODEL_PLACEHOLDERS:
             QMessageBox.warning(self, "Warning", "Please enter text and select a model.")
             return
 
-        self.generation_cursor_pos = len(text)
-        
-        # Get context for memory
-        context = None
-        if self.memory_enabled and len(text) > self.context_chars:
-            context_start = max(0, len(text) - self.context_chars)
-            context = text[context_start:self.generation_cursor_pos]
-        elif self.memory_enabled:
-            context = text[:self.generation_cursor_pos]
+        self.generation_cursor_pos = document_end(self.editor.document())
+        self.stream_insert_pos = self.generation_cursor_pos
+        self.stream_buffer = []
+        self.generation_streamed = self.streaming_enabled
+        self.last_generation_stats = {}
+        self.speed_label.setText("")
+        self.pending_kv_tokens = None
+        self.generation_kv_key = (model, self.selected_genre)
+        self.warmup_timer.stop()
+        self.cancel_warmup()
+        
+        worker_args = self.generation_args(model)
+        context = worker_args['context']
         
         # Update memory view with actual context being sent
         if self.memory_enabled and context:
-            self.memory_view.setText(f"📤 SENDING TO AI:\n\n{context[-500:] if len(context) > 500 else context}\n\n...")
+            self.set_memory_view_text(f"📤 SENDING TO AI:\n\n{context[-500:] if len(context) > 500 else context}\n\n...")
         
         # UI State: Loading
         self.generate_btn.setEnabled(False)
         self.generate_btn.setText("⏳ Writing...")
+        self.stop_btn.show()
         self.progress_bar.show()
         memory_status = "🧠 With Memory" if self.memory_enabled else "⏸️ No Memory"
         self.statusBar.showMessage(f"AI is writing ({memory_status}, {self.selected_genre}, Temp: {self.temperature:.2f})...")
         self.editor.setEnabled(False)
         
-        self.worker = OllamaWorker(endpoint="generate", model=model, prompt=text[self.generation_cursor_pos:], 
-                                   context=context, temperature=self.temperature, token_limit=self.token_limit, 
-                                   genre=self.selected_genre)
-        self.worker.finished.connect(self.on_generation_finished)
-        self.worker.error.connect(self.on_error)
-        self.worker.start()
+        if self.candidate_count > 1:
+            self.start_candidates(worker_args)
+            return
+        
+        worker = self.generation_worker = OllamaWorker(**worker_args)
+        worker.partial.connect(self.on_generation_partial)
+        worker.stats.connect(self.on_generation_stats)
+        worker.kv_context.connect(self.on_kv_context)
+        worker.finished.connect(self.on_generation_finished)
+        worker.cancelled.connect(self.on_generation_cancelled)
+        worker.error.connect(self.on_error)
+        worker.start()
+
+    def generation_args(self, model):
+        """OllamaWorker arguments for continuing the document, shared by generations and warm-ups.
+
+        Only the blocks at the end of the document are read, never the whole text.
+        """
+        document = self.editor.document()
+        
+        # Get context for memory
+        context = None
+        if self.memory_enabled and self.chat_prompt_enabled:
+            # The window moves in steps, so consecutive prompts share their context prefix
+            context = document_text(document, stable_context_start(document_end(document), self.context_chars))
+        elif self.memory_enabled:
+            context = document_tail(document, self.context_chars)
+        
+        # Reuse Ollama's context tokens when the document only grew at the end
+        kv_tokens = self.reusable_kv_tokens(model)
+        if kv_tokens:
+            context = document_text(document, self.kv_session['length'])
+        
+        # Older text reaches the model through the rolling summary
+        memory_summary = None
+        if self.memory_enabled and self.rolling_summary_enabled and self.doc_stats.char_count > self.context_chars:
+            memory_summary = self.memory_summary or None
+        
+        # Related earlier passages are looked up in the worker thread
+        retriever = None if kv_tokens else self.make_retriever(document)
+        
+        return dict(endpoint="generate", model=model, prompt="", 
+                    context=context, temperature=self.temperature, token_limit=self.token_limit, 
+                    genre=self.selected_genre, memory_summary=memory_summary,
+                    stream=self.streaming_enabled,
+                    kv_tokens=kv_tokens, deadline=self.generation_deadline,
+                    min_tokens_per_second=self.min_tokens_per_second,
+                    retriever=retriever, num_ctx_limit=self.num_ctx_limit,
+                    seed=self.seed, cache=self.completion_cache, keep_alive=self.keep_alive(),
+                    chat=self.chat_prompt_enabled)
+
+    def start_candidates(self, worker_args):
+        """Send the same prompt several times at once with different seeds (and temperatures)"""
+        self.clear_candidates()
+        count = self.candidate_count
+        base_seed = self.seed or random.randrange(1, 2**31 - count)
+        if worker_args['retriever']:
+            # Passages are looked up once and shared by all candidates
+            worker_args['retriever'] = functools.lru_cache(maxsize=None)(worker_args['retriever'])
+        for i in range(count):
+            temperature = self.temperature
+            if self.spread_temperatures and count > 1:
+                offset = CANDIDATE_TEMPERATURE_SPREAD * (2 * i / (count - 1) - 1)
+                temperature = min(2.0, max(0.0, self.temperature + offset))
+            seed = base_seed + i
+            
+            box = QGroupBox(f"#{i + 1} · temp {temperature:.2f} · seed {seed}")
+            box_layout = QVBoxLayout(box)
+            view = QTextEdit()
+            view.setObjectName("memory-view")
+            view.setReadOnly(True)
+            view.setMinimumHeight(140)
+            box_layout.addWidget(view)
+            use_btn = QPushButton("✅ Use this")
+            use_btn.setEnabled(False)
+            use_btn.clicked.connect(functools.partial(self.pick_candidate, i))
+            box_layout.addWidget(use_btn)
+            self.candidates_list_layout.insertWidget(i, box)
+            
+            # A seed picked here is still a random draw: only a fixed seed (or temperature 0) makes it reproducible
+            cache = worker_args['cache'] if self.seed or temperature == 0 else None
+            worker = OllamaWorker(**dict(worker_args, temperature=temperature, seed=seed, stream=True, cache=cache))
+            candidate = {'worker': worker, 'box': box, 'view': view, 'button': use_btn,
+                         'buffer': [], 'text': "", 'done': False, 'stats': {}, 'kv_tokens': None}
+            self.candidates.append(candidate)
+            worker.partial.connect(functools.partial(self.on_candidate_partial, i))
+            worker.stats.connect(functools.partial(self.on_candidate_stats, i))
+            worker.kv_context.connect(functools.partial(self.on_candidate_kv_context, i))
+            worker.finished.connect(functools.partial(self.on_candidate_finished, i))
+            worker.cancelled.connect(functools.partial(self.on_candidate_stopped, i))
+            worker.error.connect(functools.partial(self.on_candidate_stopped, i, ""))
+        
+        self.candidates_panel.show()
+        for candidate in self.candidates:
+            candidate['worker'].start()
+        self.statusBar.showMessage(f"🎲 Writing {count} candidates in parallel...")
+
+    def on_candidate_partial(self, index, text):
+        self.candidates[index]['buffer'].append(text)
+        self.candidates[index]['button'].setEnabled(True)
+        if not self.candidate_timer.isActive():
+            self.candidate_timer.start()
+
+    def flush_candidate_buffers(self):
+        pending = False
+        for candidate in self.candidates:
+            if candidate['buffer']:
+                pending = True
+                chunk = "".join(candidate['buffer'])
+                candidate['buffer'] = []
+                candidate['text'] += chunk
+                cursor = QTextCursor(candidate['view'].document())
+                cursor.movePosition(QTextCursor.End)
+                cursor.insertText(chunk)
+        if not pending:
+            self.candidate_timer.stop()
+
+    def on_candidate_stats(self, index, stats):
+        self.candidates[index]['stats'] = stats
+        self.update_cache_label()
+
+    def on_candidate_kv_context(self, index, tokens):
+        self.candidates[index]['kv_tokens'] = tokens
+
+    def on_candidate_finished(self, index, completion):
+        self.flush_candidate_buffers()
+        candidate = self.candidates[index]
+        candidate['text'] = completion
+        candidate['done'] = True
+        candidate['button'].setEnabled(bool(completion.strip()))
+        self.check_candidates_done()
+
+    def on_candidate_stopped(self, index, partial_text, reason):
+        self.flush_candidate_buffers()
+        candidate = self.candidates[index]
+        candidate['done'] = True
+        candidate['text'] = partial_text or candidate['text']
+        candidate['box'].setTitle(f"{candidate['box'].title()} · ⚠️ {reason}")
+        candidate['button'].setEnabled(bool(candidate['text'].strip()))
+        self.check_candidates_done()
+
+    def check_candidates_done(self):
+        if all(candidate['done'] for candidate in self.candidates):
+            self.progress_bar.hide()
+            self.stop_btn.hide()
+            self.statusBar.showMessage("🎲 All candidates ready - pick one to insert it")
+
+    def pick_candidate(self, index):
+        """Insert the chosen candidate at the generation position and drop the others"""
+        self.flush_candidate_buffers()
+        candidate = self.candidates[index]
+        text = candidate['text'] if candidate['done'] else candidate['worker'].partial_text()
+        self.stop_candidates()
+        
+        self.generation_streamed = False
+        self.last_generation_stats = candidate['stats']
+        self.pending_kv_tokens = candidate['kv_tokens'] if candidate['done'] else None
+        self.clear_candidates()
+        self.on_generation_finished(text)
+
+    def stop_candidates(self, reason="Candidate chosen"):
+        """Abort candidates still running, keeping the text they have so far"""
+        for candidate in self.candidates:
+            worker = candidate['worker']
+            if candidate['done']:
+                continue
+            for signal in (worker.partial, worker.stats, worker.kv_context,
+                           worker.finished, worker.cancelled, worker.error):
+                signal.disconnect()
+            worker.cancel(reason)
+            candidate['text'] = worker.partial_text()
+            candidate['done'] = True
+            candidate['button'].setEnabled(bool(candidate['text'].strip()))
+
+    def discard_candidates(self):
+        self.stop_candidates("Discarded")
+        self.clear_candidates()
+        self.reset_generation_ui()
+        self.statusBar.showMessage("🗑️ Candidates discarded")
+        self.refresh_text_stats()
+
+    def clear_candidates(self):
+        self.candidate_timer.stop()
+        for candidate in self.candidates:
+            self.retire_worker(candidate['worker'])
+            candidate['box'].deleteLater()
+        self.candidates = []
+        self.candidates_panel.hide()
+
+    def stop_generation(self):
+        if self.candidates and not all(c['done'] for c in self.candidates):
+            # Keep what each candidate has written so far; it can still be picked
+            self.flush_candidate_buffers()
+            self.stop_candidates("Stopped by user")
+            self.check_candidates_done()
+            self.statusBar.showMessage("⏹ Stopped - pick a candidate to insert it")
+            return
+        
+        worker = self.generation_worker
+        if worker is None or not self.stop_btn.isVisible():
+            return
+        # Abort the request, then finish up with what has arrived so far without
+        # waiting for the thread; late signals from it are no longer connected
+        for signal in (worker.partial, worker.stats, worker.kv_context,
+                       worker.finished, worker.cancelled, worker.error):
+            signal.disconnect()
+        worker.cancel("Stopped by user")
+        self.on_generation_cancelled(worker.partial_text(), worker.cancel_reason)
+
+    def on_generation_cancelled(self, partial_text, reason):
+        self.generation_worker = None
+        if self.generation_streamed:
+            self.stream_timer.stop()
+            if self.keep_partial:
+                self.flush_stream_buffer()
+            else:
+                self.stream_buffer = []
+                cursor = self.editor.textCursor()
+                cursor.setPosition(self.generation_cursor_pos)
+                cursor.setPosition(self.stream_insert_pos, QTextCursor.KeepAnchor)
+                cursor.removeSelectedText()
+        elif self.keep_partial and partial_text:
+            self.stream_buffer = [partial_text]
+            self.flush_stream_buffer()
+        
+        # The returned context tokens never arrived, so the text no longer matches them
+        self.kv_session = None
+        self.flush_autosave()
+        self.reset_generation_ui()
+        kept = "text kept" if self.keep_partial else "text discarded"
+        self.statusBar.showMessage(f"⏹ {reason} ({kept})")
+        self.refresh_text_stats()
+
+    def reset_generation_ui(self):
+        self.progress_bar.hide()
+        self.stop_btn.hide()
+        self.generate_btn.setText("✨ Generate")
+        self.editor.setEnabled(True)
+        self.editor.setFocus()
+
+    def reusable_kv_tokens(self, model):
+        """Return the last context tokens if they still describe the start of the document"""
+        session = self.kv_session
+        if not (self.kv_reuse_enabled and self.memory_enabled and session) or self.chat_prompt_enabled:
+            return None
+        if session['key'] != (model, self.selected_genre):
+            return None
+        num_ctx = min(self.num_ctx_limit, MODEL_CONTEXT_LENGTHS.get(model, FALLBACK_MODEL_CONTEXT))
+        if len(session['tokens']) + self.token_limit > num_ctx - PROMPT_SAFETY_TOKENS:
+            return None
+        # Edits before session['length'] clear the session (on_contents_change), so only growth is left
+        if document_end(self.editor.document()) < session['length']:
+            return None
+        return session['tokens']
+
+    def on_kv_context(self, tokens):
+        self.pending_kv_tokens = tokens
+
+    def on_generation_partial(self, text):
+        self.stream_buffer.append(text)
+        if not self.stream_timer.isActive():
+            self.stream_timer.start()
+
+    def flush_stream_buffer(self):
+        """Insert all streamed text received since the last frame in one edit"""
+        if not self.stream_buffer:
+            self.stream_timer.stop()
+            return
+        
+        chunk = "".join(self.stream_buffer)
+        self.stream_buffer = []
+        
+        cursor = self.editor.textCursor()
+        cursor.setPosition(self.stream_insert_pos)
+        if self.stream_insert_pos == self.generation_cursor_pos and self.stream_insert_pos > 0:
+            previous = self.editor.document().characterAt(self.stream_insert_pos - 1)
+            if not previous.isspace() and not chunk[0].isspace():
+                cursor.insertText(" ")
+        cursor.insertText(chunk)
+        self.stream_insert_pos = cursor.position()
+        self.editor.setTextCursor(cursor)
+        self.editor.ensureCursorVisible()
+        
+        worker = self.generation_worker
+        rate = worker.generation.tokens_per_second() if worker is not None else None
+        if rate:
+            self.speed_label.setText(f"⚡ {rate:.1f} tok/s")
+
+    def on_generation_stats(self, stats):
+        self.last_generation_stats = stats
+        self.update_cache_label()
+        if stats.get('budget'):
+            self.last_budget = stats['budget']
+        if self.generation_worker is not None:
+            self.last_retrieved = self.generation_worker.passages
+
+    def update_cache_label(self):
+        cache = self.completion_cache
+        lookups = cache.hits + cache.misses
+        if lookups:
+            self.cache_label.setText(f"💾 {cache.hits}/{lookups} cached")
 
     def on_generation_finished(self, completion):
+        self.flush_stream_buffer()
+        self.stream_timer.stop()
+        
         # UI State: Ready
+        self.generation_worker = None
         self.progress_bar.hide()
+        self.stop_btn.hide()
         self.generate_btn.setEnabled(True)
         self.generate_btn.setText("✨ Generate")
         self.editor.setEnabled(True)
@@ -939,90 +2823,621 @@ Generations in Session: {len(self.generation_history)}
             self.statusBar.showMessage("⚠️ No completion generated")
             return
         
-        # Add to generation history
-        self.generation_history.append({
-            'timestamp': datetime.now().strftime("%H:%M:%S"),
+        # Add to generation history, with Ollama's timings for the metrics export
+        stats = self.last_generation_stats
+        metrics = generation_metrics(stats)
+        self.generation_history.append(dict({
+            'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'model': self.generation_kv_key[0],
             'length': len(completion),
-            'genre': self.selected_genre
-        })
-        
-        # Update history tab
-        history_text = "📜 GENERATION HISTORY\n" + "="*50 + "\n\n"
-        for i, gen in enumerate(self.generation_history[-10:], 1):  # Show last 10
-            history_text += f"{i}. [{gen['timestamp']}] {gen['length']} chars - {gen['genre']}\n"
-        self.history_view.setText(history_text)
-        
-        # Insert completion at cursor position
-        cursor = self.editor.textCursor()
-        cursor.setPosition(self.generation_cursor_pos)
-        
-        text = self.editor.toPlainText()
-        if text and not text[-1].isspace() and completion and not completion[0].isspace():
-            cursor.insertText(" ")
-        
-        cursor.insertText(completion)
-        self.editor.setTextCursor(cursor)
-        
-        self.statusBar.showMessage(f"✓ Completion added ({len(completion)} chars) | 🧠 Memory Updated")
-        self.on_text_changed()
+            'genre': self.selected_genre,
+            'cached': bool(stats.get('cache')),
+            'first_token_s': stats.get('first_token_s'),
+            'host': (stats.get('timing') or {}).get('host'),
+            'kv_reused_tokens': stats.get('kv_reused_tokens', 0),
+            'prompt_mode': stats.get('prompt_mode'),
+        }, **metrics))
+        if metrics['tokens_per_s'] and not stats.get('cache'):
+            self.speed_label.setText(f"⚡ {metrics['tokens_per_s']:.1f} tok/s")
+        
+        self.update_history_view()
+        
+        # Streamed completions are already in the editor
+        if not self.generation_streamed:
+            # Insert completion at cursor position
+            cursor = self.editor.textCursor()
+            cursor.setPosition(self.generation_cursor_pos)
+            
+            position = self.generation_cursor_pos
+            previous = self.editor.document().characterAt(position - 1) if position > 0 else " "
+            if not previous.isspace() and completion and not completion[0].isspace():
+                cursor.insertText(" ")
+            
+            cursor.insertText(completion)
+            self.editor.setTextCursor(cursor)
+        # A completion is expensive to get again; journal it now rather than at the next interval
+        self.flush_autosave()
+        
+        timing = self.last_generation_stats.get('timing_summary', '')
+        self.remember_kv_session()
+        self.poll_resident_models()
+        
+        details = [timing] if timing else []
+        warm = self.record_warmup_result(self.last_generation_stats.get('prompt_fingerprint'))
+        if warm:
+            details.append("🔥 warm start")
+        if self.last_generation_stats.get('cache'):
+            details.append("💾 from cache")
+        request = self.last_generation_stats.get('timing') or {}
+        if request.get('host') and len(OLLAMA_HOSTS) > 1:
+            details.append(f"🖥️ {request['host']}")
+        if (request.get('queued_s') or 0) >= 0.1:
+            details.append(f"⏳ waited {request['queued_s']:.1f} s for a free slot")
+        reused = self.last_generation_stats.get('kv_reused_tokens', 0)
+        if reused:
+            evaluated = self.last_generation_stats.get('prompt_eval_count', 0)
+            details.append(f"♻️ {reused} cached tokens reused, {evaluated} evaluated")
+        elif self.last_generation_stats.get('prompt_mode') == "chat" and not self.last_generation_stats.get('cache'):
+            evaluated = self.last_generation_stats.get('prompt_eval_count') or 0
+            details.append(f"💬 {evaluated} prompt tokens evaluated")
+        self.statusBar.showMessage(" | ".join([f"✓ Completion added ({len(completion)} chars) | 🧠 Memory Updated"] + details))
+        self.refresh_text_stats()
         self.update_memory_view()
 
+    def remember_kv_session(self):
+        """Keep the returned context tokens together with the text they now cover"""
+        if not (self.kv_reuse_enabled and self.memory_enabled and self.pending_kv_tokens):
+            self.kv_session = None
+            return
+        self.kv_session = {
+            'key': self.generation_kv_key,
+            'tokens': self.pending_kv_tokens,
+            'length': document_end(self.editor.document()),
+        }
+
     def on_error(self, error_msg):
+        self.flush_stream_buffer()
+        self.stream_timer.stop()
+        self.generation_worker = None
         self.progress_bar.hide()
+        self.stop_btn.hide()
         self.generate_btn.setEnabled(True)
         self.generate_btn.setText("✨ Generate")
         self.editor.setEnabled(True)
         self.statusBar.showMessage("❌ Error")
+        self.finish_startup()
         QMessageBox.critical(self, "Error", error_msg)
 
     def save_txt(self):
-        text = self.editor.toPlainText()
-        if not text.strip():
+        self.export_as('txt')
+
+    def save_docx(self):
+        self.export_as('docx')
+
+    def export_as(self, format):
+        """Ask for a file name, then export the document (or the whole project) in the background"""
+        if self.export_worker is not None:
+            self.statusBar.showMessage("⏳ Wait for the running export to finish")
+            return
+        if self.project is None and self.doc_stats.word_count == 0:
             QMessageBox.warning(self, "Warning", "No text to save!")
             return
         
-        default_name = f"document_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        file_path, _ = QFileDialog.getSaveFileName(self, "Save as TXT", default_name, "Text Files (*.txt)")
-        
+        caption, file_filter = EXPORT_DIALOGS[format]
+        name = os.path.splitext(self.project.name)[0] if self.project else "document"
+        default_name = f"{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{EXPORTERS[format].extension}"
+        file_path, _ = QFileDialog.getSaveFileName(self, caption, default_name, file_filter)
         if file_path:
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(text)
-                self.statusBar.showMessage(f"✓ Saved to {file_path}")
-                self.current_file = file_path
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to save: {str(e)}")
+            self.start_export(file_path, format)
 
-    def save_docx(self):
-        if not DOCX_AVAILABLE:
-            QMessageBox.warning(self, "Warning", "python-docx not installed. Run: pip install python-docx")
+    def export_sources(self):
+        """(heading, text) pairs for export_document: the editor's document, or every chapter in order"""
+        if self.project is None:
+            # Kept: a saved .txt or .docx restarts the autosave journal from the text written
+            return [(None, DocumentReader(self.editor.document(), keep=True))]
+        sources = []
+        for chapter in self.project.chapters:
+            entry = self.open_chapters.get(chapter.id)
+            if entry is not None and entry['document'].isModified():
+                text = DocumentReader(entry['document'])
+            else:
+                text = functools.partial(self.project.read, chapter)  # Read by the export thread
+            # Chapters of a single-file book start with their own heading (or come before the first)
+            sources.append((None if self.project.single_file else chapter.title, text))
+        return sources
+
+    def start_export(self, file_path, format):
+        document = self.editor.document()
+        title = os.path.splitext(self.project.name)[0] if self.project else "AI Writer Document"
+        self.export_worker = ExportWorker(file_path, format, self.export_sources(), title)
+        self.export_worker.document = document
+        self.export_worker.progress.connect(self.export_progress.setValue)
+        self.export_worker.exported.connect(self.on_exported)
+        self.export_worker.cancelled.connect(self.on_export_cancelled)
+        self.export_worker.error.connect(self.on_export_error)
+        self.export_progress.setValue(0)
+        self.export_progress.show()
+        self.export_cancel_btn.show()
+        self.statusBar.showMessage(f"📤 Exporting to {file_path}...")
+        self.export_worker.start()
+
+    def cancel_export(self):
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+
+    def finish_export(self):
+        worker = self.export_worker
+        self.export_worker = None
+        self.export_progress.hide()
+        self.export_cancel_btn.hide()
+        return worker
+
+    def on_exported(self, stats):
+        worker = self.finish_export()
+        chapters = f", {stats['chapters']} chapters" if stats['chapters'] else ""
+        self.statusBar.showMessage(f"✓ Saved to {worker.path} ({stats['bytes'] / 1024:.0f} KB{chapters}, "
+                                   f"{stats['seconds']:.1f} s)")
+        if self.project is None and worker.format in ('txt', 'docx'):
+            self.current_file = worker.path
+            # Unchanged since it was read: the file holds everything, so the journal can start over
+            reader = worker.sources[0][1]
+            if self.editor.document() is worker.document and worker.document.revision() == reader.revision:
+                worker.document.setModified(False)
+                self.restart_autosave(self.scratch_autosave_key, reader.text,
+                                      {'title': os.path.basename(worker.path), 'file': worker.path})
+            reader.text = None
+
+    def on_export_cancelled(self):
+        self.finish_export()
+        self.statusBar.showMessage("⏹ Export cancelled")
+
+    def on_export_error(self, error_msg):
+        self.finish_export()
+        QMessageBox.critical(self, "Error", f"Failed to save: {error_msg}")
+
+    def open_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Document", "",
+                                              "Documents (*.txt *.md *.docx);;All Files (*)")
+        if path:
+            self.import_file(path)
+
+    def import_file(self, path):
+        """Read a manuscript in the background into a new document, inserting it a slice at a time"""
+        if self.generation_worker is not None or self.candidates:
+            self.statusBar.showMessage("⏳ Wait for the generation to finish before opening a document")
+            return
+        if self.import_worker is not None:
+            self.statusBar.showMessage("⏳ Another document is still opening")
+            return
+        if not self.confirm_unsaved_chapters():
             return
         
-        text = self.editor.toPlainText()
-        if not text.strip():
-            QMessageBox.warning(self, "Warning", "No text to save!")
+        self.cancel_warmup()
+        self.cancel_summary()
+        # The editor deletes its own first document when it is replaced; one opened earlier is ours to delete
+        old_document = self.editor.document()
+        stale = list(self.open_chapters.values())
+        if old_document.parent() is not self or any(old_document is entry['document'] for entry in stale):
+            old_document = None
+        if self.project is not None:
+            self.project = None
+            self.chapter = None
+            self.chapter_memory = {}
+            self.open_chapters = OrderedDict()
+            self.chapter_list.blockSignals(True)
+            self.chapter_list.clear()
+            self.chapter_list.blockSignals(False)
+            self.chapter_list.hide()
+            self.save_chapters_btn.setEnabled(False)
+            self.project_label.setText("No project open")
+        self.forget_autosave(self.scratch_autosave_key)
+        self.scratch_autosave_key = None
+        
+        document = QTextDocument(self)
+        document.setDocumentLayout(QPlainTextDocumentLayout(document))
+        document.setDefaultFont(self.editor.font())
+        document.setUndoRedoEnabled(False)  # Inserting the file is not something to undo piece by piece
+        self.set_editor_document(document, DocumentStats(document))
+        self.editor.setReadOnly(True)
+        for entry in stale:
+            self.forget_autosave(entry['autosave'])
+            entry['document'].deleteLater()
+        if old_document is not None:
+            old_document.deleteLater()
+        
+        self.current_file = None
+        self.memory_summary = ""
+        self.memory_summary_stats = {}
+        self.last_retrieved = []
+        self.last_budget = {}
+        self.kv_session = None
+        self.retrieval_index = None
+        self.retrieval_stats = {}
+        self.import_queue.clear()
+        self.import_result = None
+        self.import_pieces = 0
+        index_path = f"{path}.embeddings.npz" if self.retrieval_enabled and self.memory_enabled else None
+        self.import_worker = ImportWorker(path, index_path, self.embedding_backend() if index_path else None)
+        self.import_worker.chunk.connect(self.on_import_chunk)
+        self.import_worker.progress.connect(self.import_progress.setValue)
+        self.import_worker.imported.connect(self.on_imported)
+        self.import_worker.error.connect(self.on_import_error)
+        self.import_progress.setValue(0)
+        self.import_progress.show()
+        self.setWindowTitle(f"{os.path.basename(path)} - AI Writer Pro")
+        self.statusBar.showMessage(f"📂 Opening {path}...")
+        self.import_worker.started_at = time.perf_counter()
+        self.import_worker.start()
+
+    def on_import_chunk(self, text, counts):
+        self.import_queue.append((text, counts))
+        if not self.import_timer.isActive():
+            self.import_timer.start()
+
+    def insert_imported_text(self):
+        """Append queued pieces for up to IMPORT_SLICE_MS, then let the event loop paint and handle input"""
+        document = self.editor.document()
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        deadline = time.perf_counter() + IMPORT_SLICE_MS / 1000
+        while self.import_queue and time.perf_counter() < deadline:
+            text, counts = self.import_queue.popleft()
+            if self.import_pieces == 0:
+                self.doc_stats.supply(counts[1:])  # The first line goes into the document's empty block
+            else:
+                self.doc_stats.supply(counts)
+                text = "\n" + text
+            cursor.insertText(text)
+            self.import_pieces += 1
+            self.import_worker.piece_inserted()
+        if not self.import_queue:
+            self.import_timer.stop()
+            if self.import_result is not None:
+                self.finish_import()
+
+    def on_imported(self, result):
+        self.import_result = result
+        if not self.import_queue:
+            self.finish_import()
+
+    def finish_import(self):
+        worker = self.import_worker
+        result = self.import_result
+        self.import_worker = None
+        self.import_result = None
+        self.import_progress.hide()
+        document = self.editor.document()
+        document.setUndoRedoEnabled(True)
+        document.setModified(False)
+        self.editor.setReadOnly(False)
+        if self.doc_stats.char_count == max(0, result['chars']):
+            # The editor holds the file as it was read; the autosave thread reads it again for the journal
+            text = import_pieces(worker.path)
+        else:
+            # Qt split the text into blocks differently than the lines were counted
+            self.doc_stats.rebuild()
+            text = document.toPlainText()
+        
+        self.current_file = worker.path
+        name = os.path.basename(worker.path)
+        self.scratch_autosave_key = self.track_autosave(document, text, {'title': name, 'file': worker.path})
+        if 'index' in result:
+            self.retrieval_index = result['index']
+            self.retrieval_stats = {'paragraphs': len(result['index']), 'embedded': result['embedded'],
+                                    'seconds': result['total_seconds']}  # Indexed while it was read
+        
+        message = (f"✓ Opened {name}: {self.doc_stats.word_count} words "
+                   f"(read in {result['seconds']:.1f} s, shown in {time.perf_counter() - worker.started_at:.1f} s)")
+        if 'index_error' in result:
+            message += f" ⚠️ Retrieval index not updated: {result['index_error']}"
+        self.statusBar.showMessage(message)
+        self.refresh_text_stats()
+        self.update_memory_view()
+        self.update_rolling_summary()
+
+    def on_import_error(self, error_msg):
+        self.import_worker = None
+        self.import_timer.stop()
+        self.import_queue.clear()
+        self.import_progress.hide()
+        self.editor.document().setUndoRedoEnabled(True)
+        self.editor.setReadOnly(False)
+        self.scratch_autosave_key = self.track_autosave(self.editor.document(), self.editor.toPlainText(),
+                                                        {'title': "Untitled"})
+        self.editor.document().setModified(bool(self.doc_stats.word_count))
+        self.setWindowTitle("AI Writer Pro - With Memory")
+        QMessageBox.critical(self, "Error", f"Failed to open document: {error_msg}")
+
+    def open_project_folder(self):
+        path = QFileDialog.getExistingDirectory(self, "Open Project Folder")
+        if path:
+            self.open_project(path)
+
+    def open_project_file(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Open Book File", "", "Text Files (*.txt *.md)")
+        if path:
+            self.open_project(path)
+
+    def open_project(self, path):
+        """Open a folder of chapter files or a single-file book and show its first chapter"""
+        if self.generation_worker is not None or self.candidates:
+            self.statusBar.showMessage("⏳ Wait for the generation to finish before opening a project")
+            return
+        if not self.confirm_unsaved_chapters():
+            return
+        try:
+            project = Project(path)
+        except (OSError, ValueError) as e:
+            QMessageBox.critical(self, "Error", f"Failed to open project: {str(e)}")
+            return
+        if not project.chapters:
+            QMessageBox.warning(self, "Warning", "No chapters found.\n\nA project is a folder of .txt or .md files, "
+                                                 "or one file with a \"# \" heading per chapter.")
             return
         
-        default_name = f"document_{datetime.now().strftime('%Y%m%d_%H%M%S')}.docx"
-        file_path, _ = QFileDialog.getSaveFileName(self, "Save as DOCX", default_name, "Word Documents (*.docx)")
+        self.project = project
+        self.chapter = None
+        self.chapter_memory = {}
+        self.retrieval_index = None  # The project's own index is loaded on the next update
+        self.retrieval_stats = {}
+        self.current_file = None
+        self.chapter_list.blockSignals(True)
+        self.chapter_list.clear()
+        self.chapter_list.addItems([chapter.title for chapter in project.chapters])
+        self.chapter_list.blockSignals(False)
+        self.chapter_list.show()
+        self.save_chapters_btn.setEnabled(True)
+        # Documents of the previous project go after the new first chapter is shown
+        old_document = self.editor.document()
+        stale = list(self.open_chapters.values())
+        if old_document.parent() is not self or any(old_document is entry['document'] for entry in stale):
+            old_document = None  # The editor's own document is deleted when replaced; chapters are handled below
+        self.open_chapters = OrderedDict()
+        self.forget_autosave(self.scratch_autosave_key)
+        self.scratch_autosave_key = None
+        self.open_chapter(project.chapters[0])
+        for entry in stale:
+            self.forget_autosave(entry['autosave'])
+            if entry['document'] is not self.editor.document():
+                entry['document'].deleteLater()
+        if old_document is not None and old_document is not self.editor.document():
+            old_document.deleteLater()  # An opened file
+
+    def on_chapter_selected(self, row):
+        if self.project is not None and 0 <= row < len(self.project.chapters):
+            self.open_chapter(self.project.chapters[row])
+
+    def open_chapter(self, chapter):
+        """Show a chapter in the editor with its own memory, loading it if it isn't open"""
+        if chapter is self.chapter:
+            return
+        if self.generation_worker is not None or self.candidates:
+            self.statusBar.showMessage("⏳ Wait for the generation to finish before switching chapters")
+            self.select_chapter_row()
+            return
         
-        if file_path:
+        # Background work for the previous chapter would land in the wrong one
+        self.cancel_warmup()
+        self.cancel_summary()
+        if self.chapter is not None:
+            self.chapter_memory[self.chapter.id] = {
+                'memory_summary': self.memory_summary,
+                'memory_summary_stats': self.memory_summary_stats,
+                'last_retrieved': self.last_retrieved,
+                'last_budget': self.last_budget,
+            }
+        
+        entry = self.open_chapters.pop(chapter.id, None)
+        if entry is None:
             try:
-                doc = Document()
-                doc.add_heading('AI Writer Document', 0)
-                doc.add_paragraph(f'Created: {datetime.now().strftime("%Y-%m-%d %H:%M")}')
-                doc.add_paragraph()
-                
-                paragraphs = text.split('\n')
-                for para in paragraphs:
-                    if para.strip():
-                        doc.add_paragraph(para)
-                
-                doc.save(file_path)
-                self.statusBar.showMessage(f"✓ Saved to {file_path}")
-                self.current_file = file_path
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to save: {str(e)}")
+                text = self.project.read(chapter)
+            except OSError as e:
+                QMessageBox.critical(self, "Error", f"Failed to read chapter: {str(e)}")
+                self.select_chapter_row()
+                return
+            document = QTextDocument(self)  # Owned by the window, so the editor doesn't delete it when switching
+            document.setDocumentLayout(QPlainTextDocumentLayout(document))
+            document.setDefaultFont(self.editor.font())
+            document.setPlainText(text)
+            document.setModified(False)
+            document.modificationChanged.connect(lambda _, chapter=chapter: self.update_chapter_item(chapter))
+            # Qt turns "\r\n" into a single separator, so journal positions must start from its copy
+            base = text if "\r" not in text else document.toPlainText()
+            entry = {'chapter': chapter, 'document': document, 'stats': DocumentStats(document),
+                     'autosave': self.track_autosave(document, base, self.chapter_autosave_meta(chapter))}
+        self.open_chapters[chapter.id] = entry
+        
+        self.chapter = chapter
+        self.set_editor_document(entry['document'], entry['stats'])
+        memory = self.chapter_memory.get(chapter.id, {})
+        self.memory_summary = memory.get('memory_summary', "")
+        self.memory_summary_stats = memory.get('memory_summary_stats', {})
+        self.last_retrieved = memory.get('last_retrieved', [])
+        self.last_budget = memory.get('last_budget', {})
+        self.kv_session = None
+        self.close_stale_chapters()
+        
+        self.select_chapter_row()
+        self.setWindowTitle(f"{chapter.title} - {self.project.name} - AI Writer Pro")
+        self.project_label.setText(f"{self.project.name}: {len(self.project.chapters)} chapters, "
+                                   f"{len(self.open_chapters)} loaded")
+        self.refresh_text_stats()
+        self.update_memory_view()
+        if self.rolling_summary_enabled or self.retrieval_enabled:
+            self.memory_timer.start()
+
+    def set_editor_document(self, document, stats):
+        """Put a document in the editor; DocumentStats and the edit tracking follow it"""
+        self.editor.document().contentsChange.disconnect(self.on_contents_change)
+        self.doc_stats = stats
+        self.editor.setDocument(document)
+        document.contentsChange.connect(self.on_contents_change)
+        self.editor.moveCursor(QTextCursor.Start)
+
+    def close_stale_chapters(self):
+        """Unload the least recently shown chapters beyond PROJECT_OPEN_CHAPTERS; changed ones stay until saved"""
+        unmodified = [chapter_id for chapter_id, entry in self.open_chapters.items()
+                      if entry['chapter'] is not self.chapter and not entry['document'].isModified()]
+        for chapter_id in unmodified[:max(0, len(self.open_chapters) - PROJECT_OPEN_CHAPTERS)]:
+            entry = self.open_chapters.pop(chapter_id)
+            self.forget_autosave(entry['autosave'])
+            entry['document'].deleteLater()
+
+    def select_chapter_row(self):
+        self.chapter_list.blockSignals(True)
+        self.chapter_list.setCurrentRow(self.project.chapters.index(self.chapter) if self.chapter else -1)
+        self.chapter_list.blockSignals(False)
+
+    def update_chapter_item(self, chapter):
+        if self.project is None or chapter not in self.project.chapters:
+            return
+        entry = self.open_chapters.get(chapter.id)
+        modified = entry is not None and entry['document'].isModified()
+        item = self.chapter_list.item(self.project.chapters.index(chapter))
+        item.setText(f"● {chapter.title}" if modified else chapter.title)
+
+    def save_chapters(self):
+        """Write every changed chapter; returns False if one could not be saved"""
+        if self.project is None:
+            return True
+        saved = 0
+        for entry in list(self.open_chapters.values()):
+            document = entry['document']
+            if not document.isModified():
+                continue
+            text = document.toPlainText()
+            try:
+                self.project.write(entry['chapter'], text)
+            except OSError as e:
+                QMessageBox.critical(self, "Error", f"Failed to save {entry['chapter'].title}: {str(e)}")
+                return False
+            document.setModified(False)
+            # The file now holds these edits; the journal starts again from the saved text
+            self.restart_autosave(entry['autosave'], text, self.chapter_autosave_meta(entry['chapter']))
+            saved += 1
+        self.close_stale_chapters()
+        self.statusBar.showMessage(f"✓ Saved {saved} chapter{'s' if saved != 1 else ''} to {self.project.path}")
+        if saved and self.retrieval_enabled:
+            self.memory_timer.start()
+        return True
+
+    def confirm_unsaved_chapters(self):
+        """Ask before unsaved text is closed; returns False if the writer cancelled"""
+        if self.project is None:
+            document = self.editor.document()
+            if not (document.isModified() and self.doc_stats.word_count):
+                return True
+            reply = QMessageBox.question(self, "Unsaved Text", "Close the unsaved text in the editor?",
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            return reply == QMessageBox.Yes
+        
+        modified = [entry for entry in self.open_chapters.values() if entry['document'].isModified()]
+        if not modified:
+            return True
+        reply = QMessageBox.question(self, "Unsaved Chapters",
+                                     f"Save changes to {len(modified)} chapter{'s' if len(modified) != 1 else ''}?",
+                                     QMessageBox.Save | QMessageBox.Discard | QMessageBox.Cancel, QMessageBox.Save)
+        if reply == QMessageBox.Save:
+            return self.save_chapters()
+        return reply == QMessageBox.Discard
+
+    def closeEvent(self, event):
+        # Only projects ask; closing with loose text in the editor behaves as it always has
+        if self.project is not None and not self.confirm_unsaved_chapters():
+            event.ignore()
+            return
+        if self.import_worker is not None:
+            self.import_worker.cancel()
+            self.import_worker.wait()
+        if self.export_worker is not None:
+            self.export_worker.cancel()  # Leaves no half-written file behind
+            self.export_worker.wait()
+        if self.autosave_worker is not None:
+            # A clean exit: the journals are only for recovering from a crash
+            self.autosave_worker.stop(discard=True)
+            self.autosave_worker.wait()
+        super().closeEvent(event)
+
+    def track_autosave(self, document, text, meta):
+        """Journal a document's edits from now on, starting from `text`; returns its autosave key"""
+        if self.autosave_worker is None:
+            return None
+        key = f"{os.getpid()}-{next(AUTOSAVE_KEYS)}"
+        self.autosave_worker.track(key, text, meta)
+        document.contentsChange.connect(functools.partial(self.journal_edit, key, document))
+        return key
+
+    def journal_edit(self, key, document, position, removed, added):
+        # Only the inserted range is copied here; the autosave thread does the writing
+        end = document_end(document)
+        if position == 0 and added >= end:
+            text = document.toPlainText()  # setPlainText() and the like: one copy, without document_text's replaces
+        else:
+            text = document_text(document, position, min(position + added, end)) if added else ""
+        self.autosave_worker.edit(key, position, removed, text)
+
+    def restart_autosave(self, key, text, meta):
+        if self.autosave_worker is not None and key is not None:
+            self.autosave_worker.track(key, text, meta)
+
+    def forget_autosave(self, key):
+        if self.autosave_worker is not None and key is not None:
+            self.autosave_worker.forget(key)
+
+    def flush_autosave(self):
+        if self.autosave_worker is not None:
+            self.autosave_worker.flush()
+
+    def chapter_autosave_meta(self, chapter):
+        return {'title': f"{chapter.title} ({self.project.name})", 'project': self.project.path,
+                'chapter': chapter.id}
+
+    def on_autosaved(self, stats):
+        self.autosave_label.setText(f"💾 {datetime.now().strftime('%H:%M:%S')}")
+        self.autosave_label.setToolTip(f"Autosaved {stats['edits']} edits ({stats['bytes']} bytes written, "
+                                       f"{stats['seconds'] * 1000:.1f} ms)")
+
+    def on_autosave_error(self, error_msg):
+        self.statusBar.showMessage(f"⚠️ Autosave failed: {error_msg}")
+
+    def offer_recovery(self):
+        """After a crash, offer to restore the text the autosave journals hold"""
+        if self.autosave_worker is None:
+            return
+        documents = AutosaveJournal.recoverable(self.autosave_dir)
+        if not documents:
+            return
+        # One crashed session at a time, the most recent first
+        session = [document for document in documents if document['pid'] == documents[0]['pid']]
+        names = "\n".join(f"• {document['title']} ({len(document['text'])} characters)" for document in session)
+        reply = QMessageBox.question(self, "Recover Unsaved Work",
+                                     f"AI Writer did not close properly. Recover the text that was not saved?\n\n{names}",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+        if reply == QMessageBox.Yes:
+            self.restore_documents(session)
+        for document in session:
+            AutosaveJournal.remove(self.autosave_dir, document['key'])
+
+    def restore_documents(self, documents):
+        """Put recovered text back: chapters into their project, anything else into the editor"""
+        chapters = [document for document in documents if document.get('project')]
+        if chapters and os.path.exists(chapters[0]['project']):
+            self.open_project(chapters[0]['project'])
+            for document in chapters:
+                chapter = self.project.chapter(document['chapter']) if self.project else None
+                if chapter is not None:
+                    self.open_chapter(chapter)
+                    self.editor.document().setPlainText(document['text'])
+                    self.editor.document().setModified(True)
+            restored = len(chapters)
+        else:
+            self.editor.setPlainText("\n\n".join(document['text'] for document in documents))
+            self.editor.document().setModified(True)
+            self.current_file = next((document['file'] for document in documents if document.get('file')), None)
+            restored = len(documents)
+        self.statusBar.showMessage(f"♻️ Recovered {restored} unsaved document{'s' if restored != 1 else ''}")
+
+STARTUP.mark("module loaded")
 
 if __name__ == "__main__":
     QApplication.setAttribute(Qt.AA_EnableHighDpiScaling, True)
@@ -1031,6 +3446,7 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     font = QFont("Segoe UI", 10)
     app.setFont(font)
+    STARTUP.mark("QApplication created")
     
     window = MainWindow()
     window.show()
@@ -0,0 +1,208 @@
+"""Continue many drafts in one go without the desktop app.
+
+Reads drafts from a directory of .txt/.md files or from a JSONL file (one
+{"id": ..., "text": ...} object per line, "-" for stdin), continues each with
+the same prompt pipeline the app uses, and writes one JSON line per draft as
+soon as it is done. Requests are spread over one or more Ollama hosts with a
+fixed number of requests in flight per host. Only ai_writer_core is imported,
+so PyQt5 does not need to be installed.
+
+    python ai_writer_cli.py drafts/ --model llama3 -o results.jsonl
+    python ai_writer_cli.py drafts.jsonl --model llama3 --host gpu1:11434 --host gpu2:11434
+"""
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ai_writer_core import (
+    OLLAMA_HOSTS, DEFAULT_TOKEN_LIMIT, DEFAULT_TEMPERATURE, DEFAULT_CONTEXT_CHARS,
+    DEFAULT_NUM_CTX, SERVER_PARALLEL_SLOTS, CACHE_DIR, GENRE_INSTRUCTIONS,
+    OllamaClient, CompletionCache, Generation, GenerationCancelled, generation_metrics)
+
+DRAFT_EXTENSIONS = (".txt", ".md")
+DRAFT_OVERRIDES = ('model', 'genre', 'temperature', 'token_limit', 'context_chars', 'seed')  # Per-line JSONL settings
+
+
+def iter_drafts(source):
+    """Yield (id, text, overrides) for every draft in a directory or JSONL file"""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if name.lower().endswith(DRAFT_EXTENSIONS):
+                with open(os.path.join(source, name), 'r', encoding='utf-8') as f:
+                    yield name, f.read(), {}
+        return
+    f = sys.stdin if source == "-" else open(source, 'r', encoding='utf-8')
+    try:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            draft_id = item.pop('id', number)
+            yield draft_id, item.pop('text', ""), item
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def read_done_ids(path):
+    """Ids that already have a result without an error in an earlier output file"""
+    done = set()
+    if path == "-" or not os.path.exists(path):
+        return done
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not record.get('error'):
+                done.add(record.get('id'))
+    return done
+
+
+class BatchRunner:
+    """Runs Generations on a thread pool, at most `per_host` at a time on each host"""
+
+    def __init__(self, hosts, per_host, options, cache=None):
+        self.options = options
+        self.cache = cache
+        self.clients = [OllamaClient(host, pool_size=per_host) for host in hosts]
+        self.slots = queue.Queue()
+        for _ in range(per_host):
+            for client in self.clients:
+                self.slots.put(client)
+        self.size = per_host * len(self.clients)
+        self.active = set()
+
+    def continue_draft(self, draft_id, text, overrides, submitted):
+        """Continue one draft and return its result record"""
+        client = self.slots.get()
+        started = time.perf_counter()
+        options = dict(self.options, **{key: overrides[key] for key in DRAFT_OVERRIDES if key in overrides})
+        context_chars = options.pop('context_chars')
+        record = {'id': draft_id, 'host': client.base_url, 'model': options['model'],
+                  'completion': None, 'error': None}
+        stats = {}
+        generation = Generation(
+            options.pop('model'), prompt="", context=text[-context_chars:] if context_chars else None,
+            client=client, cache=self.cache, on_stats=stats.update, **options)
+        self.active.add(generation)
+        try:
+            record['completion'] = generation.run()
+        except GenerationCancelled as e:
+            record['completion'] = e.partial_text
+            record['error'] = e.reason
+        except Exception as e:
+            record['error'] = str(e)
+        finally:
+            self.active.discard(generation)
+            self.slots.put(client)
+        finished = time.perf_counter()
+        timing = stats.get('timing', {})
+        metrics = generation_metrics(stats)
+        record['timings'] = {
+            'queued_s': started - submitted,
+            'first_token_s': stats.get('first_token_s'),
+            'total_s': finished - started,
+            'server_s': timing.get('server_s'),
+            'transport_s': timing.get('transport_s'),
+            'prompt_eval_count': stats.get('prompt_eval_count'),
+            'eval_count': stats.get('eval_count'),
+            'prompt_tokens_per_s': metrics['prompt_tokens_per_s'],
+            'tokens_per_s': metrics['tokens_per_s'],
+        }
+        record['cached'] = stats.get('cache')
+        return record
+
+    def run(self, drafts, out):
+        """Continue every draft, writing records in completion order; returns (done, failed)"""
+        done = failed = 0
+        pending = set()
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            try:
+                for draft_id, text, overrides in drafts:
+                    # Only a couple of drafts per slot are read ahead, so huge inputs stream through
+                    while len(pending) >= self.size * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        done, failed = self.write(finished, out, done, failed)
+                    pending.add(executor.submit(self.continue_draft, draft_id, text, overrides,
+                                                time.perf_counter()))
+                while pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    done, failed = self.write(finished, out, done, failed)
+            except KeyboardInterrupt:
+                for future in pending:
+                    future.cancel()
+                for generation in list(self.active):
+                    generation.cancel("Interrupted")
+                raise
+        return done, failed
+
+    @staticmethod
+    def write(futures, out, done, failed):
+        for future in futures:
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            failed += bool(record['error'])
+        return done, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Continue drafts with Ollama and write the results as JSONL")
+    parser.add_argument("source", help="directory of .txt/.md drafts, or a JSONL file ('-' for stdin)")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--host", action="append", dest="hosts",
+                        help=f"Ollama server, repeat for several (default {','.join(OLLAMA_HOSTS)})")
+    parser.add_argument("--concurrency", type=int, default=SERVER_PARALLEL_SLOTS,
+                        help="requests in flight per host (default OLLAMA_NUM_PARALLEL or %(default)s)")
+    parser.add_argument("-o", "--output", default="-", help="JSONL file to append to (default stdout)")
+    parser.add_argument("--resume", action="store_true", help="skip drafts the output file already has")
+    parser.add_argument("--genre", default="Neutral", choices=sorted(GENRE_INSTRUCTIONS))
+    parser.add_argument("--temperature", type=float, default=DEFAULT_TEMPERATURE)
+    parser.add_argument("--tokens", type=int, default=DEFAULT_TOKEN_LIMIT, help="maximum tokens per continuation")
+    parser.add_argument("--context-chars", type=int, default=DEFAULT_CONTEXT_CHARS,
+                        help="characters from the end of each draft sent as context")
+    parser.add_argument("--num-ctx", type=int, default=DEFAULT_NUM_CTX, help="largest context window to request")
+    parser.add_argument("--seed", type=int, help="fixed seed; repeated runs are then served from the cache")
+    parser.add_argument("--deadline", type=float, default=0, help="seconds per draft before it is stopped")
+    parser.add_argument("--no-cache", action="store_true", help="don't read or write the completion cache")
+    parser.add_argument("--chat", action="store_true",
+                        help="use /api/chat; the instruction is then a system message Ollama evaluates once per slot")
+    args = parser.parse_args(argv)
+
+    options = {
+        'model': args.model, 'genre': args.genre, 'temperature': args.temperature,
+        'token_limit': args.tokens, 'context_chars': args.context_chars,
+        'num_ctx_limit': args.num_ctx, 'seed': args.seed, 'deadline': args.deadline, 'chat': args.chat,
+    }
+    cache = None if args.no_cache else CompletionCache(os.path.join(CACHE_DIR, "completions"))
+    runner = BatchRunner(args.hosts or OLLAMA_HOSTS, max(1, args.concurrency), options, cache)
+
+    drafts = iter_drafts(args.source)
+    if args.resume:
+        skip = read_done_ids(args.output)
+        drafts = (draft for draft in drafts if draft[0] not in skip)
+
+    out = sys.stdout if args.output == "-" else open(args.output, 'a', encoding='utf-8')
+    started = time.perf_counter()
+    try:
+        done, failed = runner.run(drafts, out)
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
+        return 130
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"{done} drafts in {elapsed:.1f} s ({failed} failed)", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
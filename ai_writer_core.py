@@ -0,0 +1,2448 @@
+"""Generation pipeline of AI Writer without any Qt dependency.
+
+Prompt building, context packing, the Ollama client and the caches live here so
+they can be shared by the desktop app ("ai writer.py") and the batch CLI
+(ai_writer_cli.py), which must start without importing PyQt5.
+"""
+import os
+import re
+import sys
+import json
+import functools
+import time
+import socket
+import zlib
+import mmap
+import uuid
+import hashlib
+import zipfile
+import contextlib
+import threading
+import importlib.util
+from collections import deque
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape as xml_escape
+
+
+def lazy_import(name):
+    """Import a module whose code only runs on first attribute access.
+
+    requests and numpy together take a few hundred milliseconds to import and
+    neither is needed before the window has painted. Touch the module from the
+    main thread first; worker threads then find it fully loaded.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+requests = lazy_import("requests")
+
+# numpy is optional and only used by retrieval memory
+NUMPY_AVAILABLE = importlib.util.find_spec("numpy") is not None
+np = lazy_import("numpy") if NUMPY_AVAILABLE else None
+
+# --- Configuration ---
+def normalize_ollama_url(value):
+    """Accept OLLAMA_HOST style values such as "0.0.0.0:11434" as well as full URLs"""
+    value = value.strip().rstrip("/")
+    if "://" not in value:
+        value = f"http://{value}"
+    return value
+
+OLLAMA_URL = normalize_ollama_url(os.environ.get("OLLAMA_HOST", "http://localhost:11434"))
+# Several servers, comma separated; requests go to the least busy one that has the model
+OLLAMA_HOSTS = [normalize_ollama_url(host) for host in os.environ.get("AI_WRITER_OLLAMA_HOSTS", "").split(",")
+                if host.strip()] or [OLLAMA_URL]
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("AI_WRITER_CONNECT_TIMEOUT", 5))  # Seconds to establish a connection
+OLLAMA_READ_TIMEOUT = float(os.environ.get("AI_WRITER_READ_TIMEOUT", 120))  # Seconds to wait for the next bytes
+OLLAMA_POOL_SIZE = 8  # Keep-alive connections kept open to the server
+DEFAULT_TOKEN_LIMIT = 40
+DEFAULT_TEMPERATURE = 0.8
+DEFAULT_CONTEXT_CHARS = 2000  # How many previous characters to include in context
+DEFAULT_NUM_CTX = 8192  # Largest context window requested from Ollama (capped by the model's own)
+FALLBACK_MODEL_CONTEXT = 2048  # Assumed when /api/show doesn't report a context length
+PROMPT_SAFETY_TOKENS = 64  # Margin for the model's chat template and estimation error
+SUMMARY_BUDGET_SHARE = 0.2  # Share of the free prompt budget the summary may use before the context
+PASSAGES_BUDGET_SHARE = 0.2  # Same for retrieved passages
+CHAT_CONTEXT_SPAN = 2  # In chat mode the context window grows to this many times its size before its start moves
+SERVER_PARALLEL_SLOTS = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))  # Requests the server decodes at once
+PRIORITY_INTERACTIVE = 0  # Generations and model loads the writer is waiting for
+PRIORITY_WARMUP = 1  # Warm-ups of the next prompt
+PRIORITY_BACKGROUND = 2  # Summaries of older text
+WARMUP_NUM_PREDICT = 1  # Tokens decoded by a warm-up (0 means "no limit" on some Ollama versions)
+COMPLETION_CACHE_ENTRIES = 256  # Completions kept in memory
+COMPLETION_CACHE_DISK_MB = 64  # Least recently used completions are deleted from disk beyond this
+WATCHDOG_GRACE_SECONDS = 5  # Decoding time allowed before the tokens/s check starts
+CACHE_DIR = os.environ.get("AI_WRITER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".ai_writer"))
+SUMMARY_CHUNK_MIN_CHARS = 3000  # Chunks end at a paragraph boundary once they are at least this long...
+SUMMARY_CHUNK_MAX_CHARS = 8000  # ...and always once they reach this size
+SUMMARY_FANOUT = 4  # Summaries combined into one at each level of the hierarchy
+SUMMARY_TOKEN_LIMIT = 200
+SUMMARY_CACHE_ENTRIES = 2000  # Oldest cached summaries are dropped beyond this
+DEFAULT_EMBED_MODEL = "nomic-embed-text"
+RETRIEVAL_TOP_K = 3  # Passages added to the prompt
+RETRIEVAL_QUERY_CHARS = 1000  # Tail of the document used as the search query
+RETRIEVAL_MIN_PARAGRAPH_CHARS = 40  # Shorter paragraphs (headings, dialogue tags) are not indexed
+EMBED_BATCH_SIZE = 32
+PROJECT_CHAPTER_EXTENSIONS = (".txt", ".md")  # Chapter files of a folder project
+AUTOSAVE_COMPACT_ENTRIES = 2000  # Journal lines before they are folded into a new snapshot...
+AUTOSAVE_COMPACT_MIN_BYTES = 1024 * 1024  # ...or once the journal is larger than the snapshot and this
+AUTOSAVE_COALESCE_CHARS = 4096  # Typing is merged into one journal line up to this length
+EXPORT_PROGRESS_LINES = 2000  # Lines exported between progress reports and cancel checks
+EXPORT_BUFFER_CHARS = 64 * 1024  # Exporters write in pieces of about this size
+IMPORT_CHUNK_CHARS = 64 * 1024  # Opened documents are handed to the editor in pieces of about this size
+
+# --- Improved Genre Instructions ---
+GENRE_INSTRUCTIONS = {
+    "Neutral": """You are an expert storywriter. Your task is to continue the provided text seamlessly.
+ANALYZE: Study the tone, vocabulary, sentence structure, and pacing of the existing text.
+MATCH: Mimic the writing style exactly. Do not shift to a more formal or casual tone.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. No introductions, no summaries, no moralizing, and no meta-commentary.""",
+    "Erotic": """You are an erotic  writer. Continue the text with sensual themes and intimacy and anything goses.
+FOCUS: Desire, physical connection, lust, and sex.
+STYLE: Sensory-rich language, focusing on deitels, feeling, and atmosphere.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain the heat level of the existing text. No meta-commentary.""",
+    "Dramatic": """You are a dramatic novelist. Continue the text with high emotional intensity.
+FOCUS: Conflict, strong feelings, interpersonal tension, and stakes.
+STYLE: Use evocative language, internal monologue, and charged dialogue.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Do not resolve the conflict immediately; maintain the tension. No meta-commentary.""",
+    "Action": """You are an action thriller writer. Continue the text with fast-paced energy.
+FOCUS: Physical movement, kinetics, adrenaline, and immediate danger.
+STYLE: Use strong verbs, short punchy sentences, and sensory details (sound, impact).
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Keep the pace moving. No long introspections. No meta-commentary.""",
+    "Horror": """You are a horror author. Continue the text building dread and atmosphere.
+FOCUS: Fear, the unknown, psychological tension, and unsettling imagery.
+STYLE: Slow pacing, descriptive shadows, sounds, and feelings of unease.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Do not reveal the monster/threat too quickly. No meta-commentary.""",
+    "Romantic": """You are a romance novelist. Continue the text focusing on relationships and emotion.
+FOCUS: Chemical connection, intimacy, longing, and emotional vulnerability.
+STYLE: Warm, sensory, and character-driven language.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Focus on the dynamic between characters. No meta-commentary.""",
+    "Thriller": """You are a thriller writer. Continue the text with suspense and high stakes.
+FOCUS: Plot twists, urgency, danger, and clever maneuvering.
+STYLE: Tight pacing, cliffhangers, and limited perspective.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Keep the reader guessing. No meta-commentary.""",
+    "Comedy": """You are a comedy writer. Continue the text with humor and wit.
+FOCUS: Timing, irony, absurdity, or character quirks.
+STYLE: Lighthearted, playful, and engaging.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Do not explain the jokes. No meta-commentary.""",
+    "SciFi": """You are a science fiction author. Continue the text with futuristic or technological themes.
+FOCUS: Science, technology, space, or speculative society elements.
+STYLE: Precise terminology, world-building consistency, and logical extrapolation.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain established lore. No meta-commentary.""",
+    "Fantasy": """You are a fantasy author. Continue the text with magical or mythical elements.
+FOCUS: Magic systems, mythical creatures, quests, or supernatural forces.
+STYLE: Epic, descriptive, and immersive language.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain established magic rules. No meta-commentary.""",
+    "Crime": """You are a crime fiction writer. Continue the text focusing on criminal activity or investigation.
+FOCUS: Detectives, criminals, motives, evidence, or underworld dynamics.
+STYLE: Gritty, realistic, or procedural depending on the text's tone.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. No meta-commentary.""",
+    "Mystery": """You are a mystery writer. Continue the text by introducing or developing clues.
+FOCUS: Enigmas, puzzles, hidden information, and deduction.
+STYLE: Careful pacing, red herrings, and observational details.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Do not solve the mystery immediately. No meta-commentary.""",
+    "Suspense": """You are a suspense writer. Continue the text building anxiety and anticipation.
+FOCUS: Ticking clocks, impending doom, and uncertainty.
+STYLE: Withholding information, focusing on character worry, and environmental tension.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. No meta-commentary.""",
+    "Afrofuturism": """You are an Afrofuturism writer. Continue the text blending African diaspora culture with technology and futurism.
+FOCUS: African aesthetics, mythology, technology, liberation, and cultural identity.
+STYLE: Rich cultural references, vibrant imagery, and speculative elements rooted in African traditions.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Honor cultural authenticity. No meta-commentary.""",
+    "Steampunk": """You are a steampunk author. Continue the text with Victorian-era aesthetics and steam-powered technology.
+FOCUS: Gears, brass, steam engines, Victorian fashion, and industrial revolution elements.
+STYLE: Ornate descriptions, period-appropriate language, and imaginative machinery.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain historical-futuristic blend. No meta-commentary.""",
+    "Cyberpunk": """You are a cyberpunk writer. Continue the text with high-tech, low-life themes.
+FOCUS: Corporate dominance, cybernetics, hackers, neon-lit cities, and dystopian society.
+STYLE: Gritty, noir-influenced, tech-heavy vocabulary, and urban atmosphere.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain the dark futuristic tone. No meta-commentary.""",
+    "Futuristic": """You are a futuristic fiction writer. Continue the text with advanced technology and future society elements.
+FOCUS: Space travel, AI, advanced weapons, future politics, and human evolution.
+STYLE: Clean, forward-thinking language with speculative technology descriptions.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain consistency with established future setting. No meta-commentary.""",
+    "Modern": """You are a contemporary fiction writer. Continue the text with realistic, present-day settings and themes.
+FOCUS: Current social issues, everyday life, modern relationships, and realistic scenarios.
+STYLE: Natural dialogue, relatable situations, and current cultural references.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Keep it grounded in reality. No meta-commentary.""",
+    "Historical Fiction": """You are a historical fiction author. Continue the text with accurate period details and settings.
+FOCUS: Historical accuracy, period-appropriate language, customs, and social norms.
+STYLE: Immersive world-building that reflects the chosen time period authentically.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain historical consistency. No anachronisms. No meta-commentary.""",
+    "Philosophy": """You are a philosophical writer. Continue the text exploring deep questions about existence, ethics, and meaning.
+FOCUS: Abstract concepts, moral dilemmas, consciousness, truth, and human nature.
+STYLE: Thoughtful, reflective, and intellectually engaging prose.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Weave philosophy into narrative naturally. No meta-commentary.""",
+    "Dieselpunk": """You are a dieselpunk author. Continue the text with interwar-era aesthetics and diesel-powered technology.
+FOCUS: 1920s-1950s aesthetics, heavy machinery, art deco, war machines, and industrial power.
+STYLE: Gritty, mechanical descriptions, period slang, and noir influences.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain the diesel-age atmosphere. No meta-commentary.""",
+    "Biopunk": """You are a biopunk writer. Continue the text with biotechnology and genetic engineering themes.
+FOCUS: DNA manipulation, bio-engineering, corporate biotech, mutations, and organic technology.
+STYLE: Clinical yet visceral descriptions, scientific terminology, and body horror elements.
+CONTINUE: Pick up exactly where the text ends. Do not repeat the last sentence.
+CONSTRAINTS: Output RAW TEXT ONLY. Maintain the bio-tech dystopian tone. No meta-commentary."""
+}
+
+class RequestTiming:
+    """Wall-clock timing of one HTTP request to Ollama.
+
+    headers_s is the time until the response headers arrived, total_s the time
+    until the body was fully read. When Ollama reports its own total_duration,
+    the difference is the time spent on transport and queuing rather than the model.
+    """
+
+    def __init__(self, method, path, host=None):
+        self.method = method
+        self.path = path
+        self.host = host
+        self.queued_s = None  # Time spent waiting for a free slot in a BackendPool
+        self.status = None
+        self.started = time.perf_counter()
+        self.headers_s = None
+        self.total_s = None
+        self.server_s = None
+
+    def mark_headers(self, status):
+        self.status = status
+        self.headers_s = time.perf_counter() - self.started
+
+    def finish(self, server_duration_ns=None):
+        self.total_s = time.perf_counter() - self.started
+        if server_duration_ns:
+            self.server_s = server_duration_ns / 1e9
+
+    @property
+    def transport_s(self):
+        if self.total_s is None or self.server_s is None:
+            return None
+        return max(0.0, self.total_s - self.server_s)
+
+    def as_dict(self):
+        return {
+            'method': self.method,
+            'path': self.path,
+            'host': self.host,
+            'queued_s': self.queued_s,
+            'status': self.status,
+            'headers_s': self.headers_s,
+            'total_s': self.total_s,
+            'server_s': self.server_s,
+            'transport_s': self.transport_s,
+        }
+
+    def summary(self):
+        if self.total_s is None:
+            return f"{self.path}: pending"
+        if self.transport_s is None:
+            return f"⏱️ {self.total_s * 1000:.0f} ms"
+        return f"⏱️ transport {self.transport_s * 1000:.0f} ms | model {self.server_s * 1000:.0f} ms"
+
+
+# Counters Ollama reports in the final response of every generation (durations in nanoseconds)
+OLLAMA_METRICS = ('total_duration', 'load_duration', 'prompt_eval_count', 'prompt_eval_duration',
+                  'eval_count', 'eval_duration')
+
+
+def generation_metrics(stats):
+    """Ollama's counters from a generation's stats plus the prompt and generation speeds derived from them.
+
+    Model loading, prompt evaluation and decoding show up separately, so a slow
+    generation can be told apart from a slow load or a long prompt.
+    """
+    metrics = {key: stats.get(key) for key in OLLAMA_METRICS}
+
+    def rate(count, duration):
+        return count / (duration / 1e9) if count and duration else None
+
+    metrics['prompt_tokens_per_s'] = rate(metrics['prompt_eval_count'], metrics['prompt_eval_duration'])
+    metrics['tokens_per_s'] = rate(metrics['eval_count'], metrics['eval_duration'])
+    return metrics
+
+
+class OllamaClient:
+    """Long-lived HTTP client shared by all requests to one Ollama server.
+
+    A single requests.Session keeps connections alive between scans and
+    generations, so repeated calls skip TCP setup. Every request gets a
+    RequestTiming, and the most recent ones are kept in `timings`.
+    """
+
+    def __init__(self, base_url=OLLAMA_URL, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout=OLLAMA_READ_TIMEOUT, pool_size=OLLAMA_POOL_SIZE):
+        self.base_url = normalize_ollama_url(base_url)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.timings = deque(maxlen=100)
+
+    def request(self, method, path, read_timeout=None, priority=None, owner=None, **kwargs):
+        """Send a request; the returned response carries its RequestTiming as `.timing`.
+
+        `priority` and `owner` only matter to a BackendPool, which queues requests.
+        """
+        timing = RequestTiming(method, path, self.base_url)
+        self.timings.append(timing)
+        timeout = (self.connect_timeout, read_timeout or self.read_timeout)
+        response = self.session.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs)
+        timing.mark_headers(response.status_code)
+        if not kwargs.get('stream'):
+            timing.finish()
+        response.timing = timing
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def list_models(self):
+        """Names of the installed models"""
+        response = self.get("/api/tags", read_timeout=self.connect_timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"API Error: {response.status_code}")
+        return [m['name'] for m in response.json().get('models', [])]
+
+    def resident_models(self):
+        """/api/ps entries of the models loaded in memory"""
+        response = self.get("/api/ps", read_timeout=self.connect_timeout)
+        if response.status_code != 200:
+            raise RuntimeError(f"API Error: {response.status_code}")
+        return response.json().get('models') or []
+
+    def drop(self, owner):
+        """Nothing is queued here; requests go out as soon as they are made"""
+
+    def close(self):
+        self.session.close()
+
+
+class RequestDropped(Exception):
+    """Raised by BackendPool.request when the request's owner dropped it before it was sent"""
+
+
+class QueuedRequest:
+    """A BackendPool request waiting for a free slot on a host"""
+
+    def __init__(self, priority, sequence, model, owner):
+        self.priority = priority
+        self.sequence = sequence
+        self.model = model
+        self.owner = owner
+        self.tried = []  # Hosts that could not be reached
+        self.queued_at = time.monotonic()
+        self.dropped = False
+
+    def ahead_of(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+class SharedRequest:
+    """A non-streamed request whose response is handed to every identical request made meanwhile"""
+
+    def __init__(self, leader):
+        self.leader = leader  # The QueuedRequest that actually goes out
+        self.done = False
+        self.response = None
+        self.error = None
+
+
+class Backend:
+    """One server of a BackendPool and what the last probe found out about it"""
+
+    def __init__(self, client):
+        self.client = client
+        self.url = client.base_url
+        self.healthy = True  # Until a probe or a request says otherwise
+        self.error = None  # Why the last probe or request failed
+        self.models = None  # Installed model names; None until probed
+        self.resident = []  # /api/ps entries
+        self.active = 0  # Requests of ours in flight
+        self.probed_at = None
+
+    def has_model(self, model):
+        return self.models is None or model in self.models
+
+    def is_resident(self, model):
+        return any(entry.get('name') == model for entry in self.resident)
+
+
+class BackendPool:
+    """Several Ollama servers behind the OllamaClient interface, with a request queue.
+
+    Each host runs at most `slots` of our requests at once (a streamed one
+    holds its slot until the response is closed); the rest wait, the most
+    urgent (lowest PRIORITY_* value) first and in order of arrival within a
+    priority. A request
+    naming a model goes to the least busy reachable host that has the model
+    installed; ties go to a host that already has it loaded, then to the one
+    that served it last (its prompt cache may still be warm). When a host
+    cannot be reached the request moves on to the next one, and the host is
+    only tried again after the others or once a probe finds it up.
+
+    Identical non-streamed requests made while one is queued or running share
+    its response. drop(owner) takes an owner's requests out of the queue, so
+    a cancelled warm-up or summary never reaches a server. list_models() and
+    resident_models() probe every host and merge what they report.
+    """
+
+    def __init__(self, hosts=None, connect_timeout=OLLAMA_CONNECT_TIMEOUT, read_timeout=OLLAMA_READ_TIMEOUT,
+                 pool_size=OLLAMA_POOL_SIZE, slots=SERVER_PARALLEL_SLOTS):
+        self.backends = [Backend(OllamaClient(host, connect_timeout, read_timeout, pool_size))
+                         for host in hosts or OLLAMA_HOSTS]
+        self.slots = max(1, slots)
+        self.lock = threading.Lock()
+        self.slot_freed = threading.Condition(self.lock)
+        self.waiting = []  # QueuedRequests waiting for a slot
+        self.following = []  # QueuedRequests waiting for an identical SharedRequest
+        self.shared = {}  # request key -> SharedRequest
+        self.sequence = 0
+        self.waits = deque(maxlen=50)  # Seconds recent requests spent in the queue
+        self.last_served = {}  # model -> Backend
+
+    @property
+    def base_url(self):
+        return self.backends[0].url
+
+    def candidates(self, model, tried):
+        backends = [backend for backend in self.backends if backend not in tried]
+        if model:
+            backends = [backend for backend in backends if backend.has_model(model)] or backends
+        # Unreachable hosts are only tried when no reachable one is left
+        return [backend for backend in backends if backend.healthy] or backends
+
+    def pick(self, model, tried):
+        """The least busy candidate host with a free slot, or None"""
+        free = [backend for backend in self.candidates(model, tried) if backend.active < self.slots]
+        if not free:
+            return None
+        last = self.last_served.get(model)
+        return min(free, key=lambda b: (b.active, not b.is_resident(model), b is not last))
+
+    def acquire(self, queued):
+        """Wait (holding the lock) until a host has a slot for `queued` and no request ahead of it wants that slot"""
+        while True:
+            if queued.dropped:
+                raise RequestDropped("Dropped before it was sent")
+            backend = self.pick(queued.model, queued.tried)
+            if backend is not None and not any(
+                    other.ahead_of(queued) and not other.dropped and backend in self.candidates(other.model, other.tried)
+                    for other in self.waiting):
+                backend.active += 1
+                if queued.model:
+                    self.last_served[queued.model] = backend
+                return backend
+            self.slot_freed.wait()
+
+    def release(self, backend, error=None):
+        """Free a slot; `error` (the connection failed) marks its host unreachable"""
+        with self.lock:
+            backend.active -= 1
+            if error is not None:
+                backend.healthy, backend.error = False, error
+            self.slot_freed.notify_all()
+
+    def request(self, method, path, priority=PRIORITY_INTERACTIVE, owner=None, **kwargs):
+        """Queue a request, send it to the chosen host and return the response"""
+        model = (kwargs.get('json') or {}).get('model')
+        key = None
+        if not kwargs.get('stream') and kwargs.get('json') is not None:
+            key = hashlib.sha1(json.dumps([method, path, kwargs['json']], sort_keys=True).encode('utf-8')).hexdigest()
+        while True:
+            with self.lock:
+                self.sequence += 1
+                queued = QueuedRequest(priority, self.sequence, model, owner)
+                shared = self.shared.get(key) if key else None
+                if shared is None:
+                    if key:
+                        shared = self.shared[key] = SharedRequest(queued)
+                    self.waiting.append(queued)
+                    break
+                # The same request is already queued or running; wait for its response
+                shared.leader.priority = min(shared.leader.priority, priority)
+                self.following.append(queued)
+                try:
+                    while not shared.done and not queued.dropped:
+                        self.slot_freed.wait()
+                finally:
+                    self.following.remove(queued)
+                if queued.dropped:
+                    raise RequestDropped("Dropped before it was sent")
+                if not isinstance(shared.error, RequestDropped):
+                    if shared.error is not None:
+                        raise shared.error
+                    return shared.response
+                # Its owner dropped it, but this one is still wanted: queue it afresh
+        try:
+            response = self.send(queued, method, path, kwargs)
+        except BaseException as e:
+            if key:
+                self.settle(key, shared, error=e)
+            raise
+        if key:
+            self.settle(key, shared, response=response)
+        return response
+
+    def settle(self, key, shared, response=None, error=None):
+        with self.lock:
+            shared.done, shared.response, shared.error = True, response, error
+            if self.shared.get(key) is shared:
+                del self.shared[key]
+            self.slot_freed.notify_all()
+
+    def send(self, queued, method, path, kwargs):
+        """Wait for a slot and send; a host that refuses the connection is left for the next one"""
+        while True:
+            with self.lock:
+                try:
+                    backend = self.acquire(queued)
+                finally:
+                    # Requests behind this one may be waiting for it to leave the queue
+                    self.waiting.remove(queued)
+                    self.slot_freed.notify_all()
+                waited = time.monotonic() - queued.queued_at
+            try:
+                response = backend.client.request(method, path, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                # Nothing reached the server, so the request can go elsewhere
+                self.release(backend, error=e)
+                queued.tried.append(backend)
+                if len(queued.tried) == len(self.backends):
+                    raise
+                with self.lock:
+                    self.waiting.append(queued)
+                continue
+            except BaseException:
+                self.release(backend)
+                raise
+            response.timing.queued_s = waited
+            with self.lock:
+                backend.healthy, backend.error = True, None
+                self.waits.append(waited)
+            if kwargs.get('stream'):
+                self.release_on_close(backend, response)
+            else:
+                self.release(backend)
+            return response
+
+    def release_on_close(self, backend, response):
+        """Keep a streamed response's slot taken until the response is closed"""
+        close = response.close
+        pending = [True]
+
+        def close_and_release():
+            close()
+            with self.lock:
+                if pending:
+                    pending.clear()
+                    backend.active -= 1
+                    self.slot_freed.notify_all()
+
+        response.close = close_and_release
+
+    def drop(self, owner):
+        """Take every queued request of `owner` out of the queue; sent ones are left alone"""
+        with self.lock:
+            for queued in self.waiting + self.following:
+                if queued.owner is owner:
+                    queued.dropped = True
+            self.slot_freed.notify_all()
+
+    def queue_status(self):
+        """Requests waiting for a slot, running, the total slots and the longest current wait in seconds"""
+        with self.lock:
+            now = time.monotonic()
+            waiting = [queued for queued in self.waiting + self.following if not queued.dropped]
+            return {
+                'waiting': len(waiting),
+                'running': sum(backend.active for backend in self.backends),
+                'slots': self.slots * len(self.backends),
+                'longest_wait_s': max((now - queued.queued_at for queued in waiting), default=0.0),
+                'last_wait_s': self.waits[-1] if self.waits else None,
+            }
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def probe_backend(self, backend):
+        try:
+            models = backend.client.list_models()
+            resident = backend.client.resident_models()
+        except Exception as e:
+            with self.lock:
+                backend.healthy, backend.error = False, e
+        else:
+            with self.lock:
+                backend.models, backend.resident = models, resident
+                backend.healthy, backend.error = True, None
+                # Requests waiting for other hosts may go to this one now
+                self.slot_freed.notify_all()
+        backend.probed_at = time.monotonic()
+
+    def probe(self):
+        """Ask every host, all at the same time, for its installed and loaded models"""
+        threads = [threading.Thread(target=self.probe_backend, args=(backend,), daemon=True)
+                   for backend in self.backends[1:]]
+        for thread in threads:
+            thread.start()
+        self.probe_backend(self.backends[0])
+        for thread in threads:
+            thread.join()
+
+    def list_models(self):
+        """Every model installed on a reachable host, in host order"""
+        self.probe()
+        healthy = [backend for backend in self.backends if backend.healthy]
+        if not healthy:
+            raise self.backends[0].error
+        return list(dict.fromkeys(name for backend in healthy for name in backend.models))
+
+    def resident_models(self):
+        """The /api/ps entries of every reachable host, each with its 'host'"""
+        self.probe()
+        with self.lock:
+            return [dict(entry, host=backend.url) for backend in self.backends for entry in backend.resident
+                    if backend.healthy]
+
+    def status(self):
+        """(url, healthy, requests in flight, error) per host"""
+        with self.lock:
+            return [(backend.url, backend.healthy, backend.active, backend.error and str(backend.error))
+                    for backend in self.backends]
+
+    def close(self):
+        for backend in self.backends:
+            backend.client.close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_ollama_client():
+    """Return the process-wide BackendPool over OLLAMA_HOSTS, creating it on first use"""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = BackendPool()
+        return _shared_client
+
+
+SUMMARY_INSTRUCTION = """Summarize the following part of a story in a few sentences.
+Keep the names, places, relationships and events that matter for what happens later.
+Output the summary only, with no introduction."""
+
+ROLLUP_INSTRUCTION = """The following are summaries of consecutive parts of a story, in order.
+Combine them into one shorter summary that keeps the main characters, their goals and the key events.
+Output the summary only, with no introduction."""
+
+
+def may_end_summary_chunk(paragraph):
+    """Whether a chunk that is long enough ends after this paragraph"""
+    return zlib.crc32(paragraph.encode('utf-8')) % 4 == 0
+
+
+def split_summary_chunks(text, min_chars=SUMMARY_CHUNK_MIN_CHARS, max_chars=SUMMARY_CHUNK_MAX_CHARS):
+    """Split text into chunks at paragraph boundaries chosen by content.
+
+    A chunk ends after a paragraph whose hash hits a fixed pattern once the chunk
+    is long enough, so an edit only moves the boundaries around it and the other
+    chunks (and their cached summaries) stay the same.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for paragraph in text.split("\n"):
+        current.append(paragraph)
+        size += len(paragraph) + 1
+        if size >= max_chars or (size >= min_chars and may_end_summary_chunk(paragraph)):
+            chunks.append("\n".join(current))
+            current = []
+            size = 0
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+class SummaryCache:
+    """Summaries keyed by model, hierarchy level and content hash, persisted as JSON"""
+
+    def __init__(self, path=None, max_entries=SUMMARY_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def digest(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def key(cls, model, level, text=None, digest=None):
+        """Cache key of a summary of `text`, or of the text whose digest() is `digest`"""
+        if digest is None:
+            digest = cls.digest(text)
+        return f"{model}:{level}:{digest}"
+
+    def get(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def put(self, key, summary):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = summary
+            while len(self.entries) > self.max_entries:
+                del self.entries[next(iter(self.entries))]
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            data = dict(self.entries)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+
+class ModelListCache:
+    """Last model list and selection seen on each Ollama host, persisted as JSON.
+
+    Lets the app fill the model picker before the server has answered.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hosts = {}
+        self.load()
+
+    def get(self, host):
+        return self.hosts.get(host, {})
+
+    def put(self, host, **fields):
+        entry = self.hosts.setdefault(host, {})
+        if all(entry.get(name) == value for name, value in fields.items()):
+            return
+        entry.update(fields)
+        self.save()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.hosts = json.load(f)
+        except (OSError, ValueError):
+            self.hosts = {}
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.hosts, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+
+class CompletionCache:
+    """Completions of deterministic requests, keyed by a hash of the full payload.
+
+    Recently used entries are kept in memory; every entry is also written to
+    its own JSON file so the cache survives restarts. When the files exceed
+    max_disk_bytes the least recently used are deleted. Only requests with a
+    fixed seed or temperature 0 are reproducible, see `cacheable`.
+    """
+
+    def __init__(self, directory=None, max_entries=COMPLETION_CACHE_ENTRIES,
+                 max_disk_bytes=COMPLETION_CACHE_DISK_MB * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = {}
+        self.disk = {}  # file name -> [last used, size]
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.scan()
+
+    @staticmethod
+    def cacheable(payload):
+        options = payload.get("options", {})
+        return options.get("seed") is not None or options.get("temperature") == 0
+
+    @staticmethod
+    def key(payload):
+        # Streaming and keep_alive only change how the same completion is delivered
+        request = {name: value for name, value in payload.items() if name not in ("stream", "keep_alive")}
+        return hashlib.sha1(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                entry = self.read(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries[key] = entry
+            self.trim_memory()
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = entry
+            self.trim_memory()
+            self.write(key, entry)
+
+    def trim_memory(self):
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def scan(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for item in os.scandir(self.directory):
+            if item.name.endswith(".json"):
+                stat = item.stat()
+                self.disk[item.name] = [stat.st_mtime, stat.st_size]
+                self.disk_bytes += stat.st_size
+
+    def read(self, key):
+        name = f"{key}.json"
+        if name not in self.disk:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self.disk[name][0] = time.time()
+        return entry
+
+    def write(self, key, entry):
+        if not self.directory:
+            return
+        name = f"{key}.json"
+        path = os.path.join(self.directory, name)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        old = self.disk.get(name)
+        self.disk_bytes += size - (old[1] if old else 0)
+        self.disk[name] = [time.time(), size]
+        if self.disk_bytes > self.max_disk_bytes:
+            self.evict()
+
+    def evict(self):
+        for name, (_, size) in sorted(self.disk.items(), key=lambda item: item[1][0]):
+            if self.disk_bytes <= self.max_disk_bytes * 0.9:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            del self.disk[name]
+            self.disk_bytes -= size
+
+
+class HashingEmbeddingBackend:
+    """Deterministic local embeddings from hashed word features.
+
+    Needs no model or server, so it works offline and gives the same vectors on
+    every run, which makes it suitable for tests and benchmarks.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = zlib.crc32(word.strip('.,;:!?"\'()').encode('utf-8'))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return matrix
+
+
+class OllamaEmbeddingBackend:
+    """Embeddings from an Ollama embedding model via /api/embed"""
+
+    def __init__(self, model, client=None):
+        self.model = model
+        self.name = model
+        self.client = client or get_ollama_client()
+
+    def embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), EMBED_BATCH_SIZE):
+            batch = texts[start:start + EMBED_BATCH_SIZE]
+            response = self.client.post("/api/embed", json={"model": self.model, "input": batch})
+            if response.status_code == 404:
+                # Older Ollama versions only have the single-prompt endpoint
+                for text in batch:
+                    legacy = self.client.post("/api/embeddings", json={"model": self.model, "prompt": text})
+                    legacy.raise_for_status()
+                    vectors.append(legacy.json()['embedding'])
+                continue
+            response.raise_for_status()
+            vectors.extend(response.json()['embeddings'])
+        return np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+
+
+def split_paragraphs(text, min_chars=RETRIEVAL_MIN_PARAGRAPH_CHARS):
+    """Return (offset, paragraph) pairs for the paragraphs worth indexing"""
+    paragraphs = []
+    offset = 0
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if len(stripped) >= min_chars:
+            paragraphs.append((offset, stripped))
+        offset += len(line) + 1
+    return paragraphs
+
+
+class EmbeddingIndex:
+    """Paragraph embeddings of the manuscript held in one normalised NumPy matrix.
+
+    Vectors are keyed by a hash of the paragraph text, so after an edit only
+    new or changed paragraphs are embedded again. Searches are a single
+    matrix-vector product over every row.
+
+    Rows belong to a source (a chapter id in project mode, "" otherwise), and
+    updating one source leaves the others alone. `signatures` remembers which
+    version of each source was indexed, so unchanged chapters need not be read.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.backend_name = None
+        self.lock = threading.Lock()
+        self.state = self.empty_state(0)
+        self.signatures = {}
+        self.load()
+
+    @staticmethod
+    def empty_state(dim):
+        return {
+            'hashes': [],
+            'texts': [],
+            'ends': np.zeros(0, dtype=np.int64),
+            'sources': np.zeros(0, dtype=str),
+            'matrix': np.zeros((0, dim), dtype=np.float32),
+        }
+
+    def __len__(self):
+        return len(self.state['hashes'])
+
+    @staticmethod
+    def normalize(matrix):
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def update(self, text, backend, source="", signature=None):
+        """Re-index `text` as `source`; returns how many paragraphs needed new embeddings.
+
+        `text` may also be an iterable of pieces of whole lines that give the
+        text when joined by newlines; each piece is embedded as it arrives, so
+        a document can be indexed while it is being read.
+        """
+        state = self.state
+        signatures = dict(self.signatures)
+        if self.backend_name != backend.name:
+            state = self.empty_state(0)
+            signatures = {}
+        # Vectors are reused from any source; a paragraph repeated in another chapter is not embedded twice
+        known = {h: row for row, h in enumerate(state['hashes'])}
+        
+        hashes, texts, ends, matrices = [], [], [], []
+        embedded = 0
+        offset = 0
+        for piece in [text] if isinstance(text, str) else text:
+            paragraphs = split_paragraphs(piece)
+            piece_hashes = [hashlib.sha1(p.encode('utf-8')).hexdigest() for _, p in paragraphs]
+            missing = [i for i, h in enumerate(piece_hashes) if h not in known]
+            new_vectors = backend.embed([paragraphs[i][1] for i in missing]) if missing else None
+            
+            if paragraphs:
+                dim = new_vectors.shape[1] if new_vectors is not None else state['matrix'].shape[1]
+                matrix = np.empty((len(piece_hashes), dim), dtype=np.float32)
+                reused = [i for i, h in enumerate(piece_hashes) if h in known]
+                if reused:
+                    matrix[reused] = state['matrix'][[known[piece_hashes[i]] for i in reused]]
+                if missing:
+                    matrix[missing] = self.normalize(new_vectors)
+                matrices.append(matrix)
+            hashes += piece_hashes
+            texts += [p for _, p in paragraphs]
+            ends += [offset + o + len(p) for o, p in paragraphs]
+            embedded += len(missing)
+            offset += len(piece) + 1
+        
+        keep = np.flatnonzero(state['sources'] != source)
+        matrices.insert(0, state['matrix'][keep])
+        new_state = {
+            'hashes': [state['hashes'][row] for row in keep] + hashes,
+            'texts': [state['texts'][row] for row in keep] + texts,
+            'ends': np.concatenate([state['ends'][keep], np.asarray(ends, dtype=np.int64)]),
+            'sources': np.concatenate([state['sources'][keep], np.full(len(hashes), source)]),
+            'matrix': np.concatenate([matrix for matrix in matrices if len(matrix)] or matrices[:1]),
+        }
+        signatures[source] = signature
+        with self.lock:
+            self.state = new_state
+            self.signatures = signatures
+            self.backend_name = backend.name
+        return embedded
+
+    def is_current(self, source, signature, backend):
+        """Whether `source` was last indexed at this signature with this backend (None never matches)"""
+        return (signature is not None and self.backend_name == backend.name
+                and self.signatures.get(source) == signature)
+
+    def retain_sources(self, sources):
+        """Drop the rows of every source not in `sources` (deleted or renamed chapters); returns how many"""
+        state = self.state
+        keep = np.flatnonzero(np.isin(state['sources'], list(sources)))
+        if len(keep) == len(state['hashes']):
+            return 0
+        new_state = {
+            'hashes': [state['hashes'][row] for row in keep],
+            'texts': [state['texts'][row] for row in keep],
+            'ends': state['ends'][keep],
+            'sources': state['sources'][keep],
+            'matrix': state['matrix'][keep],
+        }
+        with self.lock:
+            self.state = new_state
+            self.signatures = {key: value for key, value in self.signatures.items() if key in sources}
+        return len(state['hashes']) - len(keep)
+
+    def search(self, query_vector, k=RETRIEVAL_TOP_K, before_offset=None, source=""):
+        """Return up to k (score, text) pairs, best first.
+
+        With `before_offset`, passages of `source` must end before that offset;
+        passages of other sources (other chapters) always qualify.
+        """
+        state = self.state
+        matrix = state['matrix']
+        if not len(matrix):
+            return []
+        query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != matrix.shape[1]:
+            return []
+        scores = matrix @ (query / norm)
+        if before_offset is not None:
+            allowed = (state['ends'] <= before_offset) | (state['sources'] != source)
+            scores = np.where(allowed, scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), state['texts'][i]) for i in top if np.isfinite(scores[i])]
+
+    def search_text(self, backend, query, k=RETRIEVAL_TOP_K, before_offset=None, source=""):
+        if not len(self) or self.backend_name != backend.name or not query.strip():
+            return []
+        return self.search(backend.embed([query])[0], k, before_offset, source)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                hashes = [str(h) for h in data['hashes']]
+                self.state = {
+                    'hashes': hashes,
+                    'texts': [str(t) for t in data['texts']],
+                    'ends': data['ends'],
+                    # Indexes saved before projects existed have a single, unnamed source
+                    'sources': data['sources'] if 'sources' in data.files else np.full(len(hashes), ""),
+                    'matrix': data['matrix'],
+                }
+                self.signatures = json.loads(str(data['signatures'])) if 'signatures' in data.files else {}
+                self.backend_name = str(data['backend'])
+        except (OSError, ValueError, KeyError):
+            self.state = self.empty_state(0)
+            self.signatures = {}
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        state = self.state
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, hashes=np.asarray(state['hashes'], dtype=str),
+                 texts=np.asarray(state['texts'], dtype=str), ends=state['ends'],
+                 sources=np.asarray(state['sources'], dtype=str), matrix=state['matrix'],
+                 signatures=np.asarray(json.dumps(self.signatures)), backend=np.asarray(self.backend_name or ""))
+        os.replace(tmp_path, path)
+
+
+# --- Projects ---
+CHAPTER_HEADING = re.compile(rb"^# [^\r\n]*", re.M)  # Chapters of a single-file project start at "# " headings
+
+
+class Chapter:
+    """One chapter of a Project: a whole file, or the byte range [start, end) of a single-file project"""
+
+    def __init__(self, id, title, path, start=0, end=None):
+        self.id = id
+        self.title = title
+        self.path = path
+        self.start = start
+        self.end = end  # None: up to the end of the file
+
+
+class Project:
+    """A book made of chapters: one file per chapter in a folder, or "# " headings in a single file.
+
+    Only the chapter list and byte offsets are kept in memory. Chapter text is
+    read on demand through a read-only memory map, so indexing or listing the
+    chapters that are not open costs page cache instead of Python memory.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.single_file = os.path.isfile(self.path)
+        self.chapters = []
+        self.scan()
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def index_path(self):
+        """Where the cross-chapter retrieval index is kept"""
+        if self.single_file:
+            return f"{self.path}.embeddings.npz"
+        return os.path.join(self.path, ".embeddings.npz")
+
+    def chapter(self, chapter_id):
+        return next((chapter for chapter in self.chapters if chapter.id == chapter_id), None)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def mapped(path):
+        """Read-only memory map of a file (empty files cannot be mapped and give b"")"""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+
+    def scan(self):
+        """List the chapters again from disk"""
+        if not self.single_file:
+            names = sorted(name for name in os.listdir(self.path)
+                           if name.lower().endswith(PROJECT_CHAPTER_EXTENSIONS) and not name.startswith("."))
+            self.chapters = [Chapter(name, os.path.splitext(name)[0], os.path.join(self.path, name))
+                             for name in names]
+            return
+        with self.mapped(self.path) as data:
+            headings = [(m.start(), data[m.start() + 2:m.end()].decode('utf-8', 'replace').strip())
+                        for m in CHAPTER_HEADING.finditer(data)]
+        if not headings or headings[0][0] != 0:
+            headings.insert(0, (0, "Opening"))  # Text before the first heading
+        self.chapters = []
+        for number, (start, title) in enumerate(headings):
+            end = headings[number + 1][0] if number + 1 < len(headings) else None
+            self.chapters.append(Chapter(f"{number + 1:03d} {title}", title or "Untitled", self.path, start, end))
+
+    def read(self, chapter):
+        with self.mapped(chapter.path) as data:
+            return data[chapter.start:chapter.end].decode('utf-8', 'replace')
+
+    def signature(self, chapter):
+        """Changes whenever the chapter's text on disk does"""
+        if not self.single_file:
+            stat = os.stat(chapter.path)
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        # Saving any chapter rewrites the file, so compare the chapter's own bytes
+        with self.mapped(chapter.path) as data:
+            return f"{chapter.start}:{zlib.crc32(data[chapter.start:chapter.end])}"
+
+    def write(self, chapter, text):
+        """Save one chapter; the other chapters of a single-file project are copied through unchanged"""
+        data = text.encode('utf-8')
+        if self.single_file and chapter.end is not None and not data.endswith(b"\n"):
+            # The next chapter's "# " heading must stay at the start of a line
+            data += b"\n"
+        tmp_path = f"{chapter.path}.tmp"
+        if not self.single_file:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, chapter.path)
+            return
+        with self.mapped(self.path) as old, open(tmp_path, 'wb') as f:
+            f.write(old[:chapter.start])
+            f.write(data)
+            if chapter.end is not None:
+                f.write(old[chapter.end:])
+        os.replace(tmp_path, self.path)
+        if chapter.end is None:
+            return
+        # Later chapters moved by the change in length
+        shift = len(data) - (chapter.end - chapter.start)
+        for other in self.chapters:
+            if other.start > chapter.start:
+                other.start += shift
+                if other.end is not None:
+                    other.end += shift
+        chapter.end = chapter.start + len(data)
+
+
+# --- Autosave ---
+def utf16_len(text):
+    """Length of `text` in UTF-16 code units, the unit QTextDocument positions use"""
+    if text.isascii():  # No copy for the common case
+        return len(text)
+    return len(text.encode('utf-16-le', 'surrogatepass')) // 2
+
+
+def apply_edits(text, edits):
+    """Apply (position, removed, added) edits to `text`.
+
+    Positions and lengths are UTF-16 code units, as QTextDocument reports them,
+    and are clamped to the text because Qt sometimes reports a range that
+    includes the document's final paragraph separator.
+    """
+    if not edits:
+        return text
+    data = bytearray(text.encode('utf-16-le', 'surrogatepass'))
+    for position, removed, added in edits:
+        start = min(position * 2, len(data))
+        end = min(start + removed * 2, len(data))
+        data[start:end] = added.encode('utf-16-le', 'surrogatepass')
+    return data.decode('utf-16-le', 'surrogatepass')
+
+
+def process_alive(pid):
+    """Whether a process is running. Always False on Windows, where os.kill() would terminate it."""
+    if os.name == "nt":
+        return False
+    try:
+        os.kill(pid, 0)
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class AutosaveJournal:
+    """Crash-recovery copy of one document: a snapshot plus the edits made since.
+
+    Edits are appended to `<key>.<generation>.jsonl` as [position, removed, added]
+    lines, so a save writes only what changed. compact() folds the journal into
+    the next generation's snapshot `<key>.<generation>.txt`; the new files are
+    complete before the old ones are deleted, so a crash at any point leaves a
+    readable pair. `<key>.json` records which document it is and which process
+    wrote it. Not thread-safe: one thread (AutosaveWorker) owns all journals.
+    """
+
+    def __init__(self, directory, key, meta=None):
+        self.directory = directory
+        self.key = key
+        self.meta = {}
+        self.generation = -1  # No files yet
+        self.journal = None
+        self.length = 0  # In UTF-16 units, to recognise edits that replace the whole text
+        self.snapshot_bytes = 0
+        self.entries = 0
+        self.journal_bytes = 0
+        self.set_meta(meta or {})
+
+    def set_meta(self, meta):
+        self.meta = dict(meta, key=self.key, pid=os.getpid(), started=self.meta.get('started', time.time()))
+
+    def file_path(self, generation, extension):
+        return os.path.join(self.directory, f"{self.key}.{generation}.{extension}")
+
+    @classmethod
+    def coalesce(cls, edits):
+        """Merge runs of typing (and backspacing over it) into single edits"""
+        merged = []
+        for position, removed, added in edits:
+            if merged and len(merged[-1][2]) < AUTOSAVE_COALESCE_CHARS:
+                last_position, last_removed, last_added = merged[-1]
+                end = last_position + utf16_len(last_added)
+                if not removed and position == end:
+                    merged[-1] = (last_position, last_removed, last_added + added)
+                    continue
+                if (removed == 1 and not added and position == end - 1 and last_added
+                        and last_added[-1] < "\ud800"):
+                    merged[-1] = (last_position, last_removed, last_added[:-1])
+                    continue
+            merged.append((position, removed, added))
+        return merged
+
+    def start(self, text, meta=None):
+        """Begin again from `text` (e.g. after the document was saved). An empty text writes nothing yet.
+
+        `text` may also be an iterable of pieces, such as import_pieces() of the file just opened.
+        """
+        self.discard()
+        if meta is not None:
+            self.set_meta(meta)
+        if text:
+            self.write_snapshot(text)
+
+    def append(self, edits):
+        """Journal edits; returns the bytes written"""
+        edits = self.coalesce(edits)
+        if self.generation < 0:
+            self.write_snapshot("")  # The empty starting text, deferred until there was something to save
+        # Anything before an edit that replaced the whole text (setPlainText, a recovery) is moot
+        replaced = None
+        for number, (position, removed, added) in enumerate(edits):
+            position = min(position, self.length)
+            removed = min(removed, self.length - position)
+            if position == 0 and removed == self.length and (removed or added):
+                replaced = number
+            self.length += utf16_len(added) - removed
+        if replaced is not None:
+            length = self.length
+            self.write_snapshot(edits[replaced][2])
+            edits = edits[replaced + 1:]
+            self.length = length
+        if not edits:
+            return self.snapshot_bytes if replaced is not None else 0
+        
+        data = "".join(json.dumps(edit, ensure_ascii=False) + "\n" for edit in edits).encode('utf-8')
+        self.journal.write(data)
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.entries += len(edits)
+        self.journal_bytes += len(data)
+        return len(data)
+
+    def needs_compaction(self):
+        return (self.entries >= AUTOSAVE_COMPACT_ENTRIES
+                or self.journal_bytes > max(AUTOSAVE_COMPACT_MIN_BYTES, self.snapshot_bytes))
+
+    def compact(self):
+        """Fold the journal into a new snapshot"""
+        text, _ = self.replay(self.directory, self.key, self.generation)
+        self.write_snapshot(text)
+
+    def write_snapshot(self, text):
+        """`text` may also be an iterable of pieces that concatenate to it"""
+        os.makedirs(self.directory, exist_ok=True)
+        old = self.generation
+        self.generation += 1
+        path = self.file_path(self.generation, "txt")
+        length = 0
+        with open(f"{path}.tmp", 'w', encoding='utf-8', newline='') as f:
+            for piece in [text] if isinstance(text, str) else text:
+                for start in range(0, len(piece), 1024 * 1024):  # Encoded a piece at a time
+                    f.write(piece[start:start + 1024 * 1024])
+                length += utf16_len(piece)
+        os.replace(f"{path}.tmp", path)
+        meta_path = os.path.join(self.directory, f"{self.key}.json")
+        with open(f"{meta_path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        
+        if self.journal:
+            self.journal.close()
+        self.journal = open(self.file_path(self.generation, "jsonl"), 'ab')
+        for extension in ("txt", "jsonl"):
+            with contextlib.suppress(OSError):
+                os.remove(self.file_path(old, extension))
+        self.length = length
+        self.snapshot_bytes = os.path.getsize(path)
+        self.entries = 0
+        self.journal_bytes = 0
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def discard(self):
+        """Delete the journal's files (the document was saved or closed)"""
+        self.close()
+        self.remove(self.directory, self.key)
+        self.generation = -1
+        self.length = 0
+
+    @staticmethod
+    def remove(directory, key):
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name.startswith(f"{key}."):
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(directory, name))
+
+    @staticmethod
+    def generations(directory, key):
+        pattern = re.compile(rf"{re.escape(key)}\.(\d+)\.txt$")
+        return sorted(int(m.group(1)) for m in map(pattern.match, os.listdir(directory)) if m)
+
+    @classmethod
+    def replay(cls, directory, key, generation=None):
+        """Text of the newest (or given) snapshot with its journal applied; returns (text, edits applied)"""
+        if generation is None:
+            generation = cls.generations(directory, key)[-1]
+        with open(os.path.join(directory, f"{key}.{generation}.txt"), 'r', encoding='utf-8', newline='') as f:
+            text = f.read()
+        edits = []
+        with contextlib.suppress(FileNotFoundError):
+            with open(os.path.join(directory, f"{key}.{generation}.jsonl"), 'rb') as f:
+                for line in f:
+                    try:
+                        edits.append(json.loads(line))
+                    except ValueError:
+                        break  # A line cut short by the crash
+        return apply_edits(text, edits), len(edits)
+
+    @classmethod
+    def recoverable(cls, directory):
+        """Documents journaled by processes that are no longer running, newest first.
+
+        Each is its metadata plus 'text'. Documents that were never changed
+        after their journal started are left out.
+        """
+        if not os.path.isdir(directory):
+            return []
+        documents = []
+        for name in os.listdir(directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(directory, name), 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta['pid'] == os.getpid() or process_alive(meta['pid']):
+                    continue
+                generations = cls.generations(directory, meta['key'])
+                text, edits = cls.replay(directory, meta['key'], generations[-1])
+            except (OSError, ValueError, KeyError, IndexError):
+                continue
+            if edits or generations[-1] > 0:
+                documents.append(dict(meta, text=text))
+        return sorted(documents, key=lambda document: document['started'], reverse=True)
+
+
+# --- Export ---
+_XML_INVALID = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")  # Not allowed in XML 1.0
+_MARKDOWN_BLOCK_START = re.compile(r"([#>+*-]|\d+[.)])(\s|$)|(-{3,}|={3,}|\*{3,}|_{3,})\s*$")
+
+
+def xml_text(text):
+    return xml_escape(_XML_INVALID.sub("", text))
+
+
+def iter_lines(text, final_empty=True):
+    """Yield the lines of `text` one at a time, without building a list of them.
+
+    With `final_empty` False, a newline at the very end doesn't produce an
+    empty last line, so chapter files that end with one can be joined.
+    """
+    start = 0
+    while True:
+        end = text.find("\n", start)
+        if end < 0:
+            if final_empty or start < len(text):
+                yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def chapter_heading(line):
+    """Title of a "# " chapter heading line, or None"""
+    return line[2:].strip() if line.startswith("# ") else None
+
+
+class ExportCancelled(Exception):
+    """Raised by export_document when it was cancelled; the target file is left untouched"""
+
+
+class Exporter:
+    """Writes a document to an open binary file line by line, as export_document reads it.
+
+    "# " lines start chapters. Output is collected into pieces of about
+    EXPORT_BUFFER_CHARS, so memory use doesn't depend on the document's size.
+    """
+    extension = ".txt"
+
+    def __init__(self, f, title):
+        self.f = f
+        self.title = title
+        self.chapters = 0
+        self.buffer = []
+        self.buffered = 0
+
+    def emit(self, text):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= EXPORT_BUFFER_CHARS:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.output().write("".join(self.buffer).encode('utf-8'))
+            self.buffer = []
+            self.buffered = 0
+
+    def output(self):
+        return self.f
+
+    def begin(self):
+        pass
+
+    def write_line(self, line):
+        raise NotImplementedError
+
+    def end(self):
+        self.flush()
+
+    def abort(self):
+        """Release what begin() opened; export_document deletes the partial file"""
+
+
+class TextExporter(Exporter):
+    """Plain text, exactly as in the editor"""
+
+    def __init__(self, f, title):
+        super().__init__(f, title)
+        self.separator = ""
+
+    def write_line(self, line):
+        self.emit(self.separator + line)
+        self.separator = "\n"
+        if chapter_heading(line) is not None:
+            self.chapters += 1
+
+
+class MarkdownExporter(Exporter):
+    """Markdown: "# " headings stay headings, every other non-empty line becomes a paragraph"""
+    extension = ".md"
+
+    def write_line(self, line):
+        if not line.strip():
+            return
+        if chapter_heading(line) is not None:
+            self.chapters += 1
+        elif _MARKDOWN_BLOCK_START.match(line):
+            line = "\\" + line  # Text that would otherwise turn into a list, quote, heading or rule
+        self.emit(line + "\n\n")
+
+
+class DocxExporter(Exporter):
+    """A minimal Word document, written straight into the zip without python-docx.
+
+    Only word/document.xml grows with the text; it is compressed as it is
+    written. "# " lines become Heading 1 paragraphs.
+    """
+    extension = ".docx"
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '<Override PartName="/word/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+        '</Types>')
+    PACKAGE_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="word/document.xml"/></Relationships>')
+    DOCUMENT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'styles" Target="styles.xml"/></Relationships>')
+    STYLES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/>'
+        '<w:pPr><w:spacing w:after="160"/></w:pPr></w:style>'
+        '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+        '<w:rPr><w:sz w:val="56"/></w:rPr></w:style>'
+        '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+        '<w:pPr><w:keepNext/><w:spacing w:before="480"/><w:outlineLvl w:val="0"/></w:pPr>'
+        '<w:rPr><w:b/><w:sz w:val="32"/></w:rPr></w:style>'
+        '</w:styles>')
+
+    def begin(self):
+        self.zip = zipfile.ZipFile(self.f, 'w', zipfile.ZIP_DEFLATED)
+        self.zip.writestr("[Content_Types].xml", self.CONTENT_TYPES)
+        self.zip.writestr("_rels/.rels", self.PACKAGE_RELS)
+        self.zip.writestr("word/_rels/document.xml.rels", self.DOCUMENT_RELS)
+        self.zip.writestr("word/styles.xml", self.STYLES)
+        self.document = self.zip.open("word/document.xml", 'w')
+        self.emit('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                  '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+        self.paragraph(self.title, "Title")
+        self.paragraph(f"Created: {time.strftime('%Y-%m-%d %H:%M')}")
+
+    def output(self):
+        return self.document
+
+    def paragraph(self, text, style=None):
+        style = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+        self.emit(f'<w:p>{style}<w:r><w:t xml:space="preserve">{xml_text(text)}</w:t></w:r></w:p>')
+
+    def write_line(self, line):
+        if not line.strip():
+            return
+        title = chapter_heading(line)
+        if title is not None:
+            self.chapters += 1
+            self.paragraph(title, "Heading1")
+        else:
+            self.paragraph(line)
+
+    def end(self):
+        self.emit('<w:sectPr/></w:body></w:document>')
+        self.flush()
+        self.document.close()
+        self.zip.close()
+
+    def abort(self):
+        self.document.close()
+        self.zip.close()
+
+
+class EpubExporter(Exporter):
+    """An EPUB 3 book with one XHTML file per chapter.
+
+    Chapters are compressed into the zip as they are written; the package
+    document and table of contents, which list them, are added at the end.
+    """
+    extension = ".epub"
+    CONTAINER = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+        '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+        '</rootfiles></container>')
+
+    def begin(self):
+        self.zip = zipfile.ZipFile(self.f, 'w', zipfile.ZIP_DEFLATED)
+        # The mimetype must come first and uncompressed
+        self.zip.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", zipfile.ZIP_STORED)
+        self.zip.writestr("META-INF/container.xml", self.CONTAINER)
+        self.titles = []
+        self.chapter = None
+
+    def output(self):
+        return self.chapter
+
+    def start_chapter(self, title):
+        self.close_chapter()
+        self.titles.append(title)
+        self.chapters += 1
+        self.chapter = self.zip.open(f"OEBPS/chapter-{self.chapters:03d}.xhtml", 'w')
+        self.emit('<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+                  '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+                  f'<head><title>{xml_text(title)}</title></head><body><h1>{xml_text(title)}</h1>')
+
+    def close_chapter(self):
+        if self.chapter is not None:
+            self.emit('</body></html>')
+            self.flush()
+            self.chapter.close()
+            self.chapter = None
+
+    def write_line(self, line):
+        title = chapter_heading(line)
+        if title is not None:
+            self.start_chapter(title or "Untitled")
+        elif line.strip():
+            if self.chapter is None:
+                self.start_chapter(self.title)  # Text before the first heading
+            self.emit(f"<p>{xml_text(line)}</p>")
+
+    def end(self):
+        if not self.titles:
+            self.start_chapter(self.title)
+        self.close_chapter()
+        files = [f"chapter-{number:03d}.xhtml" for number in range(1, len(self.titles) + 1)]
+        manifest = "".join(f'<item id="c{number}" href="{name}" media-type="application/xhtml+xml"/>'
+                           for number, name in enumerate(files, 1))
+        spine = "".join(f'<itemref idref="c{number}"/>' for number in range(1, len(files) + 1))
+        self.zip.writestr("OEBPS/content.opf", (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="book-id">urn:uuid:{uuid.uuid4()}</dc:identifier>'
+            f'<dc:title>{xml_text(self.title)}</dc:title><dc:language>en</dc:language>'
+            f'<meta property="dcterms:modified">{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}</meta>'
+            '</metadata><manifest>'
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+            f'{manifest}</manifest><spine>{spine}</spine></package>'))
+        toc = "".join(f'<li><a href="{name}">{xml_text(title)}</a></li>' for name, title in zip(files, self.titles))
+        self.zip.writestr("OEBPS/nav.xhtml", (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f'<head><title>{xml_text(self.title)}</title></head><body>'
+            f'<nav epub:type="toc"><h1>Contents</h1><ol>{toc}</ol></nav></body></html>'))
+        self.zip.close()
+
+    def abort(self):
+        if self.chapter is not None:
+            self.chapter.close()
+        self.zip.close()
+
+
+EXPORTERS = {'txt': TextExporter, 'md': MarkdownExporter, 'docx': DocxExporter, 'epub': EpubExporter}
+
+
+def export_document(path, format, sources, title, progress=None, cancelled=None):
+    """Stream a document into `path` in one of the EXPORTERS formats.
+
+    `sources` are (heading, text) pairs: the text of each part (or a callable
+    returning it, so chapters are read one at a time) and, for chapters, a
+    title that becomes a "# " heading unless the text starts with one.
+    progress(fraction) and cancelled() are called every EXPORT_PROGRESS_LINES
+    lines. The file is written under a temporary name and only replaces
+    `path` once complete. Returns {'lines', 'chapters', 'bytes'}.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            exporter = EXPORTERS[format](f, title)
+            exporter.begin()
+            try:
+                lines = write_sources(exporter, sources, progress, cancelled)
+                exporter.end()
+            except BaseException:
+                exporter.abort()
+                raise
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+    return {'lines': lines, 'chapters': exporter.chapters, 'bytes': os.path.getsize(path)}
+
+
+def write_sources(exporter, sources, progress, cancelled):
+    lines = 0
+    for number, (heading, text) in enumerate(sources):
+        if callable(text):
+            text = text()
+        if heading is not None and chapter_heading(next(iter_lines(text))) is None:
+            exporter.write_line(f"# {heading}")
+        done = 0
+        for line in iter_lines(text, final_empty=number + 1 == len(sources)):
+            exporter.write_line(line)
+            lines += 1
+            done += len(line) + 1
+            if lines % EXPORT_PROGRESS_LINES == 0:
+                if cancelled is not None and cancelled():
+                    raise ExportCancelled()
+                if progress is not None:
+                    progress((number + min(1.0, done / max(1, len(text)))) / len(sources))
+    return lines
+
+
+# --- Import ---
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_DOCX_TEXT = {f"{_WORD_NS}t"}
+_DOCX_BREAKS = {f"{_WORD_NS}br": "\n", f"{_WORD_NS}cr": "\n", f"{_WORD_NS}tab": "\t",
+                f"{_WORD_NS}noBreakHyphen": "-"}
+
+
+def iter_text_lines(f):
+    """Lines of a text file opened with universal newlines, split as QTextDocument splits blocks"""
+    line = ""
+    for line in f:
+        text = line[:-1] if line.endswith("\n") else line
+        yield from text.split("\u2029") if "\u2029" in text else (text,)
+    if not line or line.endswith("\n"):
+        yield ""  # A newline at the end (or an empty file) leaves an empty last block
+
+
+def iter_docx_lines(f):
+    """Paragraphs of a word/document.xml stream, parsed one at a time.
+
+    Heading 1 paragraphs become "# " lines, as DocxExporter writes chapters;
+    line breaks inside a paragraph start a new line.
+    """
+    parts = []
+    heading = False
+    for _, element in ElementTree.iterparse(f, events=('end',)):
+        tag = element.tag
+        if tag in _DOCX_TEXT:
+            parts.append(element.text or "")
+        elif tag in _DOCX_BREAKS:
+            parts.append(_DOCX_BREAKS[tag])
+        elif tag == f"{_WORD_NS}pStyle":
+            style = element.get(f"{_WORD_NS}val", "").replace(" ", "").lower()
+            heading = style == "heading1"
+        elif tag == f"{_WORD_NS}p":
+            text = "".join(parts).replace("\u2029", "\n")
+            yield from (f"# {text}" if heading else text).split("\n")
+            parts = []
+            heading = False
+            element.clear()  # Keeps memory flat: finished paragraphs are dropped from the tree
+
+
+@contextlib.contextmanager
+def open_import(path):
+    """Yield (lines, position, size) for a .txt, .md or .docx file; position() / size is how much was read"""
+    if path.lower().endswith(".docx"):
+        with zipfile.ZipFile(path) as package, package.open("word/document.xml") as f:
+            yield iter_docx_lines(f), f.tell, package.getinfo("word/document.xml").file_size
+        return
+    with open(path, 'rb') as raw:
+        start = raw.read(4)
+        raw.seek(0)
+        encoding = 'utf-16' if start[:2] in (b"\xff\xfe", b"\xfe\xff") else 'utf-8-sig'
+        with open(path, 'r', encoding=encoding, errors='replace') as f:
+            yield iter_text_lines(f), f.buffer.tell, os.path.getsize(path)
+
+
+def import_chunks(path, chunk_chars=IMPORT_CHUNK_CHARS):
+    """Read a manuscript in pieces of whole lines without loading the file at once.
+
+    Yields (text, counts, fraction): about `chunk_chars` of lines joined by
+    newlines, the (characters, words) of each line as DocumentStats counts
+    editor blocks, and the fraction of the file read so far. Joining every
+    text with newlines gives the document.
+    """
+    with open_import(path) as (lines, position, size):
+        batch = []
+        counts = []
+        chars = 0
+        for line in lines:
+            batch.append(line)
+            counts.append((len(line), len(line.split())))
+            chars += len(line) + 1
+            if chars >= chunk_chars:
+                yield "\n".join(batch), counts, min(1.0, position() / size) if size else 1.0
+                batch = []
+                counts = []
+                chars = 0
+        if batch:
+            yield "\n".join(batch), counts, 1.0
+
+
+def import_pieces(path):
+    """The text import_chunks() reads from `path`, as pieces that concatenate to it"""
+    for number, (text, _, _) in enumerate(import_chunks(path)):
+        yield text if number == 0 else "\n" + text
+
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def _piece_cost(piece):
+    # Short words are usually one token, longer ones split into roughly six-letter pieces
+    return 1 + len(piece) // 6
+
+
+@functools.lru_cache(maxsize=512)
+def estimate_tokens(text):
+    """Approximate token count of `text` without loading a tokenizer.
+
+    Errs slightly on the high side so packed prompts stay inside num_ctx.
+    Results are cached, which makes repeated instructions and summaries free.
+    """
+    return sum(_piece_cost(piece) for piece in _TOKEN_PATTERN.findall(text))
+
+
+def trim_to_tokens(text, max_tokens, keep_end=True):
+    """Cut `text` to about max_tokens, keeping its end (or its start) at a word boundary"""
+    if max_tokens <= 0:
+        return ""
+    matches = list(_TOKEN_PATTERN.finditer(text))
+    total = sum(_piece_cost(m.group()) for m in matches)
+    if total <= max_tokens:
+        return text
+    if keep_end:
+        i = 0
+        while total > max_tokens:
+            total -= _piece_cost(matches[i].group())
+            i += 1
+        return text[matches[i].start():] if i < len(matches) else ""
+    i = len(matches)
+    while total > max_tokens:
+        i -= 1
+        total -= _piece_cost(matches[i].group())
+    return text[:matches[i - 1].end()] if i > 0 else ""
+
+
+MODEL_CONTEXT_LENGTHS = {}  # model name -> context length reported by /api/show
+_model_context_lock = threading.Lock()
+
+def load_model(client, model, keep_alive=None):
+    """Ask Ollama to load `model` into memory without generating anything"""
+    payload = {"model": model, "stream": False}
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    response = client.post("/api/generate", json=payload)
+    if response.status_code != 200:
+        raise RuntimeError(f"Model load Error: {response.status_code}")
+
+
+def fetch_model_context_length(client, model):
+    """Look up (once per model) how many tokens of context the model supports"""
+    with _model_context_lock:
+        if model in MODEL_CONTEXT_LENGTHS:
+            return MODEL_CONTEXT_LENGTHS[model]
+    length = FALLBACK_MODEL_CONTEXT
+    response = client.post("/api/show", json={"model": model}, read_timeout=OLLAMA_CONNECT_TIMEOUT * 2)
+    if response.status_code == 200:
+        data = response.json()
+        for key, value in (data.get('model_info') or {}).items():
+            if key.endswith(".context_length") and isinstance(value, int):
+                length = value
+                break
+        # A num_ctx set in the Modelfile is what the model was configured for
+        match = re.search(r"^num_ctx\s+(\d+)", data.get('parameters') or "", re.MULTILINE)
+        if match:
+            length = int(match.group(1)) if length == FALLBACK_MODEL_CONTEXT else min(length, int(match.group(1)))
+    with _model_context_lock:
+        MODEL_CONTEXT_LENGTHS[model] = length
+    return length
+
+
+def pack_prompt(instruction, summary, passages, context, current, budget):
+    """Fit the prompt sections into `budget` tokens.
+
+    The instruction and current text are always kept. The summary and passages
+    each get up to a fixed share of what is left, the context takes the rest and
+    loses its oldest text first, and anything the context doesn't need goes back
+    to the summary. Returns the packed pieces and a token breakdown.
+    """
+    used = estimate_tokens(instruction) + estimate_tokens(current or "") + PROMPT_SAFETY_TOKENS
+    free = max(0, budget - used)
+    
+    summary = summary or ""
+    summary_tokens = estimate_tokens(summary)
+    summary_cap = int(free * SUMMARY_BUDGET_SHARE)
+    packed_summary = trim_to_tokens(summary, summary_cap, keep_end=False) if summary_tokens > summary_cap else summary
+    
+    packed_passages = []
+    passages_tokens = 0
+    for score, text in passages or []:
+        cost = estimate_tokens(text)
+        if passages_tokens + cost > int(free * PASSAGES_BUDGET_SHARE):
+            break
+        packed_passages.append((score, text))
+        passages_tokens += cost
+    
+    context = context or ""
+    context_cap = free - estimate_tokens(packed_summary) - passages_tokens
+    packed_context = trim_to_tokens(context, context_cap)
+    context_tokens = estimate_tokens(packed_context)
+    
+    leftover = context_cap - context_tokens
+    if leftover > 0 and len(packed_summary) < len(summary):
+        packed_summary = trim_to_tokens(summary, estimate_tokens(packed_summary) + leftover, keep_end=False)
+    
+    breakdown = {
+        'budget': budget,
+        'instruction': estimate_tokens(instruction),
+        'summary': estimate_tokens(packed_summary),
+        'passages': passages_tokens,
+        'context': context_tokens,
+        'current': estimate_tokens(current or ""),
+        'trimmed_context_chars': len(context) - len(packed_context),
+        'trimmed_summary_chars': len(summary) - len(packed_summary),
+    }
+    breakdown['total'] = (breakdown['instruction'] + breakdown['summary'] + breakdown['passages']
+                          + breakdown['context'] + breakdown['current'])
+    return packed_summary, packed_passages, packed_context, breakdown
+
+
+def stable_context_start(length, context_chars):
+    """Where the context window of a `length`-character text starts in chat mode.
+
+    Instead of sliding with every character, the start stays put until the
+    window has grown to CHAT_CONTEXT_SPAN times context_chars, then moves on
+    by the difference, so the prompts sent while the text grows by that much
+    share the same context prefix. The start is a multiple of that step, not
+    a function of earlier calls, and the window overlaps the summarised text
+    rather than leaving a gap before it.
+    """
+    if length <= context_chars:
+        return 0
+    step = max(1, int(context_chars * (CHAT_CONTEXT_SPAN - 1)))
+    return (length - context_chars) // step * step
+
+
+class CompletionStreamCleaner:
+    """Applies Generation.clean_completion to a streamed completion.
+
+    The start of the stream is held back until it is long enough to tell whether
+    it carries an echoed prompt or a "continuation:" style prefix. After that,
+    chunks pass straight through, except trailing whitespace, which is only
+    released once more text follows it (the non-streamed result is stripped too).
+    """
+
+    def __init__(self, original, clean_func, prefixes):
+        self.original = original
+        self.clean_func = clean_func
+        # Enough characters to cover the echoed prompt, the longest prefix and a quote
+        self.threshold = len(original.strip()) + max(len(p) for p in prefixes) + 2
+        self.head = ""
+        self.decided = False
+        self.pending_ws = ""
+        self.parts = []
+
+    def feed(self, chunk):
+        """Add a raw chunk and return the cleaned text that can be shown now"""
+        if not chunk:
+            return ""
+        if not self.decided:
+            self.head += chunk
+            if len(self.head.lstrip()) <= self.threshold:
+                return ""
+            self.decided = True
+            body = self.head.rstrip()
+            self.pending_ws = self.head[len(body):]
+            return self._emit(self.clean_func(self.original, body))
+
+        text = self.pending_ws + chunk
+        body = text.rstrip()
+        self.pending_ws = text[len(body):]
+        return self._emit(body)
+
+    def finish(self):
+        """Flush whatever is still held back once the stream is complete"""
+        if not self.decided:
+            self.decided = True
+            return self._emit(self.clean_func(self.original, self.head))
+        self.pending_ws = ""
+        return ""
+
+    def text(self):
+        return "".join(self.parts)
+
+    def _emit(self, text):
+        if text:
+            self.parts.append(text)
+        return text
+
+
+class GenerationCancelled(Exception):
+    """Raised by Generation.run when it was cancelled; carries the text received so far"""
+
+    def __init__(self, partial_text, reason):
+        super().__init__(reason)
+        self.partial_text = partial_text
+        self.reason = reason
+
+
+class Generation:
+    """One continuation request: builds the prompt, streams it from Ollama and cleans the result.
+
+    run() blocks until the completion is done and returns it. Progress is
+    reported through optional callbacks (on_partial for cleaned text as it
+    arrives, on_stats for Ollama's final fields, on_kv_context for the context
+    tokens), so the same code drives OllamaWorker in the app and the batch CLI.
+    cancel() may be called from another thread.
+
+    With `chat`, the request goes to /api/chat instead (see build_messages);
+    context tokens are not used there, Ollama reuses the shared prompt prefix.
+
+    In a BackendPool queue the request waits with `priority` (a warm-up with
+    PRIORITY_WARMUP); cancelling takes it out of the queue if it is still there.
+    """
+
+    CLEAN_PREFIXES = [
+        "here's the continuation: ", "continuation: ", "continued: ", 
+        "here is the completion: ", "here's the completion: ",
+        "the continuation is: ", "completion: ", "### Continuation ###",
+        "### CONTINUATION ###"
+    ]
+
+    def __init__(self, model, prompt="", context=None, temperature=DEFAULT_TEMPERATURE,
+                 token_limit=DEFAULT_TOKEN_LIMIT, genre="Neutral", memory_summary=None, client=None,
+                 kv_tokens=None, deadline=0, min_tokens_per_second=0, retriever=None,
+                 num_ctx_limit=None, seed=None, cache=None, keep_alive=None, chat=False,
+                 priority=PRIORITY_INTERACTIVE, on_partial=None, on_stats=None, on_kv_context=None):
+        self.client = client or get_ollama_client()
+        self.model = model
+        self.chat = chat
+        self.endpoint = "/api/chat" if chat else "/api/generate"
+        self.prompt = prompt
+        self.context = context
+        self.temperature = temperature
+        self.token_limit = token_limit
+        self.genre = genre
+        self.memory_summary = memory_summary
+        self.kv_tokens = None if chat else kv_tokens
+        self.deadline = deadline
+        self.min_tokens_per_second = min_tokens_per_second
+        self.retriever = retriever
+        self.passages = []
+        self.num_ctx_limit = num_ctx_limit
+        self.seed = seed
+        self.cache = cache
+        self.cache_key = None
+        self.keep_alive = keep_alive
+        self.priority = priority
+        self.on_partial = on_partial
+        self.on_stats = on_stats
+        self.on_kv_context = on_kv_context
+        self.budget = {}
+        self.prompt_fingerprint = None
+        self.cancel_reason = None
+        self.cleaner = None
+        self.response = None
+        self.running = False
+        self.token_count = 0
+        self.started_at = None
+        self.first_token_at = None
+
+    def build_payload(self):
+        """Look up passages, fit the prompt into the context window and return the request body"""
+        if self.retriever:
+            self.passages = self.retriever()
+        if self.num_ctx_limit:
+            self.fit_to_context_window()
+        # Always read Ollama's stream so the request can be aborted part way
+        payload = {"model": self.model}
+        if self.chat:
+            payload["messages"] = self.build_messages()
+        else:
+            payload["prompt"] = self.build_prompt()
+        payload.update({
+            "stream": True,
+            "options": {
+                "num_predict": self.token_limit,
+                "temperature": self.temperature
+            }
+        })
+        if self.kv_tokens:
+            payload["context"] = self.kv_tokens
+        if self.num_ctx_limit:
+            payload["options"]["num_ctx"] = self.budget['num_ctx']
+        if self.seed is not None:
+            payload["options"]["seed"] = self.seed
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        self.prompt_fingerprint = self.fingerprint(payload)
+        return payload
+
+    def run(self):
+        """Generate the continuation and return the cleaned text"""
+        payload = self.build_payload()
+        if self.cache is not None and CompletionCache.cacheable(payload):
+            self.cache_key = CompletionCache.key(payload)
+            entry = self.cache.get(self.cache_key)
+            if entry is not None:
+                return self.replay_cached(entry)
+        return self.run_stream(payload)
+
+    def warm_up(self):
+        """Send the prompt so Ollama evaluates and caches it, then hang up after the first token.
+
+        Returns the prompt fingerprint, which matches the one of a later run()
+        with the same inputs.
+        """
+        payload = self.build_payload()
+        payload["options"]["num_predict"] = WARMUP_NUM_PREDICT
+        with self.client.post(self.endpoint, json=payload, stream=True, priority=PRIORITY_WARMUP,
+                              owner=self) as response:
+            self.response = response
+            if self.cancel_reason:
+                self.abort_response()
+                raise GenerationCancelled("", self.cancel_reason)
+            if response.status_code != 200:
+                raise RuntimeError(f"Warm-up Error: {response.status_code}")
+            # The first chunk only arrives once the whole prompt has been evaluated
+            for line in response.iter_lines():
+                if line:
+                    break
+        if self.cancel_reason:
+            raise GenerationCancelled("", self.cancel_reason)
+        return self.prompt_fingerprint
+
+    def fit_to_context_window(self):
+        """Choose num_ctx for the model and pack the prompt sections to fit inside it"""
+        model_ctx = fetch_model_context_length(self.client, self.model)
+        num_ctx = min(model_ctx, self.num_ctx_limit)
+        budget = num_ctx - self.token_limit
+        if self.kv_tokens:
+            self.budget = {'num_ctx': num_ctx, 'model_ctx': model_ctx, 'budget': budget,
+                           'reused': len(self.kv_tokens)}
+            return
+        instruction = GENRE_INSTRUCTIONS.get(self.genre, GENRE_INSTRUCTIONS["Neutral"])
+        self.memory_summary, self.passages, self.context, breakdown = pack_prompt(
+            instruction, self.memory_summary, self.passages, self.context, self.prompt, budget)
+        breakdown.update({'num_ctx': num_ctx, 'model_ctx': model_ctx, 'output': self.token_limit})
+        self.budget = breakdown
+
+    def build_prompt(self):
+        if self.kv_tokens:
+            # Instruction and earlier text are already in the reused context tokens,
+            # so only the text added since the last generation is sent
+            prompt_parts = []
+            new_text = (self.context or "") + (self.prompt or "")
+            if new_text:
+                prompt_parts.append(f"\n\n### CURRENT TEXT ###\n{new_text}\n")
+            prompt_parts.append("\n### CONTINUATION ###\n")
+            return "".join(prompt_parts)
+        
+        system_instruction = GENRE_INSTRUCTIONS.get(self.genre, GENRE_INSTRUCTIONS["Neutral"])
+        
+        # Build prompt with memory context
+        prompt_parts = [system_instruction]
+        
+        if self.memory_summary:
+            prompt_parts.append(f"\n\n### STORY SUMMARY (Memory) ###\n{self.memory_summary}\n")
+        
+        if self.passages:
+            passages = "\n\n".join(text for _, text in self.passages)
+            prompt_parts.append(f"\n\n### RELEVANT EARLIER PASSAGES ###\n{passages}\n")
+        
+        if self.context:
+            prompt_parts.append(f"\n\n### PREVIOUS CONTEXT ###\n{self.context}\n")
+        
+        prompt_parts.append(f"\n\n### CURRENT TEXT ###\n{self.prompt}\n")
+        prompt_parts.append("\n### CONTINUATION ###\n")
+        
+        return "".join(prompt_parts)
+
+    def build_messages(self):
+        """Chat messages for /api/chat, ordered from the most stable content to the most volatile.
+
+        Ollama keeps the last prompt evaluated and only evaluates what follows
+        the prefix a new prompt shares with it. The genre instruction is the
+        system message; the summary changes only when text leaves the context
+        window, and the context (see stable_context_start) only when its start
+        takes a step. Retrieved passages depend on the last paragraph, so they
+        come last, just before the text to continue.
+        """
+        system_instruction = GENRE_INSTRUCTIONS.get(self.genre, GENRE_INSTRUCTIONS["Neutral"])
+        parts = []
+        if self.memory_summary:
+            parts.append(f"### STORY SUMMARY (Memory) ###\n{self.memory_summary}\n")
+        if self.context:
+            parts.append(f"### PREVIOUS CONTEXT ###\n{self.context}\n")
+        if self.passages:
+            passages = "\n\n".join(text for _, text in self.passages)
+            parts.append(f"### RELEVANT EARLIER PASSAGES ###\n{passages}\n")
+        parts.append(f"### CURRENT TEXT ###\n{self.prompt}\n")
+        parts.append("### CONTINUATION ###\n")
+        return [{"role": "system", "content": system_instruction},
+                {"role": "user", "content": "\n".join(parts)}]
+
+    @staticmethod
+    def fingerprint(payload):
+        """Hash of everything that decides which prompt prefix Ollama evaluates"""
+        prompt = payload["prompt"] if "prompt" in payload else payload["messages"]
+        key = [payload["model"], prompt, payload["options"].get("num_ctx"), payload.get("context")]
+        return hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+
+    def replay_cached(self, entry):
+        """Deliver a cached completion exactly as a fresh one would arrive"""
+        timing = RequestTiming("CACHE", self.endpoint)
+        timing.finish()
+        self.emit_stats(entry['final'], timing)
+        if entry['text'] and self.on_partial:
+            self.on_partial(entry['text'])
+        return entry['text']
+
+    def run_stream(self, payload):
+        """Read Ollama's NDJSON stream, reporting cleaned text as it arrives"""
+        cleaner = self.cleaner = CompletionStreamCleaner(self.prompt, self.clean_completion, self.CLEAN_PREFIXES)
+        final = {}
+        self.started_at = time.monotonic()
+        self.running = True
+        watchdog = threading.Thread(target=self.watch_limits, daemon=True)
+        watchdog.start()
+        try:
+            with self.client.post(self.endpoint, json=payload, stream=True, priority=self.priority,
+                                  owner=self) as response:
+                self.response = response
+                if self.cancel_reason:
+                    self.abort_response()
+                if response.status_code != 200:
+                    raise RuntimeError(f"Generation Error: {response.status_code}")
+                for line in response.iter_lines():
+                    if self.cancel_reason:
+                        break
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get('error'):
+                        raise RuntimeError(f"Generation Error: {data['error']}")
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                    self.token_count += 1
+                    chunk = (data.get('message') or {}).get('content', '') if self.chat else data.get('response', '')
+                    text = cleaner.feed(chunk)
+                    if text and self.on_partial:
+                        self.on_partial(text)
+                    if data.get('done'):
+                        final = data
+                        break
+        except Exception:
+            # Aborting the connection surfaces as an exception; that is a cancel, not an error
+            if self.cancel_reason:
+                raise GenerationCancelled(self.partial_text(), self.cancel_reason)
+            raise
+        finally:
+            self.running = False
+        if self.cancel_reason:
+            raise GenerationCancelled(self.partial_text(), self.cancel_reason)
+        response.timing.finish(final.get('total_duration'))
+        self.emit_stats(final, response.timing)
+        text = cleaner.finish()
+        if text and self.on_partial:
+            self.on_partial(text)
+        if self.cache_key and final:
+            self.cache.put(self.cache_key, {'text': cleaner.text(), 'final': final})
+        return cleaner.text()
+
+    def cancel(self, reason="Stopped"):
+        """Stop the generation and close the connection so Ollama stops decoding too"""
+        if self.cancel_reason:
+            return
+        self.cancel_reason = reason
+        self.client.drop(self)
+        self.abort_response()
+
+    def abort_response(self):
+        response = self.response
+        if response is None:
+            return
+        # Closing the file object does not wake a thread blocked in recv(), shutting the socket down does
+        try:
+            sock = response.raw._connection.sock
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        try:
+            response.close()
+        except Exception:
+            pass
+
+    def partial_text(self):
+        """Cleaned text received so far, including anything the cleaner still holds back"""
+        if self.cleaner is None:
+            return ""
+        if not self.cleaner.decided:
+            return self.clean_completion(self.prompt, self.cleaner.head)
+        return self.cleaner.text()
+
+    def watch_limits(self):
+        """Enforce the overall deadline and the minimum decoding speed"""
+        while self.running and not self.cancel_reason:
+            now = time.monotonic()
+            if self.deadline and now - self.started_at > self.deadline:
+                self.cancel(f"Deadline of {self.deadline} s reached")
+            elif self.min_tokens_per_second and self.first_token_at is not None:
+                if now - self.first_token_at > WATCHDOG_GRACE_SECONDS:
+                    rate = self.tokens_per_second()
+                    if rate < self.min_tokens_per_second:
+                        self.cancel(f"Too slow ({rate:.1f} tokens/s)")
+            time.sleep(0.2)
+
+    def tokens_per_second(self):
+        """Decoding speed so far, measured from the first token (None until it arrives)"""
+        if self.first_token_at is None:
+            return None
+        elapsed = time.monotonic() - self.first_token_at
+        return self.token_count / elapsed if elapsed > 0 else None
+
+    def emit_stats(self, data, timing):
+        """Report Ollama's final response fields together with the request timing"""
+        stats = {key: value for key, value in data.items() if key not in ('response', 'message', 'context')}
+        stats['prompt_mode'] = "chat" if self.chat else "generate"
+        stats['kv_reused_tokens'] = len(self.kv_tokens) if self.kv_tokens else 0
+        stats['retrieved_passages'] = len(self.passages)
+        stats['budget'] = self.budget
+        stats['prompt_fingerprint'] = self.prompt_fingerprint
+        stats['cache'] = None if self.cache_key is None else timing.method == "CACHE"
+        stats['first_token_s'] = (self.first_token_at - self.started_at
+                                  if self.first_token_at is not None else None)
+        stats['timing'] = timing.as_dict()
+        stats['timing_summary'] = timing.summary()
+        if self.on_stats:
+            self.on_stats(stats)
+        if data.get('context') and self.on_kv_context:
+            self.on_kv_context(data['context'])
+
+    def clean_completion(self, original, completion):
+        original_stripped = original.strip()
+        completion_stripped = completion.strip()
+
+        if completion_stripped.startswith(original_stripped):
+            completion_stripped = completion_stripped[len(original_stripped):].strip()
+
+        for prefix in self.CLEAN_PREFIXES:
+            if completion_stripped.lower().startswith(prefix):
+                completion_stripped = completion_stripped[len(prefix):].strip()
+
+        if completion_stripped.startswith('"') and not original_stripped.endswith('"'):
+            completion_stripped = completion_stripped[1:].strip()
+
+        return completion_stripped
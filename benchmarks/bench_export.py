@@ -0,0 +1,78 @@
+"""Background export of a novel-length (10 MB) manuscript to every format.
+
+Loads a generated document of the given size into MainWindow, then exports it
+through MainWindow.start_export as the buttons do, and records per format:
+
+* start: UI-thread time to take the snapshot and start the export worker
+* total: until the worker reports the file written
+* UI-thread stalls while the export runs (a 2 ms heartbeat timer, as in bench_generation)
+* the size of the file
+
+    python benchmarks/bench_export.py [--mb 10] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from common import make_window, qt_app, sample_text, wait_until
+from bench_generation import Heartbeat
+
+FORMATS = ('txt', 'md', 'docx', 'epub')
+EXPORT_TIMEOUT = 300
+
+
+def run(megabytes):
+    window = make_window()
+    app = qt_app()
+    # A "# " heading every 20 paragraphs (2400 words) gives the EPUB its chapters
+    lines = sample_text(int(megabytes * 1024 * 1024 / 5.3)).split("\n")
+    text = "\n".join(f"# Chapter {i // 20 + 1}\n{line}" if i % 20 == 0 else line for i, line in enumerate(lines))
+    del lines
+    window.editor.setPlainText(text)
+    app.processEvents()
+    del text
+
+    results = []
+    heartbeat = Heartbeat()
+    with tempfile.TemporaryDirectory() as directory:
+        for format in FORMATS:
+            path = os.path.join(directory, f"bench.{format}")
+            exported = []
+            heartbeat.start()
+            started = time.perf_counter()
+            window.start_export(path, format)
+            worker = window.export_worker
+            worker.exported.connect(exported.append)
+            start_ms = (time.perf_counter() - started) * 1000
+            if not wait_until(lambda: window.export_worker is None, EXPORT_TIMEOUT):
+                raise RuntimeError(f"{format} export did not finish")
+            total_ms = (time.perf_counter() - started) * 1000
+            result = dict(heartbeat.stop(), name=format, start_ms=start_ms, total_ms=total_ms,
+                          bytes=os.path.getsize(path) if exported else None)
+            results.append(result)
+    window.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=10, help="document size in megabytes")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.mb)
+    for result in results:
+        print(f"{result['name']:<5} start {result['start_ms']:7.1f} ms  total {result['total_ms']:8.1f} ms  "
+              f"longest stall {result['max_gap_ms']:6.1f} ms  {(result['bytes'] or 0) / 1e6:6.1f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'export', 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
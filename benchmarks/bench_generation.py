@@ -0,0 +1,188 @@
+"""Generation latency and UI-thread stalls against fake_ollama.
+
+Two passes, both offscreen against a local fake_ollama server with a fixed
+per-token delay, so the numbers reflect the app and not the model:
+
+* worker: runs OllamaWorker generations and measures time to the first
+  streamed text and to the finished signal, as seen on the UI thread.
+* window: types a document of each size into MainWindow, presses Generate and
+  measures the same latencies plus how long the UI thread was blocked. A
+  heartbeat timer ticks on the UI thread throughout; any gap between ticks
+  longer than a 60 Hz frame counts as stall time.
+
+    python benchmarks/bench_generation.py [--sizes 1000,100000] [--runs 3] [--tokens 100]
+    python benchmarks/bench_generation.py --replay session.jsonl   # recorded Ollama timings
+"""
+import sys
+import json
+import time
+import argparse
+from statistics import median
+
+from common import load_app, make_window, qt_app, sample_text, start_fake_ollama, wait_until
+
+FRAME_MS = 1000 / 60
+HEARTBEAT_MS = 2
+
+
+class Heartbeat:
+    """Ticks on the UI thread and records how late each tick was"""
+
+    def __init__(self):
+        from PyQt5.QtCore import Qt, QTimer
+        self.timer = QTimer()
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(HEARTBEAT_MS)
+        self.timer.timeout.connect(self.tick)
+        self.gaps = []
+        self.last = None
+
+    def start(self):
+        self.gaps = []
+        self.last = time.perf_counter()
+        self.timer.start()
+
+    def tick(self):
+        now = time.perf_counter()
+        self.gaps.append((now - self.last) * 1000)
+        self.last = now
+
+    def stop(self):
+        self.tick()
+        self.timer.stop()
+        return {
+            'max_gap_ms': max(self.gaps),
+            'stall_ms': sum(gap - FRAME_MS for gap in self.gaps if gap > FRAME_MS),
+        }
+
+
+def generate_with_worker(app_module, client, model, text, tokens, timeout):
+    """One OllamaWorker generation; returns its timings"""
+    worker = app_module.OllamaWorker(endpoint="generate", model=model, prompt="", context=text,
+                                     token_limit=tokens, stream=True, client=client)
+    marks = {}
+    stats = {}
+    worker.partial.connect(lambda _: marks.setdefault('first', time.perf_counter()))
+    worker.stats.connect(stats.update)
+    for signal in (worker.finished, worker.error):
+        signal.connect(lambda *_: marks.setdefault('done', time.perf_counter()))
+    started = time.perf_counter()
+    worker.start()
+    if not wait_until(lambda: 'done' in marks, timeout):
+        worker.cancel("Benchmark timeout")
+    worker.wait()
+    return {
+        'ttft_ms': (marks['first'] - started) * 1000 if 'first' in marks else None,
+        'total_ms': (marks['done'] - started) * 1000 if 'done' in marks else None,
+        'worker_first_token_ms': stats['first_token_s'] * 1000 if stats.get('first_token_s') else None,
+        'eval_count': stats.get('eval_count'),
+    }
+
+
+def generate_in_window(window, heartbeat, streaming, timeout):
+    """Press Generate once; returns latencies and UI stalls"""
+    document = window.editor.document()
+    window.streaming_enabled = streaming
+    marks = {}
+    on_change = lambda *_: marks.setdefault('first', time.perf_counter())
+
+    heartbeat.start()
+    started = time.perf_counter()
+    document.contentsChange.connect(on_change)
+    window.start_generation()
+    marks['started'] = time.perf_counter()
+    finished = wait_until(lambda: window.generation_worker is None, timeout)
+    ended = time.perf_counter()
+    document.contentsChange.disconnect(on_change)
+    # Whatever runs right after the finish (stats, memory view) is part of the stall
+    wait_until(lambda: time.perf_counter() - ended > 0.05)
+    stalls = heartbeat.stop()
+    if not finished:
+        window.stop_generation()
+    return dict({
+        'ttft_ms': (marks['first'] - started) * 1000 if 'first' in marks else None,
+        'total_ms': (ended - started) * 1000 if finished else None,
+        'start_call_ms': (marks['started'] - started) * 1000,
+    }, **stalls)
+
+
+def summarize(name, runs, **fields):
+    """Median of each metric over the runs"""
+    result = dict(fields, name=name, runs=len(runs))
+    for key in runs[0]:
+        values = [run[key] for run in runs if run[key] is not None]
+        result[key] = median(values) if values else None
+    return result
+
+
+def run(sizes, runs, tokens, token_delay, prompt_delay, replay=None, timeout=60):
+    """Worker and window results for each document size (in words)"""
+    server = start_fake_ollama(token_delay=token_delay, prompt_delay=prompt_delay, tokens=tokens,
+                               replay_path=replay)
+    app_module = load_app()
+    qt_app()
+    from PyQt5.QtGui import QTextCursor
+    from ai_writer_core import OllamaClient
+    client = OllamaClient(server.url)
+    model = client.get("/api/tags").json()['models'][0]['name']  # The recorded model when replaying
+    results = []
+    try:
+        for words in sizes:
+            context = sample_text(words)[-app_module.DEFAULT_CONTEXT_CHARS:]
+            timings = [generate_with_worker(app_module, client, model, context, tokens, timeout)
+                       for _ in range(runs)]
+            results.append(summarize(f"worker {words}w", timings, words=words, tokens=tokens))
+
+        window = make_window(scan=True)
+        wait_until(window.has_models)
+        window.model_combo.setCurrentText(model)
+        window.token_limit = tokens
+        heartbeat = Heartbeat()
+        for words in sizes:
+            text = sample_text(words)
+            for streaming in (True, False):
+                timings = []
+                for _ in range(runs):
+                    window.kv_session = None  # Every run sends the full prompt
+                    window.editor.setPlainText(text)
+                    window.editor.moveCursor(QTextCursor.End)
+                    qt_app().processEvents()
+                    timings.append(generate_in_window(window, heartbeat, streaming, timeout))
+                mode = "stream" if streaming else "batch"
+                results.append(summarize(f"window {words}w {mode}", timings, words=words, tokens=tokens))
+        window.close()
+    finally:
+        server.shutdown()
+    return results
+
+
+def format_ms(value):
+    return "      -" if value is None else f"{value:7.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,100000", help="comma separated document sizes in words")
+    parser.add_argument("--runs", type=int, default=3, help="generations per case (the median is reported)")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per generation")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="fake server seconds per token")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="fake server seconds per 1000 prompt tokens")
+    parser.add_argument("--replay", help="serve a recorded Ollama session instead of synthetic text")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run([int(size) for size in args.sizes.split(",")], args.runs, args.tokens,
+                  args.token_delay, args.prompt_delay, args.replay)
+    print(f"{'case':<24}{'ttft ms':>9}{'total ms':>10}{'stall ms':>10}{'max gap':>9}")
+    for result in results:
+        print(f"{result['name']:<24}{format_ms(result['ttft_ms']):>9}{format_ms(result['total_ms']):>10}"
+              f"{format_ms(result.get('stall_ms')):>10}{format_ms(result.get('max_gap_ms')):>9}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'generation', 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""Opening a novel-length (10 MB) manuscript as .txt and .docx.
+
+Writes a generated document of the given size to disk, opens it through
+MainWindow.import_file as the Open button does, and records per format:
+
+* total: until the whole document is in the editor with its counts
+* UI-thread stalls while it opens (a 2 ms heartbeat timer, as in bench_generation)
+
+For comparison, "paste" puts the same text into the editor with setPlainText
+in one go, which is what opening a file amounted to before.
+
+    python benchmarks/bench_import.py [--mb 10] [--json results.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+from common import make_window, qt_app, sample_text, wait_until
+from bench_generation import Heartbeat
+
+FORMATS = ('txt', 'docx')
+IMPORT_TIMEOUT = 300
+
+
+def run(megabytes):
+    window = make_window()
+    from ai_writer_core import export_document  # Importable once make_window has loaded the app
+    app = qt_app()
+    text = sample_text(int(megabytes * 1024 * 1024 / 5.3))
+    results = []
+    heartbeat = Heartbeat()
+    with tempfile.TemporaryDirectory() as directory:
+        for format in FORMATS:
+            path = os.path.join(directory, f"bench.{format}")
+            export_document(path, format, [(None, text)], "Bench")
+            heartbeat.start()
+            started = time.perf_counter()
+            window.import_file(path)
+            if not wait_until(lambda: window.import_worker is None, IMPORT_TIMEOUT):
+                raise RuntimeError(f"{format} import did not finish")
+            total_ms = (time.perf_counter() - started) * 1000
+            results.append(dict(heartbeat.stop(), name=format, total_ms=total_ms,
+                                words=window.doc_stats.word_count))
+            window.editor.document().setModified(False)
+
+        heartbeat.start()
+        started = time.perf_counter()
+        window.editor.setPlainText(text)
+        app.processEvents()
+        total_ms = (time.perf_counter() - started) * 1000
+        results.append(dict(heartbeat.stop(), name="paste", total_ms=total_ms, words=window.doc_stats.word_count))
+        window.editor.document().setModified(False)
+    window.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=10, help="document size in megabytes")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.mb)
+    for result in results:
+        print(f"{result['name']:<5} total {result['total_ms']:8.1f} ms  longest stall {result['max_gap_ms']:7.1f} ms  "
+              f"stalled {result['stall_ms']:7.1f} ms  {result['words']} words")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'import', 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
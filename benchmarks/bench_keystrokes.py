@@ -0,0 +1,80 @@
+"""Keystroke handling time at growing document sizes.
+
+Types characters at the end of documents of increasing size and reports the
+mean and worst time the editor took to process each key, including every
+textChanged/contentsChange handler in MainWindow. With incremental statistics
+the numbers should stay roughly flat as the document grows.
+
+    python benchmarks/bench_keystrokes.py [--sizes 1000,10000,100000,300000] [--keys 200]
+"""
+import sys
+import json
+import time
+import argparse
+
+from common import make_window, qt_app, sample_text
+
+
+def bench_size(window, words, keys):
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtTest import QTest
+    from PyQt5.QtGui import QTextCursor
+
+    app = qt_app()
+    window.editor.setPlainText(sample_text(words))
+    window.editor.moveCursor(QTextCursor.End)
+    window.editor.setFocus()
+    app.processEvents()
+
+    timings = []
+    for i in range(keys):
+        key = Qt.Key_Space if i % 6 == 5 else Qt.Key_A
+        started = time.perf_counter()
+        QTest.keyClick(window.editor, key)
+        app.processEvents()
+        timings.append(time.perf_counter() - started)
+
+    # Let the debounced status bar refresh run once so it is measured as well
+    started = time.perf_counter()
+    window.refresh_text_stats()
+    refresh = time.perf_counter() - started
+
+    timings.sort()
+    return {
+        'words': words,
+        'chars': window.doc_stats.char_count,
+        'keys': keys,
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p95_ms': timings[int(len(timings) * 0.95) - 1] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'stats_refresh_ms': refresh * 1000,
+    }
+
+
+def run(sizes, keys):
+    """Keystroke timings for each document size (in words)"""
+    window = make_window()
+    return [bench_size(window, words, keys) for words in sizes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,300000",
+                        help="comma separated document sizes in words")
+    parser.add_argument("--keys", type=int, default=200, help="keystrokes per size")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run([int(size) for size in args.sizes.split(",")], args.keys)
+    for result in results:
+        print(f"{result['words']:>8} words  mean {result['mean_ms']:7.3f} ms  "
+              f"p95 {result['p95_ms']:7.3f} ms  max {result['max_ms']:7.3f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'keystrokes', 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
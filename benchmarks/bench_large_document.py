@@ -0,0 +1,161 @@
+"""Editor responsiveness on a novel-length (10 MB) manuscript.
+
+Loads a generated document of the given size into MainWindow and times:
+
+* open: setPlainText until the window has processed the resulting events, then
+  the UI-thread time spent over the next seconds (background layout) and the
+  longest single stall in it
+* scroll: jumping the scroll bar through the document, repainting each time
+* type: keystrokes at the end and in the middle of the document
+* prepare: building a generation request (context, memory summary, retrieval query)
+* insert: inserting streamed completion chunks at the end, as a generation does
+
+plus the growth of the process's peak memory while the document is open.
+
+    python benchmarks/bench_large_document.py [--mb 10] [--keys 100] [--json results.json]
+"""
+import sys
+import json
+import time
+import argparse
+
+from common import make_window, qt_app, sample_text
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SETTLE_SECONDS = 2
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)  # bytes on macOS, KiB elsewhere
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'mean_ms': sum(timings) / len(timings) * 1000,
+        'p95_ms': timings[max(0, int(len(timings) * 0.95) - 1)] * 1000,
+        'max_ms': timings[-1] * 1000,
+    }
+
+
+def settle(seconds):
+    """Let the event loop run for a while; returns (total, longest) time spent processing events in ms"""
+    app = qt_app()
+    busy = longest = 0.0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        app.processEvents()
+        spent = time.perf_counter() - started
+        busy += spent
+        longest = max(longest, spent)
+        time.sleep(0.005)
+    return busy * 1000, longest * 1000
+
+
+def timed(action, repeat):
+    app = qt_app()
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        action(i)
+        app.processEvents()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def run(megabytes, keys):
+    from PyQt5.QtCore import Qt
+    from PyQt5.QtTest import QTest
+    from PyQt5.QtGui import QTextCursor
+
+    window = make_window()
+    app = qt_app()
+    window.model_combo.addItem("bench:latest")
+    window.model_combo.setCurrentText("bench:latest")
+    editor = window.editor
+    text = sample_text(int(megabytes * 1024 * 1024 / 5.3))  # About 5.3 bytes per word with spaces
+    memory_before = peak_rss_mb()
+    results = {'chars': len(text)}
+
+    started = time.perf_counter()
+    editor.setPlainText(text)
+    app.processEvents()
+    results['open_ms'] = (time.perf_counter() - started) * 1000
+    del text
+    results['after_open_busy_ms'], results['after_open_max_stall_ms'] = settle(SETTLE_SECONDS)
+
+    scroll_bar = editor.verticalScrollBar()
+    steps = 50
+
+    def scroll(i):
+        scroll_bar.setValue(scroll_bar.maximum() * i // (steps - 1))
+        editor.viewport().repaint()
+
+    results['scroll'] = timed(scroll, steps)
+
+    editor.setFocus()
+
+    def type_at(position):
+        def key(i):
+            if i == 0:
+                cursor = editor.textCursor()
+                cursor.setPosition(position() if callable(position) else position)
+                editor.setTextCursor(cursor)
+            QTest.keyClick(editor, Qt.Key_Space if i % 6 == 5 else Qt.Key_A)
+        return key
+
+    document = editor.document()
+    results['type_end'] = timed(type_at(lambda: document.characterCount() - 1), keys)
+    results['type_middle'] = timed(type_at(document.characterCount() // 2), keys)
+    results['prepare'] = timed(lambda i: window.generation_args("bench:latest"), 20)
+
+    def insert(i):
+        if i == 0:
+            window.generation_cursor_pos = window.stream_insert_pos = document.characterCount() - 1
+        window.stream_buffer = [" and the rain kept falling"]
+        window.flush_stream_buffer()
+
+    results['insert'] = timed(insert, keys)
+    editor.moveCursor(QTextCursor.End)
+
+    memory_after = peak_rss_mb()
+    if memory_before is not None:
+        results['peak_memory_growth_mb'] = memory_after - memory_before
+    window.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=10, help="document size in megabytes")
+    parser.add_argument("--keys", type=int, default=100, help="keystrokes and insertions per case")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run(args.mb, args.keys)
+    print(f"{results['chars'] / 1e6:.1f} M characters, open {results['open_ms']:.0f} ms, "
+          f"then {results['after_open_busy_ms']:.0f} ms busy (longest stall "
+          f"{results['after_open_max_stall_ms']:.0f} ms) in the next {SETTLE_SECONDS} s")
+    for name in ('scroll', 'type_end', 'type_middle', 'prepare', 'insert'):
+        result = results[name]
+        print(f"{name:<12} mean {result['mean_ms']:8.3f} ms  p95 {result['p95_ms']:8.3f} ms  "
+              f"max {result['max_ms']:8.3f} ms")
+    if 'peak_memory_growth_mb' in results:
+        print(f"peak memory grew by {results['peak_memory_growth_mb']:.0f} MB")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'large_document', 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+"""Prompt tokens Ollama evaluates per generation, /api/generate against /api/chat.
+
+Simulates a writing session: a draft grows by a typed sentence and the
+completion after every generation, with a rolling summary that is refreshed
+every few generations, as in the app. The same session runs once per prompt
+mode through ai_writer_core.Generation, without and with retrieved passages
+(which change with the last paragraph, so with every generation), and
+records per generation:
+
+* prompt_eval_count: tokens Ollama evaluated (the rest came from its prompt cache)
+* first_token: time to the first streamed token
+
+Besides the mean over the whole session, the mean over its second half is
+reported as the steady state, once the first, uncached prompt and the
+context window's first moves are behind.
+
+Runs against fake_ollama, which evaluates only what follows the prefix a
+prompt shares with the previous one and charges `--prompt-delay` seconds per
+1000 of those tokens, or against a real server with --host and --model.
+
+    python benchmarks/bench_prompt_cache.py [--generations 100] [--json results.json]
+    python benchmarks/bench_prompt_cache.py --host localhost:11434 --model llama3
+"""
+import sys
+import json
+import argparse
+from statistics import mean
+
+from common import REPO_DIR, sample_text, start_fake_ollama
+
+MODES = ('generate', 'chat')
+SUMMARY_EVERY = 8  # Generations between rolling summary refreshes
+PASSAGES = 3
+
+
+def run(generations, tokens, prompt_delay, host=None, model=None):
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    from ai_writer_core import DEFAULT_CONTEXT_CHARS, OllamaClient, Generation, stable_context_start
+
+    server = None
+    if host is None:
+        server = start_fake_ollama(token_delay=0.002, prompt_delay=prompt_delay, tokens=tokens)
+        host, model = server.url, server.models[0]
+    client = OllamaClient(host)
+    start_text = sample_text(3000)
+    typed = sample_text(40).strip()
+    results = []
+    try:
+        for passage_count, mode in [(0, mode) for mode in MODES] + [(PASSAGES, mode) for mode in MODES]:
+            chat = mode == "chat"
+            text = start_text
+            paragraphs = start_text.split("\n")
+            summary = None
+            counts, first_tokens = [], []
+            for step in range(generations):
+                text += " " + typed
+                if step % SUMMARY_EVERY == 0:
+                    summary = f"Summary {step // SUMMARY_EVERY}: " + " ".join(paragraphs[:step // SUMMARY_EVERY + 4])[:1200]
+                if chat:
+                    context = text[stable_context_start(len(text), DEFAULT_CONTEXT_CHARS):]
+                else:
+                    context = text[-DEFAULT_CONTEXT_CHARS:]
+                # The last paragraph changes with every generation, and with it the retrieved passages
+                first = step * 7 % (len(paragraphs) - passage_count)
+                passages = [(i, paragraphs[i]) for i in range(first, first + passage_count)]
+                stats = {}
+                generation = Generation(model, prompt="", context=context, token_limit=tokens,
+                                        memory_summary=summary, client=client, retriever=lambda: passages,
+                                        seed=step + 1, chat=chat, on_stats=stats.update)
+                text += generation.run()
+                counts.append(stats.get('prompt_eval_count') or 0)
+                first_tokens.append(stats.get('first_token_s') or 0.0)
+            results.append({'name': f"{mode}+retrieval" if passage_count else mode, 'generations': generations,
+                            'mean_prompt_eval_count': mean(counts), 'total_prompt_eval_count': sum(counts),
+                            'steady_prompt_eval_count': mean(counts[generations // 2:]),
+                            'first_token_ms': mean(first_tokens) * 1000})
+            if server is not None:
+                server.prompt_cache.clear()
+    finally:
+        client.close()
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--generations", type=int, default=100, help="generations per mode (at least 2)")
+    parser.add_argument("--tokens", type=int, default=60, help="tokens per generation")
+    parser.add_argument("--prompt-delay", type=float, default=0.2,
+                        help="fake server seconds per 1000 evaluated prompt tokens")
+    parser.add_argument("--host", help="real Ollama server instead of fake_ollama")
+    parser.add_argument("--model", help="model to use with --host")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.host and not args.model:
+        parser.error("--host needs --model")
+    if args.generations < 2:
+        parser.error("--generations must be at least 2")
+
+    host = args.host and (args.host if "://" in args.host else f"http://{args.host}")
+    results = run(args.generations, args.tokens, args.prompt_delay, host, args.model)
+    for result in results:
+        print(f"{result['name']:<18} prompt tokens evaluated: mean {result['mean_prompt_eval_count']:7.1f}  "
+              f"steady {result['steady_prompt_eval_count']:7.1f}  total {result['total_prompt_eval_count']:7d}  "
+              f"first token {result['first_token_ms']:6.1f} ms")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'prompt_cache', 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
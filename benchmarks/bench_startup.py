@@ -0,0 +1,121 @@
+"""Cold start time of the application.
+
+Launches "ai writer.py --startup-report" several times (offscreen, against
+fake_ollama) and reports the median of each startup
+milestone: module loaded, window built, first paint (the editor is usable)
+and models listed (Generate is usable), plus the wall-clock time from spawning
+the process until the report arrives. A second pass runs the import under
+`python -X importtime` and lists the most expensive top-level imports, so a new
+eager import shows up as a regression here.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 12] [--json results.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+from statistics import median
+
+import fake_ollama
+from common import REPO_DIR, APP_PATH
+
+REPORT_LINE = re.compile(r"\[startup\]\s+([\d.]+) ms\s+(.+)")
+LAST_MILESTONE = "models listed"
+
+
+def launch_once(env, timeout):
+    """Start the app once and return ({milestone: ms}, wall-clock ms until the report arrived)"""
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, APP_PATH, "--startup-report"], cwd=REPO_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    killer = threading.Timer(timeout, proc.kill)
+    killer.start()
+    marks, wall = {}, None
+    try:
+        for line in proc.stderr:
+            match = REPORT_LINE.match(line.strip())
+            if not match:
+                continue
+            name = match.group(2)
+            marks[name] = float(match.group(1))
+            if name == LAST_MILESTONE:
+                wall = (time.perf_counter() - started) * 1000
+                break
+    finally:
+        killer.cancel()
+        proc.kill()
+        proc.wait()
+    return marks, wall
+
+
+def import_costs(env, top):
+    """Top-level imports of the app ranked by cumulative time, from -X importtime"""
+    loader = ("import importlib.util, sys; sys.path.insert(0, '.'); "
+              f"spec = importlib.util.spec_from_file_location('app', {APP_PATH!r}); "
+              "spec.loader.exec_module(importlib.util.module_from_spec(spec))")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", loader], cwd=REPO_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    costs = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit() or name.startswith("  "):
+            continue  # header line or nested import
+        name = name.strip()
+        costs[name] = costs.get(name, 0) + int(cumulative) / 1000
+    return sorted(costs.items(), key=lambda item: -item[1])[:top]
+
+
+def run(runs, top, timeout):
+    """Median startup milestones over `runs` launches, and the `top` slowest imports"""
+    server = fake_ollama.start(token_delay=0)
+    env = dict(os.environ, QT_QPA_PLATFORM="offscreen", OLLAMA_HOST=server.url,
+               AI_WRITER_CACHE_DIR=tempfile.mkdtemp(prefix="ai_writer_bench_"))
+    try:
+        launches = [launch_once(env, timeout) for _ in range(runs)]
+    finally:
+        server.shutdown()
+    results = {}
+    for name in launches[0][0]:
+        times = [marks[name] for marks, _ in launches if name in marks]
+        results[name] = {'ms': median(times), 'runs': len(times)}
+    walls = [wall for _, wall in launches if wall is not None]
+    if walls:
+        results['launch to ready'] = {'ms': median(walls), 'runs': len(walls)}
+    imports = [{'module': name, 'ms': ms} for name, ms in import_costs(env, top)]
+    return results, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="launches to take the median over")
+    parser.add_argument("--top", type=int, default=12, help="imports listed in the import report")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a launch is abandoned")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results, imports = run(args.runs, args.top, args.timeout)
+    print(f"median of {args.runs} launches")
+    for name, result in results.items():
+        note = "  (wall clock incl. interpreter start)" if name == 'launch to ready' else ""
+        print(f"{name:<22}{result['ms']:>9.1f} ms{note}")
+    if 'launch to ready' not in results:
+        print(f"warning: '{LAST_MILESTONE}' was never reported", file=sys.stderr)
+
+    print("\nslowest top-level imports (cumulative)")
+    for item in imports:
+        print(f"{item['ms']:9.1f} ms  {item['module']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({'benchmark': 'startup', 'results': results, 'imports': imports}, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
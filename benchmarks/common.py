@@ -0,0 +1,100 @@
+"""Shared helpers for the benchmark scripts.
+
+The application lives in "ai writer.py", which cannot be imported by name, so it
+is loaded from its path. Benchmarks run Qt with the offscreen platform unless a
+platform is already set, and keep their caches in a temporary directory so they
+neither read nor disturb the user's.
+"""
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import importlib.util
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "ai writer.py")
+
+_app_module = None
+_qt_app = None
+
+
+def load_app():
+    """Import "ai writer.py" once and return it as a module"""
+    global _app_module
+    if _app_module is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        os.environ.setdefault("AI_WRITER_CACHE_DIR", tempfile.mkdtemp(prefix="ai_writer_bench_"))
+        if REPO_DIR not in sys.path:
+            sys.path.insert(0, REPO_DIR)  # for ai_writer_core
+        spec = importlib.util.spec_from_file_location("ai_writer_app", APP_PATH)
+        _app_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(_app_module)
+    return _app_module
+
+
+def qt_app():
+    """Return the QApplication, creating it on first use (a reference is kept alive here)"""
+    global _qt_app
+    from PyQt5.QtWidgets import QApplication
+    if _qt_app is None:
+        _qt_app = QApplication.instance() or QApplication(sys.argv[:1])
+    return _qt_app
+
+
+def start_fake_ollama(**settings):
+    """Start a fake_ollama server and point the app (loaded or not) at it"""
+    import fake_ollama
+    server = fake_ollama.start(**settings)
+    os.environ["OLLAMA_HOST"] = server.url
+    core = sys.modules.get("ai_writer_core")
+    if core is not None:
+        core._shared_client = core.BackendPool([server.url])
+    return server
+
+
+def make_window(scan=False):
+    """Create a MainWindow; without `scan` it does not contact Ollama on startup"""
+    app_module = load_app()
+    qt_app()
+    window = app_module.MainWindow()
+    if not scan:
+        window.background_started = True  # Skips the model scan, model load and /api/ps polling
+    window.show()
+    return window
+
+
+def wait_until(condition, timeout=30):
+    """Process Qt events until `condition()` is true; returns whether it became true"""
+    app = qt_app()
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            return False
+        app.processEvents()
+        time.sleep(0.001)
+    return True
+
+
+def git_revision():
+    """Commit hash of the working tree, with "-dirty" when it has uncommitted changes"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True,
+                                capture_output=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               text=True, capture_output=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("-dirty" if dirty else "")
+
+
+def sample_text(words, words_per_paragraph=120):
+    """Deterministic prose-like text with the given number of words"""
+    vocabulary = ("the night was cold and the rain kept falling on the old city while "
+                  "she walked home thinking about the letter he had never sent").split()
+    out = []
+    for i in range(words):
+        out.append(vocabulary[(i * 7 + i // 13) % len(vocabulary)])
+        if (i + 1) % words_per_paragraph == 0:
+            out.append("\n")
+    return " ".join(out).replace(" \n ", "\n")
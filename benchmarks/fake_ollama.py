@@ -0,0 +1,373 @@
+"""A local stand-in for the Ollama HTTP API, for benchmarks and offline testing.
+
+Three modes:
+
+* synthetic (default): answers /api/tags, /api/ps, /api/show, /api/embed,
+  /api/generate and /api/chat (streaming and non-streaming) with deterministic
+  text. Each token takes `token_delay` seconds and the first one additionally
+  `prompt_delay` per 1000 evaluated prompt tokens, so time-to-first-token and
+  decoding speed can be dialled in. Like Ollama, the server remembers the
+  last prompt per model and only evaluates (and counts in prompt_eval_count)
+  what follows the prefix a new prompt shares with it.
+* record: forwards every request to a real Ollama (`--upstream`) and appends
+  the request and the timed response lines to a JSONL session file.
+* replay: serves a recorded session file, reproducing the recorded gaps
+  between streamed lines (scaled by `--speed`). Requests are matched by their
+  exact body first, then by path in recorded order.
+
+    python benchmarks/fake_ollama.py --port 11434 --token-delay 0.02
+    python benchmarks/fake_ollama.py --port 11435 --record session.jsonl --upstream localhost:11434
+    python benchmarks/fake_ollama.py --port 11434 --replay session.jsonl
+
+From Python, `start()` runs a server on a free port in a background thread.
+"""
+import sys
+import json
+import socket
+import time
+import hashlib
+import argparse
+import threading
+from collections import defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ("the night was cold and the rain kept falling on the old city while she walked home "
+         "thinking about the letter he had never sent").split()
+
+
+def request_key(method, path, body):
+    return hashlib.sha1(json.dumps([method, path, body], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def render_prompt(body):
+    """The prompt text as a model would see it: chat messages go through a simple template"""
+    if 'messages' in body:
+        return "".join(f"<|{m.get('role')}|>\n{m.get('content')}\n" for m in body['messages']) + "<|assistant|>\n"
+    return body.get('prompt') or ""
+
+
+def common_prefix_length(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOllama/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    # --- plumbing ---
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def send_json(self, obj, status=200):
+        data = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_stream(self, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.dispatch("GET", {})
+
+    def do_POST(self):
+        self.dispatch("POST", self.read_body())
+
+    def dispatch(self, method, body):
+        server = self.server
+        server.count(self.path)
+        try:
+            if server.upstream:
+                self.proxy(method, body)
+            elif server.replay is not None:
+                self.replay(method, body)
+            else:
+                self.synthetic(method, body)
+        except (BrokenPipeError, ConnectionResetError):
+            server.count("aborted")
+
+    # --- synthetic ---
+    def synthetic(self, method, body):
+        server = self.server
+        if self.path == "/api/tags":
+            self.send_json({'models': [{'name': name, 'model': name} for name in server.models]})
+        elif self.path == "/api/ps":
+            with server.lock:
+                loaded = list(server.loaded)
+            self.send_json({'models': [{'name': name, 'model': name, 'size_vram': 4 * 1024 ** 3,
+                                        'expires_at': "2099-01-01T00:00:00Z"} for name in loaded]})
+        elif self.path == "/api/show":
+            self.send_json({'model_info': {'general.architecture': "llama",
+                                           'llama.context_length': server.context_length},
+                            'parameters': ""})
+        elif self.path in ("/api/embed", "/api/embeddings"):
+            texts = body.get('input') or body.get('prompt') or ""
+            texts = [texts] if isinstance(texts, str) else texts
+            vectors = [[b / 255.0 for b in hashlib.sha256(text.encode('utf-8')).digest()[:16]] for text in texts]
+            if self.path == "/api/embed":
+                self.send_json({'embeddings': vectors})
+            else:
+                self.send_json({'embedding': vectors[0]})
+        elif self.path in ("/api/generate", "/api/chat"):
+            self.generate(body, chat=self.path == "/api/chat")
+        else:
+            self.send_json({'error': f"unknown endpoint {self.path}"}, 404)
+
+    def generate(self, body, chat=False):
+        server = self.server
+        model = body.get('model')
+        if model not in server.models:
+            self.send_json({'error': f"model '{model}' not found"}, 404)
+            return
+        with server.lock:
+            server.loaded.add(model)
+        if not body.get('prompt') and not body.get('context') and not body.get('messages'):
+            # An empty prompt only loads the model
+            self.send_json({'model': model, 'response': "", 'done': True, 'done_reason': "load"})
+            return
+
+        started = time.perf_counter()
+        options = body.get('options') or {}
+        tokens = options.get('num_predict', server.tokens)
+        if tokens is None or tokens < 0:
+            tokens = server.tokens
+        prompt = render_prompt(body)
+        prompt_tokens = max(1, len(prompt) // 4) + len(body.get('context') or [])
+        with server.lock:
+            cached = common_prefix_length(server.prompt_cache.get(model, ""), prompt)
+            server.prompt_cache[model] = prompt
+        evaluated = max(1, prompt_tokens - cached // 4)
+        prompt_delay = server.prompt_delay * evaluated / 1000
+        seed = options.get('seed') or 0
+        words = [" " + WORDS[(seed + i * 7) % len(WORDS)] for i in range(tokens)]
+
+        def final_fields():
+            total = time.perf_counter() - started
+            fields = {
+                'model': model, 'done': True, 'done_reason': "length",
+                'total_duration': int(total * 1e9), 'load_duration': 1000000,
+                'prompt_eval_count': evaluated, 'prompt_eval_duration': int(prompt_delay * 1e9),
+                'eval_count': tokens, 'eval_duration': int(max(0.0, total - prompt_delay) * 1e9),
+            }
+            if not chat:
+                fields['context'] = list(range(prompt_tokens + tokens))
+            return fields
+
+        def text_fields(text):
+            return {'message': {'role': "assistant", 'content': text}} if chat else {'response': text}
+
+        if not body.get('stream', True):
+            time.sleep(prompt_delay + server.token_delay * tokens)
+            self.send_json(dict(final_fields(), **text_fields("".join(words))))
+            return
+
+        self.start_stream()
+        time.sleep(prompt_delay)
+        for word in words:
+            time.sleep(server.token_delay)
+            self.send_chunk(json.dumps(dict(model=model, done=False, **text_fields(word))).encode() + b"\n")
+        self.send_chunk(json.dumps(dict(final_fields(), **text_fields(""))).encode() + b"\n")
+        self.end_stream()
+
+    # --- record ---
+    def proxy(self, method, body):
+        import requests
+        server = self.server
+        started = time.perf_counter()
+        response = requests.request(method, f"{server.upstream}{self.path}", json=body if method == "POST" else None,
+                                    stream=True, timeout=(5, 600))
+        streamed = response.headers.get("Transfer-Encoding") == "chunked"
+        lines = []
+        if streamed:
+            self.start_stream(response.status_code)
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                lines.append([time.perf_counter() - started, line.decode('utf-8')])
+                self.send_chunk(line + b"\n")
+            self.end_stream()
+        else:
+            content = response.content
+            lines.append([time.perf_counter() - started, content.decode('utf-8')])
+            self.send_response(response.status_code)
+            self.send_header("Content-Type", response.headers.get("Content-Type", "application/json"))
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        server.record({'method': method, 'path': self.path, 'body': body, 'status': response.status_code,
+                       'streamed': streamed, 'lines': lines})
+
+    # --- replay ---
+    def replay(self, method, body):
+        session = self.server.find_session(method, self.path, body)
+        if session is None:
+            self.send_json({'error': f"no recorded response for {method} {self.path}"}, 404)
+            return
+        speed = self.server.speed
+        started = time.perf_counter()
+        if not session.get('streamed'):
+            time.sleep(session['lines'][0][0] / speed if session['lines'] else 0)
+            data = session['lines'][0][1].encode('utf-8') if session['lines'] else b""
+            self.send_response(session['status'])
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.start_stream(session['status'])
+        for offset, line in session['lines']:
+            delay = offset / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            self.send_chunk(line.encode('utf-8') + b"\n")
+        self.end_stream()
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """The server; settings can be changed while it runs"""
+    daemon_threads = True
+
+    def __init__(self, port=0, models=("bench:latest",), token_delay=0.01, prompt_delay=0.0,
+                 tokens=100, context_length=8192, upstream=None, record_path=None,
+                 replay_path=None, speed=1.0):
+        super().__init__(("127.0.0.1", port), FakeOllamaHandler)
+        self.models = list(models)
+        self.token_delay = token_delay
+        self.prompt_delay = prompt_delay
+        self.tokens = tokens
+        self.context_length = context_length
+        self.upstream = upstream and (upstream if "://" in upstream else f"http://{upstream}").rstrip("/")
+        self.record_path = record_path
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.loaded = set()
+        self.prompt_cache = {}  # model -> last prompt evaluated, for prefix reuse
+        self.requests = defaultdict(int)  # path (or "aborted") -> count
+        self.replay = None
+        self.connections = set()  # Open client sockets, so stop() can drop them
+        if replay_path:
+            self.load_replay(replay_path)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # A client closing an idle keep-alive connection (or stop() cutting it) is not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request):
+        with self.lock:
+            self.connections.discard(request)
+        super().shutdown_request(request)
+
+    def stop(self):
+        """Go away like a killed server: stop listening and cut every open keep-alive connection"""
+        self.shutdown()
+        self.server_close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] += 1
+
+    def record(self, session):
+        with self.lock:
+            with open(self.record_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(session) + "\n")
+
+    def load_replay(self, path):
+        self.replay = {'exact': defaultdict(deque), 'path': defaultdict(deque)}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    session = json.loads(line)
+                    key = request_key(session['method'], session['path'], session['body'])
+                    self.replay['exact'][key].append(session)
+                    self.replay['path'][(session['method'], session['path'])].append(session)
+
+    def find_session(self, method, path, body):
+        with self.lock:
+            for queue, key in ((self.replay['exact'], request_key(method, path, body)),
+                               (self.replay['path'], (method, path))):
+                if queue[key]:
+                    session = queue[key][0]
+                    queue[key].rotate(-1)  # Cycle so long benchmarks can reuse a short recording
+                    return session
+        return None
+
+
+def start(**settings):
+    """Run a FakeOllama on a free port (or `port`) in a daemon thread and return it (call .stop() to kill it)"""
+    server = FakeOllama(**settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--models", default="bench:latest", help="comma separated model names")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="seconds per generated token")
+    parser.add_argument("--prompt-delay", type=float, default=0.0, help="seconds per 1000 prompt tokens")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens when num_predict isn't set")
+    parser.add_argument("--context-length", type=int, default=8192, help="reported by /api/show")
+    parser.add_argument("--record", help="append requests and responses to this JSONL file")
+    parser.add_argument("--upstream", help="real Ollama to forward to while recording")
+    parser.add_argument("--replay", help="serve responses from a recorded JSONL file")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    args = parser.parse_args()
+    if bool(args.record) != bool(args.upstream):
+        parser.error("--record and --upstream go together")
+
+    server = FakeOllama(args.port, args.models.split(","), args.token_delay, args.prompt_delay, args.tokens,
+                        args.context_length, args.upstream, args.record, args.replay, args.speed)
+    mode = "recording" if args.record else "replaying" if args.replay else "synthetic"
+    print(f"Fake Ollama ({mode}) on {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""Run every benchmark and write one JSON file per commit, optionally compared with another.
+
+Keystroke latency, generation latency/stalls, the large-manuscript, export and import timings
+and the prompt tokens evaluated per generation run in this process against fake_ollama; startup
+runs in subprocesses. The output file records the git revision, Python and Qt versions and the
+platform next to the results, so runs from different commits can be compared:
+
+    python benchmarks/run_suite.py                        # writes bench-<commit>.json
+    python benchmarks/run_suite.py --compare bench-1a2b3c4.json
+    python benchmarks/run_suite.py --quick --skip startup
+"""
+import sys
+import json
+import time
+import argparse
+import platform
+
+import bench_keystrokes
+import bench_generation
+import bench_large_document
+import bench_export
+import bench_import
+import bench_prompt_cache
+import bench_startup
+from common import git_revision
+
+BENCHMARKS = ("keystrokes", "generation", "large_document", "export", "import", "prompt_cache", "startup")
+LARGE_DOCUMENT_CASES = ('scroll', 'type_end', 'type_middle', 'prepare', 'insert')
+
+
+def run_suite(args):
+    suite = {}
+    if "keystrokes" not in args.skip:
+        print("keystrokes...", file=sys.stderr)
+        suite['keystrokes'] = bench_keystrokes.run(args.sizes, 50 if args.quick else 200)
+    if "generation" not in args.skip:
+        print("generation...", file=sys.stderr)
+        suite['generation'] = bench_generation.run(args.sizes[:2] if args.quick else args.sizes,
+                                                   1 if args.quick else 3, args.tokens, args.token_delay, 0.0,
+                                                   args.replay)
+    if "large_document" not in args.skip:
+        print("large document...", file=sys.stderr)
+        results = bench_large_document.run(2 if args.quick else 10, 50 if args.quick else 100)
+        opened = {key: value for key, value in results.items() if key not in LARGE_DOCUMENT_CASES}
+        suite['large_document'] = [dict(opened, name="open")] + [
+            dict(results[case], name=case) for case in LARGE_DOCUMENT_CASES]
+    if "export" not in args.skip:
+        print("export...", file=sys.stderr)
+        suite['export'] = bench_export.run(2 if args.quick else 10)
+    if "import" not in args.skip:
+        print("import...", file=sys.stderr)
+        suite['import'] = bench_import.run(2 if args.quick else 10)
+    if "prompt_cache" not in args.skip:
+        print("prompt cache...", file=sys.stderr)
+        suite['prompt_cache'] = bench_prompt_cache.run(10 if args.quick else 30, args.tokens, 0.2)
+    if "startup" not in args.skip:
+        print("startup...", file=sys.stderr)
+        results, imports = bench_startup.run(2 if args.quick else 5, 12, 30)
+        suite['startup'] = [dict(result, name=name) for name, result in results.items()]
+        suite['imports'] = imports
+    return suite
+
+
+def metrics(suite):
+    """Flatten results to {"benchmark / case / metric": value} for every *_ms and *_count figure"""
+    flat = {}
+    for benchmark in BENCHMARKS:
+        for result in suite.get(benchmark, []):
+            case = result.get('name') or f"{result.get('words')}w"
+            for key, value in result.items():
+                if (key == 'ms' or key.endswith(('_ms', '_count'))) and isinstance(value, (int, float)):
+                    flat[f"{benchmark} / {case} / {key}"] = value
+    return flat
+
+
+def compare(baseline, current):
+    """Print every metric of both runs side by side with the relative change"""
+    old, new = metrics(baseline['suite']), metrics(current['suite'])
+    print(f"\n{'':<58}{baseline['revision'] or '?':>16}{current['revision'] or '?':>16}")
+    for key in new:
+        if key not in old:
+            continue
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+        print(f"{key:<58}{old[key]:>16.2f}{new[key]:>16.2f}  {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-o", "--output", help="result file (default bench-<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma separated document sizes in words")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per generation")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="fake server seconds per token")
+    parser.add_argument("--replay", help="recorded Ollama session for the generation benchmark")
+    parser.add_argument("--skip", action="append", default=[], choices=BENCHMARKS)
+    parser.add_argument("--quick", action="store_true", help="fewer repetitions, for a smoke test")
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+
+    from PyQt5.QtCore import QT_VERSION_STR
+    revision = git_revision()
+    report = {
+        'revision': revision,
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'qt': QT_VERSION_STR,
+        'platform': platform.platform(),
+        'settings': {'sizes': args.sizes, 'tokens': args.tokens, 'token_delay': args.token_delay,
+                     'replay': args.replay, 'quick': args.quick},
+        'suite': run_suite(args),
+    }
+    output = args.output or f"bench-{revision or 'unknown'}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import threading
+
+import pytest
+
+import fake_ollama
+from ai_writer_core import BackendPool
+
+MODEL = "bench:latest"
+
+
+@pytest.fixture
+def servers():
+    started = [fake_ollama.start(token_delay=0.005, tokens=20) for _ in range(3)]
+    yield started
+    for server in started:
+        server.stop()
+
+
+def generate(pool, prompt):
+    response = pool.post("/api/generate", json={"model": MODEL, "prompt": prompt, "stream": False})
+    assert response.status_code == 200
+    return response.json()
+
+
+def served(server):
+    return server.requests["/api/generate"]
+
+
+def test_requests_fail_over_to_the_hosts_still_up(servers):
+    pool = BackendPool([server.url for server in servers], slots=1)
+    try:
+        assert pool.list_models() == [MODEL]
+        for i in range(3):
+            generate(pool, f"warm {i}")
+        assert served(servers[0]) == 3  # The model's last host is preferred, over a keep-alive connection
+        servers[0].stop()
+
+        for i in range(4):
+            generate(pool, f"after {i}")
+        status = {url: (healthy, error) for url, healthy, _, error in pool.status()}
+        healthy, error = status[servers[0].url]
+        assert not healthy and error
+        assert all(status[server.url] == (True, None) for server in servers[1:])
+        assert served(servers[1]) + served(servers[2]) == 4
+    finally:
+        pool.close()
+
+
+def test_probe_brings_a_restarted_host_back(servers):
+    pool = BackendPool([server.url for server in servers[:2]], slots=1)
+    try:
+        pool.probe()
+        port = servers[0].server_address[1]
+        servers[0].stop()
+        pool.probe()
+        assert [healthy for _, healthy, _, _ in pool.status()] == [False, True]
+        assert pool.list_models() == [MODEL]  # From the host that is still up
+
+        servers[0] = fake_ollama.start(port=port, token_delay=0.005, tokens=20)
+        pool.probe()
+        assert [healthy for _, healthy, _, _ in pool.status()] == [True, True]
+        # Two requests at once need both hosts again
+        threads = [threading.Thread(target=generate, args=(pool, f"both {i}")) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert served(servers[0]) == 1 and served(servers[1]) == 1
+    finally:
+        pool.close()
+
+
+def test_each_host_runs_at_most_its_slots(servers):
+    pool = BackendPool([server.url for server in servers[:2]], slots=1)
+    busiest = {}
+    running = threading.Event()
+    running.set()
+
+    def watch():
+        while running.is_set():
+            for url, _, active, _ in pool.status():
+                busiest[url] = max(busiest.get(url, 0), active)
+
+    try:
+        pool.probe()
+        watcher = threading.Thread(target=watch)
+        watcher.start()
+        threads = [threading.Thread(target=generate, args=(pool, f"slot {i}")) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        running.clear()
+        watcher.join()
+
+        assert busiest == {servers[0].url: 1, servers[1].url: 1}
+        assert served(servers[0]) == 3 and served(servers[1]) == 3
+        assert pool.queue_status()['waiting'] == 0
+    finally:
+        pool.close()
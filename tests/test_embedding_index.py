@@ -0,0 +1,98 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from ai_writer_core import EmbeddingIndex, HashingEmbeddingBackend
+
+TEXT = ("The lighthouse keeper counted the ships every evening.\n"
+        "A storm rolled in from the north before anyone noticed.\n"
+        "Mara found the letter hidden under the kitchen floorboards.\n"
+        "The harbour bells rang out across the water at midnight.")
+
+
+class CountingBackend(HashingEmbeddingBackend):
+    """HashingEmbeddingBackend that remembers which texts it was asked to embed"""
+
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def embed(self, texts):
+        self.embedded.extend(texts)
+        return super().embed(texts)
+
+
+def test_update_only_embeds_new_paragraphs():
+    backend = CountingBackend()
+    index = EmbeddingIndex()
+    assert index.update(TEXT, backend) == 4
+    backend.embedded.clear()
+
+    edited = TEXT.replace("A storm rolled in", "A gale rolled in") + "\nThe tide went out and left the fishing boats on the sand."
+    assert index.update(edited, backend) == 2
+    assert backend.embedded == ["A gale rolled in from the north before anyone noticed.", "The tide went out and left the fishing boats on the sand."]
+    assert len(index) == 5
+    assert index.update(edited, backend) == 0
+
+
+def test_search_finds_the_closest_paragraph():
+    backend = HashingEmbeddingBackend()
+    index = EmbeddingIndex()
+    index.update(TEXT, backend)
+    results = index.search_text(backend, "letter under the floorboards", k=1)
+    assert results[0][1] == "Mara found the letter hidden under the kitchen floorboards."
+
+
+def test_search_before_offset_excludes_later_passages_of_the_same_source():
+    backend = HashingEmbeddingBackend()
+    index = EmbeddingIndex()
+    index.update(TEXT, backend)
+    index.update("Nobody else ever read the letter under the floorboards.", backend, source="chapter-2")
+    offset = TEXT.index("Mara")
+
+    results = [text for _, text in index.search_text(backend, "letter under the floorboards", k=5,
+                                                       before_offset=offset)]
+    assert "Mara found the letter hidden under the kitchen floorboards." not in results
+    assert "The harbour bells rang out across the water at midnight." not in results
+    assert "Nobody else ever read the letter under the floorboards." in results  # Other sources always qualify
+
+    results = [text for _, text in index.search_text(backend, "letter under the floorboards", k=5,
+                                                       before_offset=10, source="chapter-2")]
+    assert "Mara found the letter hidden under the kitchen floorboards." in results
+    assert "Nobody else ever read the letter under the floorboards." not in results
+
+
+def test_save_and_load_round_trip(tmp_path):
+    backend = HashingEmbeddingBackend()
+    path = str(tmp_path / "book.embeddings.npz")
+    index = EmbeddingIndex(path)
+    index.update(TEXT, backend, signature=[1, 2])
+    index.update("A second chapter begins on the morning after the storm.", backend, source="chapter-2", signature=[3, 4])
+    index.save()
+
+    loaded = EmbeddingIndex(path)
+    assert len(loaded) == len(index)
+    assert loaded.backend_name == backend.name
+    assert loaded.is_current("chapter-2", [3, 4], backend)
+    assert loaded.search_text(backend, "harbour bells", k=2) == index.search_text(backend, "harbour bells", k=2)
+
+    counting = CountingBackend()
+    assert loaded.update(TEXT, counting, signature=[1, 2]) == 0
+    assert counting.embedded == []
+
+
+def test_update_from_pieces_matches_the_joined_text():
+    backend = HashingEmbeddingBackend()
+    whole = EmbeddingIndex()
+    whole.update(TEXT, backend)
+    lines = TEXT.split("\n")
+    pieced = EmbeddingIndex()
+    assert pieced.update(iter(["\n".join(lines[:1]), "", "\n".join(lines[1:])]), backend) == 4
+
+    joined = "\n".join(lines[:1]) + "\n\n" + "\n".join(lines[1:])
+    expected = EmbeddingIndex()
+    expected.update(joined, backend)
+    assert pieced.state['hashes'] == expected.state['hashes']
+    assert list(pieced.state['ends']) == list(expected.state['ends'])
+    assert (pieced.state['matrix'] == expected.state['matrix']).all()
+    assert pieced.state['hashes'] == whole.state['hashes']
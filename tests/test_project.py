@@ -0,0 +1,32 @@
+from ai_writer_core import Project
+
+BOOK = "# One\nalpha\n# Two\nbeta\n# Three\ngamma\n"
+
+
+def make_book(tmp_path, text=BOOK):
+    path = tmp_path / "book.md"
+    path.write_text(text, encoding="utf-8")
+    return Project(str(path))
+
+
+def test_write_without_trailing_newline_keeps_next_heading(tmp_path):
+    project = make_book(tmp_path)
+    project.write(project.chapters[0], "# One\nalpha edited")
+    assert [chapter.title for chapter in project.chapters] == ["One", "Two", "Three"]
+    assert project.read(project.chapters[1]).startswith("# Two")
+    project.scan()
+    assert [chapter.title for chapter in project.chapters] == ["One", "Two", "Three"]
+    assert (tmp_path / "book.md").read_text(encoding="utf-8") == "# One\nalpha edited\n# Two\nbeta\n# Three\ngamma\n"
+
+
+def test_write_keeps_offsets_of_later_chapters(tmp_path):
+    project = make_book(tmp_path)
+    project.write(project.chapters[1], "# Two\nbeta, much longer now\n")
+    assert [project.read(chapter) for chapter in project.chapters] == \
+        ["# One\nalpha\n", "# Two\nbeta, much longer now\n", "# Three\ngamma\n"]
+
+
+def test_write_last_chapter_is_not_padded(tmp_path):
+    project = make_book(tmp_path)
+    project.write(project.chapters[2], "# Three\ngamma edited")
+    assert (tmp_path / "book.md").read_text(encoding="utf-8").endswith("# Three\ngamma edited")